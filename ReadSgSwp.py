@@ -6,6 +6,9 @@ from os.path import getsize
 from numpy import median
 import numpy as np
 
+from .packet_reader import packet_array, check_packets, forward_fill_sync, _decode_iq
+from .packet_reader import HEADER_DATA, HEADER_SYNC, HEADER_SGSYNC
+
 class PacketError(Exception):
     def __init__(self, key):
         super().__init__(key)
@@ -18,6 +21,71 @@ class PacketType(Enum):
     SYNC  = 1
     SGSWP = 2
 
+def get_packet_size(_path):
+    ret = []
+    offset = 0
+    _f = open(_path, 'rb')
+    buff = _f.read(2**12)
+    _f.close()
+    try:
+        if buff[0] in  [0xaa, 0xff]: ret += [0]
+        else: raise PacketError('get-packet-size : header')
+    except PacketError as _e:
+        _e.print()
+        pass
+    while True:
+        _p = buff.find(0xee) ## 0xee = footer
+        if _p == len(buff) - 1: break
+        if _p == -1: break
+        buff = buff[_p+1:]
+        offset += _p+1
+        if buff[0] in [0xff, 0xf5, 0xaa]: ret += [offset]
+        pass
+    ret_diff = []
+    _p = ret[0]
+    for _n in ret[1:]:
+        ret_diff += [_n - _p]
+        _p = _n
+        pass
+    return int(median(ret_diff))
+
+def read_header(buff, ch_num):
+    '''Decode the 0xaa header packet of an SG-sweep file.
+
+    Returns
+    -------
+    rate : int
+    freqs : list of int
+        Tone frequencies of the channels.
+    f_start, f_stop : int
+        SG sweep range in MHz.
+    f_step : float
+        SG step in MHz.
+    '''
+    rate = (unpack('b', buff[1:2])[0] << (8 * 4)) + unpack('>I', buff[2:6])[0]
+    f_start = unpack('>H', buff[6 + 7 + 1 : 6 + 7 + 3])[0] # MHz
+    f_stop  = unpack('>H', buff[6 + 7 + 3 : 6 + 7 + 5])[0] # MHz
+    f_step  = unpack('>H', buff[6 + 7 + 5 : 6 + 7 + 7])[0] # kHz
+    f_step  = float(f_step / 1000.) # kHz -> MHz
+    freqs = []
+    for i in range(ch_num):
+        f_1 = unpack('b', buff[6 + 7 * 2*i     : 6 + 7 * 2*i + 1])[0]
+        f_2 = unpack('>H', buff[6 + 7 * 2*i + 1 : 6 + 7 * 2*i + 3])[0]
+        f_3 = unpack('>I', buff[6 + 7 * 2*i + 3 : 6 + 7 * 2*i + 7])[0]
+        freqs.append((f_1 << (8 * 6)) + (f_2 << (8 * 4)) + f_3)
+        pass
+    return rate, freqs, f_start, f_stop, f_step
+
+def swp_period(f_start, f_stop, f_step):
+    '''Value of swp_cnt at which the SG goes back to f_start (None if never).'''
+    if f_step == 0:
+        return 0 if f_start == f_stop else None
+    guess = int(round((f_stop - f_start) / f_step))
+    for cnt in range(max(guess - 1, 0), guess + 2):
+        if f_start + cnt * f_step == f_stop:
+            return cnt
+    return None
+
 class ReadSgSwpFile():
     def __init__(self, _path, average=True):
         self._path    = _path
@@ -29,7 +97,8 @@ class ReadSgSwpFile():
         self.packet_size = self.get_packet_size()
         self.length = int(getsize(self._path)/self.packet_size)
         self.ch_num = int((self.packet_size - 7)/7/2)
-        self._f = open(self._path, 'rb')
+        self._packets = packet_array(np.memmap(self._path, dtype=np.uint8, mode='r'),
+                                     self.packet_size)
         self.ret = [dict() for i in range(self.ch_num)]
         self.f_start, self.f_stop, self.f_step = self.read_header()
         self.sg_freq = self.f_start + self.f_step
@@ -39,61 +108,33 @@ class ReadSgSwpFile():
             self.data_avr = self.IQ_averaging()
             pass
 
-    def __del__(self):
-        if not self._f.closed:
-            self._f.close()
-
     def __iter__(self):
         return self
 
     def __next__(self):
-        if self._i == self.length:
-            raise StopIteration()
-        self.buff = self._f.read(self.packet_size)
-        timestamp, data, ptype = self.read_packet()
-        self._i += 1
-        if ptype == PacketType.DATA:
-            return timestamp, data
-        elif ptype == PacketType.SYNC:
-            self.n_rotate = timestamp
-            self.sync_off = data[0]
-            return self.__next__()
-        elif ptype == PacketType.SGSWP:
-            self.sg_freq = self.f_start + self.swp_cnt * self.f_step
-            if self.sg_freq == self.f_stop:
-                self.swp_cnt = 0
-            else:
-                self.swp_cnt += 1
-            return timestamp, data
-        pass
-
-    def get_packet_size(self):
-        ret = []
-        offset = 0
-        _f = open(self._path, 'rb')
-        buff = _f.read(2**12)
-        _f.close()
-        try:
-            if buff[0] in  [0xaa, 0xff]: ret += [0]
-            else: raise PacketError('get-packet-size : header')
-        except PacketError as _e:
-            _e.print()
-            pass
         while True:
-            _p = buff.find(0xee) ## 0xee = footer
-            if _p == len(buff) - 1: break
-            if _p == -1: break
-            buff = buff[_p+1:]
-            offset += _p+1
-            if buff[0] in [0xff, 0xf5, 0xaa]: ret += [offset]
+            if self._i == self.length:
+                raise StopIteration()
+            self.buff = self._packets[self._i].tobytes()
+            timestamp, data, ptype = self.read_packet()
+            self._i += 1
+            if ptype == PacketType.DATA:
+                return timestamp, data
+            elif ptype == PacketType.SYNC:
+                self.n_rotate = timestamp
+                self.sync_off = data[0]
+                continue
+            elif ptype == PacketType.SGSWP:
+                self.sg_freq = self.f_start + self.swp_cnt * self.f_step
+                if self.sg_freq == self.f_stop:
+                    self.swp_cnt = 0
+                else:
+                    self.swp_cnt += 1
+                return timestamp, data
             pass
-        ret_diff = []
-        _p = ret[0]
-        for _n in ret[1:]:
-            ret_diff += [_n - _p]
-            _p = _n
-            pass
-        return int(median(ret_diff))
+
+    def get_packet_size(self):
+        return get_packet_size(self._path)
 
     def read_packet(self):
         buff = self.buff
@@ -120,17 +161,8 @@ class ReadSgSwpFile():
         return time, data, ptype
 
     def read_header(self):
-        buff = self._f.read(self.packet_size)
-        rate = (unpack('b', buff[1:2])[0] << (8 * 4)) + unpack('>I', buff[2:6])[0]
-        f_start = unpack('>H', buff[6 + 7 + 1 : 6 + 7 + 3])[0] # MHz
-        f_stop  = unpack('>H', buff[6 + 7 + 3 : 6 + 7 + 5])[0] # MHz
-        f_step  = unpack('>H', buff[6 + 7 + 5 : 6 + 7 + 7])[0] # kHz
-        f_step  = float(f_step / 1000.) # kHz -> MHz
-        for i in range(self.ch_num):
-            f_1 = unpack('b', buff[6 + 7 * 2*i     : 6 + 7 * 2*i + 1])[0]
-            f_2 = unpack('>H', buff[6 + 7 * 2*i + 1 : 6 + 7 * 2*i + 3])[0]
-            f_3 = unpack('>I', buff[6 + 7 * 2*i + 3 : 6 + 7 * 2*i + 7])[0]
-            freq = (f_1 << (8 * 6)) + (f_2 << (8 * 4)) + f_3
+        rate, freqs, f_start, f_stop, f_step = read_header(self._packets[0].tobytes(), self.ch_num)
+        for i, freq in enumerate(freqs):
             self.ret[i]['name'    ] = self._path.split('/')[-1]
             self.ret[i]['rate'    ] = float(rate)
             self.ret[i]['freq'    ] = float(freq)
@@ -148,17 +180,45 @@ class ReadSgSwpFile():
         self._i += 1
         return f_start, f_stop, f_step
 
+    def swp_period(self):
+        return swp_period(self.f_start, self.f_stop, self.f_step)
+
     def read_file(self):
-        for _ts, _d in self:
-            for i in range(self.ch_num):
-                self.ret[i]['time'    ].append(_ts)
-                self.ret[i]['n_rot'   ].append(self.n_rotate)
-                self.ret[i]['sync_off'].append(self.sync_off)
-                self.ret[i]['sg_freq' ].append(self.sg_freq)
-                self.ret[i]['I'       ].append(_d[2*i])
-                self.ret[i]['Q'       ].append(_d[2*i+1])
-                pass
+        packets = self._packets[self._i:self.length]
+        n_valid, error = check_packets(packets, (HEADER_DATA, HEADER_SYNC, HEADER_SGSYNC))
+        if error is not None:
+            raise PacketError(f'{error.lower()} (packet {self._i + n_valid})')
+
+        is_sync, n_rot, sync_off = forward_fill_sync(packets, self.n_rotate, self.sync_off)
+        is_swp = packets[:, 0] == HEADER_SGSYNC
+        # i-th 0xaa marker sets sg_freq = f_start + swp_cnt * f_step,
+        # swp_cnt going 0, 1, ..., period, 0, 1, ...
+        n_marker = np.cumsum(is_swp) - 1
+        period = self.swp_period()
+        swp_cnt = n_marker if period is None else n_marker % (period + 1)
+        sg_freq = np.where(n_marker >= 0, self.f_start + swp_cnt * self.f_step, self.sg_freq)
+
+        keep = ~is_sync
+        ts, data = _decode_iq(packets[keep])
+        sg_freq = sg_freq[keep]
+        for i in range(self.ch_num):
+            self.ret[i]['time'    ] = ts
+            self.ret[i]['n_rot'   ] = n_rot[keep]
+            self.ret[i]['sync_off'] = sync_off[keep]
+            self.ret[i]['sg_freq' ] = sg_freq
+            self.ret[i]['I'       ] = data[:, 2*i]
+            self.ret[i]['Q'       ] = data[:, 2*i+1]
             pass
+
+        # leave the iterator state as if the file had been read packet by packet
+        self._i = self.length
+        if len(packets) > 0:
+            self.n_rotate = int(n_rot[-1])
+            self.sync_off = int(sync_off[-1])
+        n_swp = int(np.count_nonzero(is_swp))
+        if n_swp > 0:
+            self.sg_freq = self.f_start + int(swp_cnt[-1]) * self.f_step
+            self.swp_cnt = n_swp if period is None else n_swp % (period + 1)
         return self.ret
 
     def detect_step(self):
@@ -170,37 +230,294 @@ class ReadSgSwpFile():
         elif _start.shape[0] == 1:
             _end = np.argwhere(np.diff(_f) != 0)[:, 0][-1] + 101
             _end = np.array([_end])
+        else:
+            _end = _start
         return _start, _end, _start.shape[0]
 
-    def f_averaging(self, _v, _start, _end, _off=0):
+    def step_bounds(self, _start, _end, _off=0):
+        '''Averaging ranges of the SG steps of one run.
+
+        Returns
+        -------
+        f_avr : ndarray
+            SG frequency of each step.
+        lo, hi : ndarray
+            Packet ranges [lo, hi) averaged for each step
+            (the first `_off` and the last packet of a step are skipped).
+        '''
         _f = self.data[0]['sg_freq'][_start:_end]
-        _v = _v[_start:_end]
-        swp_intv = np.argwhere(np.diff(_f) != 0.)[:, 0] + 1
+        n = _f.shape[0]
+        swp_intv = np.flatnonzero(np.diff(_f) != 0.) + 1
         swp_intv = np.insert(swp_intv, 0, 0)
-        nstep = swp_intv.shape[0]
-        swp_intv = np.append(swp_intv, -1)
-        f_avr = []
-        v_avr = []
-        for j in range(nstep):
-            f_avr.append(_f[swp_intv[j]+1])
-            v_avr.append(np.mean(_v[swp_intv[j]+_off:swp_intv[j+1]-1]))
-            pass
-        if self.f_avr is None:
-            self.f_avr = np.array(f_avr)
-            pass
-        return v_avr
+        f_avr = _f[swp_intv + 1]
+        lo = np.minimum(swp_intv + _off, n)
+        hi = np.append(swp_intv[1:] - 1, max(n - 2, 0))
+        hi = np.maximum(hi, lo)
+        return f_avr, _start + lo, _start + hi
 
     def IQ_averaging(self):
         start, end, nrun = self.detect_step()
+        n_data = self.data[0]['sg_freq'].shape[0]
+        bounds = [self.step_bounds(start[_r], min(end[_r], n_data), _off=2) for _r in range(nrun)]
+        self.f_avr = bounds[0][0] if nrun > 0 else np.zeros(0)
+        n_step = [len(_b[0]) for _b in bounds]
+        lo = np.concatenate([_b[1] for _b in bounds] + [np.zeros(0, dtype=int)])
+        hi = np.concatenate([_b[2] for _b in bounds] + [np.zeros(0, dtype=int)])
+
+        # all channels, I and Q, all runs and steps in one reduceat
+        values = np.zeros((n_data + 1, 2*self.ch_num))
         for i in range(self.ch_num):
-            self.ret[i]['I_avr'] = []
-            self.ret[i]['Q_avr'] = []
-            for _r in range(nrun):
-                self.ret[i]['I_avr'].append(self.f_averaging(self.data[i]['I'], start[_r], end[_r], _off=2))
-                self.ret[i]['Q_avr'].append(self.f_averaging(self.data[i]['Q'], start[_r], end[_r], _off=2))
-                pass
+            values[:-1, 2*i  ] = self.data[i]['I']
+            values[:-1, 2*i+1] = self.data[i]['Q']
+            pass
+        count = hi - lo
+        if len(lo) > 0:
+            sums = np.add.reduceat(values, np.stack([lo, hi], axis=1).ravel(), axis=0)[::2]
+        else:
+            sums = np.zeros((0, 2*self.ch_num))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avr = sums / count[:, None]
+        avr[count == 0] = np.nan
+        runs = np.cumsum(n_step)[:-1]
+
+        for i in range(self.ch_num):
+            self.ret[i]['I_avr'] = np.split(avr[:, 2*i  ], runs) if nrun > 0 else []
+            self.ret[i]['Q_avr'] = np.split(avr[:, 2*i+1], runs) if nrun > 0 else []
             self.ret[i]['swp_freq'] = self.f_avr + self.data[i]['freq']/1e6
             self.ret[i]['n_swp_run'] = int(nrun)
             pass
         return self.ret
 
+
+CHUNK_PACKETS = 2**16 # packets per chunk of the streaming averager
+
+class SgSwpAverager():
+    '''Online averaging of SG-sweep packets.
+
+    Packets are fed chunk by chunk with `update`. For every (run, step, channel)
+    only the sums, sums of squares and counts are kept, so the memory does not
+    grow with the number of runs or the dwell time.
+    A step starts at its 0xaa marker; its first `skip_head` and last `skip_tail`
+    packets are not averaged, and at most `dwell` packets of a step are used
+    (default: length of the first step), which bounds the last step of the file.
+
+    Parameters
+    ----------
+    ch_num : int
+        Number of channels.
+    f_start, f_stop, f_step : int, int, float
+        SG sweep settings in MHz (see `read_header`).
+    skip_head, skip_tail : int
+        Packets skipped at the beginning/end of each step.
+    dwell : int, optional
+        Packets per step.
+    keep_tod : bool
+        Keep the decoded TOD as well.
+    '''
+    def __init__(self, ch_num, f_start, f_stop, f_step, skip_head=2, skip_tail=1, dwell=None,
+                 keep_tod=False):
+        self.ch_num = ch_num
+        self.f_start = f_start
+        self.f_stop = f_stop
+        self.f_step = f_step
+        self.skip_head = skip_head
+        self.skip_tail = skip_tail
+        self.dwell = dwell
+        self.keep_tod = keep_tod
+        self.period = swp_period(f_start, f_stop, f_step)
+
+        self.n_rotate = -1
+        self.sync_off = 0
+        self.n_data = 0       # data packets (0xff and 0xaa) so far
+        self.n_marker = 0     # 0xaa packets so far
+        self.step_start = -1  # data index of the latest 0xaa packet
+        self._first_marker = None
+        self._ref = None      # first I/Q values, subtracted before summing
+        self._held = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                      np.zeros((0, 2*ch_num)))
+        self._sum = np.zeros((0, 2*ch_num))
+        self._sqsum = np.zeros((0, 2*ch_num))
+        self._count = np.zeros(0, dtype=np.int64)
+        self._tod = []
+
+    def sg_freq(self, marker):
+        '''SG frequency set by the 0xaa marker number `marker` (-1: before the first one).'''
+        marker = np.asarray(marker)
+        swp_cnt = marker if self.period is None else marker % (self.period + 1)
+        return np.where(marker >= 0, self.f_start + swp_cnt * self.f_step,
+                        self.f_start + self.f_step)
+
+    def _grow(self, size):
+        if size <= len(self._count): return
+        size = max(size, 2 * len(self._count))
+        extra = size - len(self._count)
+        self._sum = np.concatenate([self._sum, np.zeros((extra, 2*self.ch_num))])
+        self._sqsum = np.concatenate([self._sqsum, np.zeros((extra, 2*self.ch_num))])
+        self._count = np.concatenate([self._count, np.zeros(extra, dtype=np.int64)])
+
+    def update(self, packets):
+        '''Accumulate a chunk of packets.
+
+        Parameter
+        ---------
+        packets : ndarray
+            uint8 array of shape (n_packets, packet_size) following the header packet
+            or the previous chunk.
+        '''
+        n_valid, error = check_packets(packets, (HEADER_DATA, HEADER_SYNC, HEADER_SGSYNC))
+        if error is not None:
+            raise PacketError(f'{error.lower()} (packet {self.n_data + n_valid})')
+        is_sync, n_rot, sync_off = forward_fill_sync(packets, self.n_rotate, self.sync_off)
+        if len(packets) > 0:
+            self.n_rotate, self.sync_off = int(n_rot[-1]), int(sync_off[-1])
+        keep = ~is_sync
+        packets, n_rot, sync_off = packets[keep], n_rot[keep], sync_off[keep]
+        if len(packets) == 0: return
+        ts, data = _decode_iq(packets)
+
+        is_marker = packets[:, 0] == HEADER_SGSYNC
+        index = self.n_data + np.arange(len(packets))
+        marker = self.n_marker + np.cumsum(is_marker) - 1
+        start = np.maximum.accumulate(np.where(is_marker, index, self.step_start))
+        offset = index - start
+        if self.dwell is None:
+            pos = index[is_marker]
+            if self._first_marker is None and len(pos) > 0:
+                self._first_marker, pos = int(pos[0]), pos[1:]
+            if len(pos) > 0:
+                self.dwell = int(pos[0]) - self._first_marker
+        self.n_data += len(packets)
+        self.n_marker = int(marker[-1]) + 1
+        self.step_start = int(start[-1])
+
+        if self.keep_tod:
+            self._tod.append((ts, n_rot, sync_off, self.sg_freq(marker), data))
+        if self._ref is None:
+            self._ref = data[0].astype(float)
+        values = data.astype(float) - self._ref
+
+        # the last `skip_tail` packets are held back until the next chunk tells
+        # whether their step goes on
+        marker = np.concatenate([self._held[0], marker])
+        offset = np.concatenate([self._held[1], offset])
+        values = np.concatenate([self._held[2], values])
+        n_proc = max(len(marker) - self.skip_tail, 0)
+        use = (marker[:n_proc] >= 0) & (offset[:n_proc] >= self.skip_head)
+        use &= marker[self.skip_tail:self.skip_tail + n_proc] == marker[:n_proc]
+        if self.dwell is not None:
+            use &= offset[:n_proc] < self.dwell - self.skip_tail
+        self._held = (marker[n_proc:], offset[n_proc:], values[n_proc:])
+
+        step, values = marker[:n_proc][use], values[:n_proc][use]
+        if len(step) == 0: return
+        bounds = np.flatnonzero(np.diff(step)) + 1
+        bounds = np.insert(bounds, 0, 0)
+        steps = step[bounds]
+        self._grow(int(steps[-1]) + 1)
+        self._sum[steps] += np.add.reduceat(values, bounds, axis=0)
+        self._sqsum[steps] += np.add.reduceat(values**2, bounds, axis=0)
+        self._count[steps] += np.diff(np.append(bounds, len(step)))
+
+    def result(self):
+        '''Averaged products of the complete runs accumulated so far.
+
+        Every run of n_step markers from the first 0xaa marker is complete,
+        including the last one; `ReadSgSwpFile` selects runs differently
+        (see `average_sgswp_file`).
+
+        Returns
+        -------
+        n_swp_run : int
+        f_avr : ndarray
+            SG frequency of each step (MHz).
+        avr, std : ndarray
+            Mean and standard deviation, shape (n_run, n_step, 2*ch_num).
+        n_sample : ndarray
+            Averaged packets of each step, shape (n_run, n_step).
+        '''
+        n_step = self.n_marker if self.period is None else self.period + 1
+        n_run = 0 if n_step == 0 else self.n_marker // n_step
+        n_used = n_run * n_step
+        self._grow(n_used)
+        count = self._count[:n_used].reshape(n_run, n_step)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self._sum[:n_used] / self._count[:n_used, None]
+            var = self._sqsum[:n_used] / self._count[:n_used, None] - mean**2
+        ref = self._ref if self._ref is not None else 0.
+        avr = (mean + ref).reshape(n_run, n_step, 2*self.ch_num)
+        std = np.sqrt(np.maximum(var, 0.)).reshape(n_run, n_step, 2*self.ch_num)
+        f_avr = self.sg_freq(np.arange(n_step))
+        return n_run, f_avr, avr, std, count
+
+    def tod(self):
+        '''Decoded TOD (only with keep_tod): ts, n_rot, sync_off, sg_freq, data.'''
+        if not self._tod:
+            return (np.zeros(0, dtype=np.int64),)*3 + (np.zeros(0),
+                                                        np.zeros((0, 2*self.ch_num), dtype=np.int64))
+        return tuple(np.concatenate(col) for col in zip(*self._tod))
+
+
+def average_sgswp_file(_path, chunk_packets=CHUNK_PACKETS, keep_tod=False, **kwargs):
+    '''Streaming averaging of an SG-sweep file, in place of
+    `ReadSgSwpFile(_path).data_avr`.
+
+    The file is read `chunk_packets` packets at a time and reduced with
+    `SgSwpAverager` (keyword arguments are passed to it).
+
+    The result differs from `ReadSgSwpFile(_path).data_avr`:
+    - runs: every complete run from the first 0xaa marker is averaged.
+      ReadSgSwpFile only keeps the runs that start where the SG frequency
+      drops back and end before the next drop, so it leaves out the last
+      run and, when the file starts at a marker, the first run (its run k
+      is then run k+1 here);
+    - the last step of a run: ReadSgSwpFile averages one packet less
+      (dwell - 4 instead of dwell - 3 with the default skips);
+    - I_avr/Q_avr are (n_swp_run x n_step) arrays instead of lists of
+      per-run arrays.
+
+    Returns
+    -------
+    ret : list of dict
+        For each channel: name, rate, freq, f_start, f_stop, f_step, n_swp_run,
+        swp_freq, I_avr, Q_avr, I_std, Q_std, n_sample (n_swp_run x n_step),
+        and time, n_rot, sync_off, sg_freq, I, Q when keep_tod is True.
+    '''
+    packet_size = get_packet_size(_path)
+    ch_num = int((packet_size - 7)/7/2)
+    with open(_path, 'rb') as _f:
+        rate, freqs, f_start, f_stop, f_step = read_header(_f.read(packet_size), ch_num)
+        averager = SgSwpAverager(ch_num, f_start, f_stop, f_step, keep_tod=keep_tod, **kwargs)
+        while True:
+            packets = packet_array(_f.read(packet_size * chunk_packets), packet_size)
+            if len(packets) == 0: break
+            averager.update(packets)
+            pass
+    n_run, f_avr, avr, std, count = averager.result()
+    if keep_tod:
+        ts, n_rot, sync_off, sg_freq, data = averager.tod()
+
+    ret = []
+    for i, freq in enumerate(freqs):
+        ret_i = {'name'     : str(_path).split('/')[-1],
+                 'rate'     : float(rate),
+                 'freq'     : float(freq),
+                 'f_start'  : int(f_start),
+                 'f_stop'   : int(f_stop),
+                 'f_step'   : f_step,
+                 'n_swp_run': int(n_run),
+                 'swp_freq' : f_avr + freq/1e6,
+                 'I_avr'    : avr[:, :, 2*i],
+                 'Q_avr'    : avr[:, :, 2*i+1],
+                 'I_std'    : std[:, :, 2*i],
+                 'Q_std'    : std[:, :, 2*i+1],
+                 'n_sample' : count}
+        if keep_tod:
+            ret_i.update({'time'    : ts,
+                          'n_rot'   : n_rot,
+                          'sync_off': sync_off,
+                          'sg_freq' : sg_freq,
+                          'I'       : data[:, 2*i],
+                          'Q'       : data[:, 2*i+1]})
+        ret.append(ret_i)
+        pass
+    return ret
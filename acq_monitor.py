@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+'''Live metrics of a running acquisition.
+
+`AcquisitionMonitor` samples an `Acquisition` (or a `SpliceCapture`) in a
+background thread every `interval` seconds:
+    throughput (MB/s and packets/s over the last `window` seconds),
+    packets/s expected from the downsampler and the read width,
+    socket backlog (bytes in the kernel receive queue and in the TCP ring),
+    writer queue depth, timestamp gaps and realignments (with a validator),
+    and the FIFO error flag polled on a separate RBCP connection.
+Each sample is appended to a JSON-lines file and/or written to a text file
+in the Prometheus exposition format (replaced atomically, e.g. in the
+textfile directory of node_exporter).
+
+Example
+-------
+    acq = Acquisition(fpga.tcp, [writer], length=cnt_finish, validator=validator)
+    monitor = AcquisitionMonitor.from_fpga(acq, fpga, jsonl_path=fname + METRICS_SUFFIX)
+    fpga.iq_setting.iq_on()
+    with monitor:
+        acq.run()
+'''
+import os
+import json
+import threading
+from collections import deque
+from time import time, perf_counter
+from sys import stderr
+
+from rbcp import RBCP, RBCPError
+from iq_setting import IQSetting
+from common import packet_size
+from rhea_pkg import FREQ_CLK_HZ
+
+MONITOR_INTERVAL = 1. # sec
+MONITOR_WINDOW = 10.  # sec
+METRICS_SUFFIX = '.metrics.jsonl'
+PROM_PREFIX = 'rhea_acq_'
+
+# name: (Prometheus type, help)
+PROM_METRICS = {
+    'bytes': ('counter', 'Bytes received.'),
+    'packets': ('counter', 'Packets received.'),
+    'mb_per_s': ('gauge', 'Throughput in MB/s over the window.'),
+    'packets_per_s': ('gauge', 'Packet rate over the window.'),
+    'expected_packets_per_s': ('gauge', 'Packet rate expected from the firmware settings.'),
+    'rate_ratio': ('gauge', 'Packet rate over the expected rate.'),
+    'socket_backlog': ('gauge', 'Bytes waiting in the kernel receive queue.'),
+    'ring_buffered': ('gauge', 'Bytes waiting in the TCP ring buffer.'),
+    'writer_queue': ('gauge', 'Buffers waiting for the writer thread.'),
+    'buffer_waits': ('counter', 'Reads delayed because no buffer was free.'),
+    'ts_gaps': ('counter', 'Timestamp discontinuities.'),
+    'dropped': ('counter', 'Missing timestamps.'),
+    'realign': ('counter', 'Packet realignments.'),
+    'fifo_error': ('gauge', 'FIFO error flag of the firmware.'),
+    'fifo_error_polls': ('counter', 'Polls that found the FIFO error flag set.'),
+}
+
+
+def socket_backlog(sock):
+    '''Bytes in the receive queue of a socket (None where unsupported).'''
+    try:
+        import fcntl
+        import termios
+        import array
+        buff = array.array('i', [0])
+        fcntl.ioctl(sock.fileno(), termios.FIONREAD, buff)
+        return buff[0]
+    except (ImportError, OSError):
+        return None
+
+
+class AcquisitionMonitor:
+    '''Periodic metrics of an acquisition.
+
+    Parameters
+    ----------
+    acq : Acquisition or SpliceCapture
+        Acquisition to be monitored.
+    packet_size : int, optional
+        Packet length in bytes (for the packet rate without a validator).
+    expected_rate : float, optional
+        Expected packets per second.
+    fifo_error : callable, optional
+        Returns the FIFO error flag; called from the monitor thread.
+    jsonl_path, prom_path : str, optional
+        Output files.
+    labels : dict, optional
+        Prometheus labels (e.g. {'board': '192.168.10.16'}).
+    interval : float
+        Seconds between samples.
+    window : float
+        Seconds over which the rates are averaged.
+    '''
+    def __init__(self, acq, packet_size=None, expected_rate=None, fifo_error=None,
+                 jsonl_path=None, prom_path=None, labels=None,
+                 interval=MONITOR_INTERVAL, window=MONITOR_WINDOW):
+        self.acq = acq
+        self.packet_size = packet_size
+        self.expected_rate = expected_rate
+        self.fifo_error = fifo_error
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.labels = {} if labels is None else dict(labels)
+        self.interval = interval
+        self.window = window
+
+        self._history = deque()
+        self._stop = threading.Event()
+        self._thread = None
+        self._fifo_error_polls = 0
+        self._fifo_error_reported = False
+        self._rbcp = None
+        self.last = None
+
+    @classmethod
+    def from_fpga(cls, acq, fpga, **kwargs):
+        '''Monitor with the expected rate read from the firmware settings and
+        the FIFO error flag polled through a second RBCP connection.'''
+        read_width = fpga.iq_setting.read_width
+        psize = packet_size(read_width)
+        rate = FREQ_CLK_HZ / fpga.ds_setting.get_accum()
+        ip_address, port_num = fpga.rbcp.sock.getpeername()
+        rbcp = RBCP(ip_address=ip_address, port_num=port_num)
+        side = IQSetting(rbcp, verbose=False)
+        kwargs.setdefault('labels', {'board': ip_address})
+        monitor = cls(acq, packet_size=psize, expected_rate=rate,
+                      fifo_error=lambda: side.fifo_error, **kwargs)
+        monitor._rbcp = rbcp
+        return monitor
+
+    def _poll_fifo_error(self):
+        if self.fifo_error is None: return None
+        try:
+            error = bool(self.fifo_error())
+        except (RBCPError, OSError) as err:
+            print(f'monitor: fifo_error poll failed: {err}', file=stderr)
+            return None
+        if error:
+            self._fifo_error_polls += 1
+            if not self._fifo_error_reported:
+                print('monitor: FIFO error detected', file=stderr)
+                self._fifo_error_reported = True
+        return error
+
+    def sample(self):
+        '''Take a sample of the metrics.
+
+        Returns
+        -------
+        metrics : dict
+            Metrics (None where not available).
+        '''
+        acq = self.acq
+        now = perf_counter()
+        n_bytes = getattr(acq, 'n_received', acq.n_written)
+        validator = getattr(acq, 'validator', None)
+        if validator is not None:
+            n_packets = validator.n_packets
+        elif self.packet_size:
+            n_packets = n_bytes // self.packet_size
+        else:
+            n_packets = None
+
+        self._history.append((now, n_bytes, n_packets))
+        while len(self._history) > 2 and now - self._history[1][0] >= self.window:
+            self._history.popleft()
+        t_0, bytes_0, packets_0 = self._history[0]
+        dt = now - t_0
+        mb_per_s = (n_bytes - bytes_0) / dt / 1e6 if dt > 0 else None
+        pps = (n_packets - packets_0) / dt if dt > 0 and n_packets is not None else None
+        ratio = pps / self.expected_rate if pps is not None and self.expected_rate else None
+
+        tcp = acq.tcp
+        fifo_error = self._poll_fifo_error()
+        self.last = {
+            'time': time(),
+            'bytes': n_bytes,
+            'packets': n_packets,
+            'mb_per_s': mb_per_s,
+            'packets_per_s': pps,
+            'expected_packets_per_s': self.expected_rate,
+            'rate_ratio': ratio,
+            'socket_backlog': socket_backlog(tcp.sock) if hasattr(tcp, 'sock') else None,
+            'ring_buffered': getattr(tcp, 'n_buffered', None),
+            'writer_queue': getattr(acq, 'n_queued', None),
+            'buffer_waits': getattr(acq, 'n_wait', None),
+            'ts_gaps': validator.n_gaps if validator is not None else None,
+            'dropped': validator.n_dropped if validator is not None else None,
+            'realign': validator.n_realign if validator is not None else None,
+            'fifo_error': None if fifo_error is None else int(fifo_error),
+            'fifo_error_polls': self._fifo_error_polls if self.fifo_error is not None else None,
+        }
+        return self.last
+
+    def _prom_text(self, metrics):
+        labels = ','.join(f'{key}="{value}"' for key, value in self.labels.items())
+        labels = f'{{{labels}}}' if labels else ''
+        lines = []
+        for name, (kind, text) in PROM_METRICS.items():
+            if metrics[name] is None: continue
+            prom_name = PROM_PREFIX + name + ('_total' if kind == 'counter' else '')
+            lines += [f'# HELP {prom_name} {text}',
+                      f'# TYPE {prom_name} {kind}',
+                      f'{prom_name}{labels} {metrics[name]}']
+        lines.append(f'{PROM_PREFIX}timestamp_seconds{labels} {metrics["time"]:.3f}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, metrics):
+        '''Write a sample to the output files.'''
+        if self.jsonl_path is not None:
+            with open(self.jsonl_path, 'a', encoding='utf-8') as jsonl:
+                jsonl.write(json.dumps(dict(self.labels, **metrics)) + '\n')
+        if self.prom_path is not None:
+            tmp_path = f'{self.prom_path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as prom:
+                prom.write(self._prom_text(metrics))
+            os.replace(tmp_path, self.prom_path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write(self.sample())
+        self.write(self.sample())
+
+    def start(self):
+        '''Start sampling in a daemon thread.'''
+        self._history.clear()
+        self.sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''Stop sampling after a last sample.'''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._rbcp is not None:
+            self._rbcp.sock.close()
+            self._rbcp = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
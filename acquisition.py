@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+'''Threaded acquisition of the TCP data stream.
+
+A receiver thread drains the socket into buffers taken from a bounded pool,
+and a writer thread hands the filled buffers to the sinks and returns them
+to the pool. A slow sink therefore delays only the writer thread; when the
+pool runs out the receiver waits, which is counted as backpressure.
+
+A sink is any object with a `write(data)` method taking a bytes-like object
+(e.g. a file opened in 'wb' mode). Sinks are not closed by the engine.
+
+With a `PacketValidator`, the writer thread checks the header and footer
+bytes of every packet and the timestamp continuity before the sinks see the
+data. When the stream loses the packet alignment, the bytes up to the next
+valid packet boundary are skipped, so the output stays packet-aligned, and
+the event is recorded in a JSON-lines log (LOG_SUFFIX next to the file).
+
+Example
+-------
+    with open(fname, 'wb') as file_desc:
+        file_desc.write(header_packet)
+        acq = Acquisition(fpga.tcp, [file_desc], length=psize * data_length,
+                          validator=PacketValidator(psize, fname + LOG_SUFFIX))
+        fpga.iq_setting.iq_on()
+        acq.run()
+'''
+import threading
+import queue
+import json
+from time import perf_counter
+import numpy as np
+
+from packet_reader import HEADER_DATA, HEADER_SGSYNC, HEADER_SYNC, FOOTER, sign_extend
+
+ACQ_BUFF_SIZE = 2**20 # bytes per buffer
+ACQ_N_BUFF = 64       # buffers in the pool
+ACQ_JOIN_INTERVAL = 0.1 # sec
+LOG_SUFFIX = '.acqlog'
+
+
+class AcquisitionError(Exception):
+    '''Raised when a sink or the socket read fails during acquisition.'''
+
+
+class PacketValidator:
+    '''Packet alignment and timestamp continuity check of a stream fed in
+    arbitrary pieces.
+
+    A packet is valid when its first byte is a known header and its last
+    byte is the footer. After an invalid packet, the next boundary is the
+    first offset where two consecutive valid packets start; the bytes before
+    it are skipped. Timestamps of the data packets (SYNC packets excluded)
+    must increase by one.
+
+    Parameters
+    ----------
+    packet_size : int
+        Packet length in bytes.
+    log_path : str, optional
+        JSON-lines log of the realignments and timestamp gaps (opened at the
+        first event).
+    headers : tuple of int
+        Valid header bytes.
+
+    Attributes
+    ----------
+    n_packets : int
+        Valid packets passed to the output.
+    n_dropped : int
+        Timestamps missing in the output.
+    n_gaps : int
+        Timestamp discontinuities (skips and backward jumps).
+    n_realign : int
+        Realignments.
+    n_skipped : int
+        Bytes skipped to recover the alignment.
+    first_ts, last_ts : int
+        First and last timestamps of the data packets.
+    events : list of dict
+        Logged events.
+    '''
+    def __init__(self, packet_size, log_path=None,
+                 headers=(HEADER_DATA, HEADER_SGSYNC, HEADER_SYNC)):
+        self.packet_size = packet_size
+        self.log_path = log_path
+        self.headers = tuple(headers)
+        self._log = None
+        self._rest = b''
+        self._base = 0          # stream offset of the next byte fed
+        self._searching = False
+        self._pending = None    # realignment waiting for the next timestamp
+
+        self.n_out = 0
+        self.n_packets = 0
+        self.n_dropped = 0
+        self.n_gaps = 0
+        self.n_realign = 0
+        self.n_skipped = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.events = []
+
+    def _is_header(self, arr):
+        ret = arr == self.headers[0]
+        for header in self.headers[1:]:
+            ret |= arr == header
+        return ret
+
+    def _find(self, arr, pos):
+        '''First offset >= pos where two valid packets start, None if not in `arr`.'''
+        psize = self.packet_size
+        end = len(arr) - 2 * psize + 1
+        if end <= pos: return None
+        ok = self._is_header(arr[pos:end])
+        ok &= arr[pos + psize - 1:end + psize - 1] == FOOTER
+        ok &= self._is_header(arr[pos + psize:end + psize])
+        ok &= arr[pos + 2 * psize - 1:end + 2 * psize - 1] == FOOTER
+        idx = np.flatnonzero(ok)
+        return pos + int(idx[0]) if len(idx) else None
+
+    def _event(self, event):
+        self.events.append(event)
+        if self.log_path is None: return
+        if self._log is None:
+            self._log = open(self.log_path, 'a', encoding='utf-8')
+        self._log.write(json.dumps(event) + '\n')
+        self._log.flush()
+
+    def _check_ts(self, packets):
+        is_data = packets[:, 0] != HEADER_SYNC
+        ts = sign_extend(packets[is_data, 1:6])
+        if len(ts) == 0: return
+        out = self.n_out + np.flatnonzero(is_data) * self.packet_size
+        if self.last_ts is None:
+            self.first_ts = int(ts[0])
+            prev, out = ts[:-1], out[1:]
+            if self._pending is not None:
+                self._event(dict(self._pending, ts=None, delta=None))
+                self._pending = None
+        else:
+            prev = np.concatenate([[self.last_ts], ts[:-1]])
+        diff = ts[len(ts) - len(prev):] - prev
+        self.last_ts = int(ts[-1])
+
+        self.n_gaps += int(np.count_nonzero(diff != 1))
+        self.n_dropped += int(np.maximum(diff - 1, 0).sum())
+        gaps = np.flatnonzero(diff != 1)
+        if self._pending is not None:
+            # the first step follows the realignment
+            self._event(dict(self._pending, ts=int(prev[0]), delta=int(diff[0])))
+            self._pending = None
+            gaps = gaps[gaps > 0]
+        for k in gaps:
+            self._event({'event': 'gap', 'out_offset': int(out[k]),
+                         'ts': int(prev[k]), 'delta': int(diff[k])})
+            pass
+
+    def feed(self, data):
+        '''Validate the next piece of the stream.
+
+        Returns
+        -------
+        valid : bytes-like
+            Valid packets (possibly empty); bytes of an incomplete packet
+            are kept for the next call.
+        '''
+        psize = self.packet_size
+        if self._rest:
+            buff = self._rest + bytes(data)
+        else:
+            buff = data
+        arr = np.frombuffer(buff, dtype=np.uint8)
+        base = self._base - len(self._rest)
+        self._base += len(arr) - len(self._rest)
+
+        pieces = []
+        pos = 0
+        while True:
+            if self._searching:
+                j = self._find(arr, pos)
+                if j is None:
+                    keep = max(pos, len(arr) - 2 * psize + 1)
+                    self.n_skipped += keep - pos
+                    self._pending['skipped'] += keep - pos
+                    pos = keep
+                    break
+                self.n_skipped += j - pos
+                self._pending['skipped'] += j - pos
+                pos = j
+                self._searching = False
+            n_packets = (len(arr) - pos) // psize
+            packets = arr[pos:pos + n_packets * psize].reshape(n_packets, psize)
+            valid = self._is_header(packets[:, 0]) & (packets[:, -1] == FOOTER)
+            n_valid = n_packets if valid.all() else int(np.argmin(valid))
+            if n_valid:
+                self._check_ts(packets[:n_valid])
+                pieces.append(packets[:n_valid])
+                self.n_out += n_valid * psize
+                self.n_packets += n_valid
+                pos += n_valid * psize
+            if n_valid == n_packets: break
+            # lost alignment: search from the next byte
+            self.n_realign += 1
+            self._pending = {'event': 'realign', 'offset': base + pos,
+                             'out_offset': self.n_out, 'skipped': 1}
+            self.n_skipped += 1
+            pos += 1
+            self._searching = True
+            pass
+        self._rest = bytes(arr[pos:])
+
+        if len(pieces) == 1:
+            return memoryview(pieces[0]).cast('B')
+        if pieces:
+            return np.concatenate(pieces).tobytes()
+        return b''
+
+    def close(self):
+        '''Log the incomplete realignment or packet left at the end of the stream.'''
+        if self._pending is not None:
+            self._event(dict(self._pending, skipped=self._pending['skipped'] + len(self._rest)))
+            self._pending = None
+        elif self._rest:
+            self._event({'event': 'tail', 'offset': self._base - len(self._rest),
+                         'out_offset': self.n_out, 'skipped': len(self._rest)})
+        self.n_skipped += len(self._rest)
+        self._rest = b''
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def report(self):
+        '''Summary of the check.'''
+        return (f'{self.n_packets} valid packets, dropped: {self.n_dropped} in {self.n_gaps} gaps, '
+                f'realigned: {self.n_realign} ({self.n_skipped} bytes skipped)')
+
+
+class Acquisition:
+    '''Receiver/writer thread pair.
+
+    Parameters
+    ----------
+    tcp : tcp.TCP
+        Data stream (`read_into` is used).
+    sinks : list
+        Objects with a `write(data)` method.
+    length : int, optional
+        Number of bytes to be acquired (default: until `stop` or the end of the stream).
+    buff_size : int
+        Size of each buffer in bytes; also the size of each socket read.
+    n_buff : int
+        Number of buffers in the pool.
+    progress : callable, optional
+        Called by the writer thread with the number of bytes written so far.
+    validator : PacketValidator, optional
+        Packet check applied before the sinks; closed at the end of the stream.
+    '''
+    def __init__(self, tcp, sinks, length=None, buff_size=ACQ_BUFF_SIZE, n_buff=ACQ_N_BUFF,
+                 progress=None, validator=None):
+        self.tcp = tcp
+        self.sinks = list(sinks)
+        self.validator = validator
+        self.length = length
+        self.buff_size = buff_size
+        self.progress = progress
+
+        self._free = queue.Queue()
+        for _ in range(n_buff):
+            self._free.put(bytearray(buff_size))
+        self._full = queue.Queue()
+        self._stop = threading.Event()
+        self._error = None
+        self._threads = []
+
+        self.n_received = 0
+        self.n_written = 0
+        self.n_wait = 0      # reads delayed because no buffer was free
+        self.wait_time = 0.  # sec spent waiting for a free buffer
+        self.max_queued = 0  # max number of buffers waiting for the writer
+        self.elapsed = 0.
+
+    def _receive(self):
+        try:
+            while not self._stop.is_set():
+                size = self.buff_size
+                if self.length is not None:
+                    size = min(size, self.length - self.n_received)
+                    if size <= 0: break
+                try:
+                    buff = self._free.get_nowait()
+                except queue.Empty:
+                    self.n_wait += 1
+                    start = perf_counter()
+                    buff = self._free.get()
+                    self.wait_time += perf_counter() - start
+                n_read = self.tcp.read_into(memoryview(buff)[:size])
+                self.n_received += n_read
+                self._full.put((buff, n_read))
+                self.max_queued = max(self.max_queued, self._full.qsize())
+                if n_read < size: break
+                pass
+        except Exception as err:
+            self._fail('receive', err)
+        finally:
+            self._full.put(None)
+
+    def _fail(self, where, err):
+        '''Keep the first error (raised by `join`) and stop the acquisition.'''
+        if self._error is None:
+            self._error = AcquisitionError(f'{where} error: {err}')
+            self._error.__cause__ = err
+        self._stop.set()
+
+    def _write(self):
+        failed = False
+        while True:
+            item = self._full.get()
+            if item is None: break
+            buff, n_read = item
+            if n_read and not failed:
+                data = memoryview(buff)[:n_read]
+                try:
+                    if self.validator is not None:
+                        data = self.validator.feed(data)
+                    for sink in self.sinks:
+                        sink.write(data)
+                except Exception as err:
+                    failed = True
+                    self._fail('sink', err)
+                del data
+                self.n_written += n_read
+                if self.progress is not None and not failed:
+                    self.progress(self.n_written)
+            self._free.put(buff)
+        if self.validator is not None:
+            self.validator.close()
+
+    @property
+    def n_queued(self):
+        '''Number of buffers waiting for the writer thread.'''
+        return self._full.qsize()
+
+    def start(self):
+        '''Start the receiver and writer threads.'''
+        self._start = perf_counter()
+        self._threads = [threading.Thread(target=self._receive, daemon=True),
+                         threading.Thread(target=self._write, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        '''Stop after the current read.'''
+        self._stop.set()
+
+    def join(self):
+        '''Wait for the end of the acquisition.
+
+        Raises
+        ------
+        AcquisitionError
+            If a sink or the socket read failed.
+        '''
+        for thread in self._threads:
+            while thread.is_alive():
+                thread.join(ACQ_JOIN_INTERVAL)
+        self.elapsed = perf_counter() - self._start
+        if self._error is not None:
+            raise self._error
+
+    def run(self):
+        '''Acquire until `length` bytes are written or the stream ends.
+        On KeyboardInterrupt the buffered data are flushed before re-raising.'''
+        self.start()
+        try:
+            self.join()
+        except KeyboardInterrupt:
+            self.stop()
+            self.join()
+            raise
+        return self
+
+    def report(self):
+        '''Summary of the throughput and the backpressure.'''
+        rate = self.n_written / self.elapsed / 1e6 if self.elapsed > 0 else 0.
+        ret = (f'{self.n_written} bytes in {self.elapsed:.2f} s ({rate:.2f} MB/s), '
+               f'max queued buffers: {self.max_queued}, '
+               f'waits for a free buffer: {self.n_wait} ({self.wait_time:.3f} s)')
+        if self.validator is not None:
+            ret += '\n' + self.validator.report()
+        return ret
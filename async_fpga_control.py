@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+'''asyncio readout controller for running several boards from one process.
+
+`AsyncRBCP` and `AsyncTCP` talk to a board through asyncio datagram/stream
+transports. `AsyncFPGAControl` reuses the setting classes of `FPGAControl`:
+they run in a worker thread dedicated to the board, and their RBCP accesses
+are forwarded to the event loop. Operations on one board are serialized
+while different boards proceed concurrently.
+
+Example
+-------
+    async def setup(ip_addresses, tone_conf):
+        boards = [AsyncFPGAControl(ip) for ip in ip_addresses]
+        await asyncio.gather(*[board.connect() for board in boards])
+        await asyncio.gather(*[board.init() for board in boards])
+        await asyncio.gather(*[board.configure(tone_conf) for board in boards])
+'''
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from math import floor
+from sys import stderr
+from time import time
+
+from rbcp import RBCP, RBCPPacket, RBCPError
+from tcp import TCPError, TCP_N_TRY, TCP_TIMEOUT, TCP_RING_SIZE
+from fpga_control import FPGAControl
+from rhea_pkg import IP_ADDRESS_DEFAULT, TCP_PORT_DEFAULT, RBCP_PORT_DEFAULT
+
+RBCP_TIMEOUT = 1. # sec
+
+
+class _RBCPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, rbcp):
+        self._rbcp = rbcp
+
+    def datagram_received(self, data, addr):
+        self._rbcp._received(data)
+
+    def error_received(self, exc):
+        print(f'rbcp: {exc}', file=stderr)
+
+
+class AsyncRBCP:
+    '''Awaitable RBCP.
+
+    Replies are matched to the requests by packet ID; stale replies are
+    dropped. Transactions with one board are serialized.
+
+    Parameters
+    ----------
+    ip_address : str
+        IP address.
+    port_num : int
+        RBCP port number.
+    retry_max : int
+        Number of retries of a transaction.
+    '''
+    def __init__(self, ip_address=IP_ADDRESS_DEFAULT, port_num=RBCP_PORT_DEFAULT, retry_max=30):
+        self.ip_address = ip_address
+        self.port_num = port_num
+        self._retry_max = retry_max
+        self.packet_id = int(time()) % 256
+        self._transport = None
+        self._pending = {}
+        self._lock = None
+
+    async def connect(self):
+        '''Open the datagram endpoint.'''
+        loop = asyncio.get_running_loop()
+        self._lock = asyncio.Lock()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _RBCPProtocol(self), remote_addr=(self.ip_address, self.port_num))
+        return self
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    def _received(self, data):
+        try:
+            packet = RBCPPacket.interpret(data)
+        except (AssertionError, IndexError, RBCPError):
+            return
+        future = self._pending.pop(packet.packet_id, None)
+        if future is not None and not future.done():
+            future.set_result(packet)
+
+    async def _transact(self, address, data):
+        if isinstance(data, int):
+            is_read, payload, length = True, b'', data
+        else:
+            is_read, payload, length = False, data, len(data)
+
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            retry_cnt = 0
+            while True:
+                self.packet_id = (self.packet_id + 1) % 256
+                packet = RBCPPacket(is_read, self.packet_id, length, address, data=payload)
+                future = loop.create_future()
+                self._pending[self.packet_id] = future
+                self._transport.sendto(bytes(packet.repr()))
+                try:
+                    reply = await asyncio.wait_for(future, RBCP_TIMEOUT)
+                    return reply.data
+                except asyncio.TimeoutError:
+                    self._pending.pop(self.packet_id, None)
+                    retry_cnt += 1
+                    if retry_cnt > self._retry_max:
+                        raise RBCPError(f'rbcp: no reply from {self.ip_address}')
+                    print(f'rbcp: no reply from {self.ip_address}. retry: {retry_cnt}', file=stderr)
+
+    async def read(self, address, length=1):
+        '''RBCP read (see `RBCP.read`).'''
+        return await self._transact(address, length)
+
+    async def write(self, address, data):
+        '''RBCP write (see `RBCP.write`).'''
+        return await self._transact(address, data)
+
+    async def read_intn(self, address, length):
+        '''Read n bytes and return data interpreted as integer.'''
+        return int.from_bytes(await self.read(address, length), byteorder='big')
+
+    async def write_intn(self, address, data_int, length):
+        '''Write n bytes by intepreting given integer.'''
+        assert isinstance(data_int, int)
+        return await self.write(address, data_int.to_bytes(length, byteorder='big'))
+
+
+class _RBCPBridge(RBCP):
+    '''Blocking RBCP interface of an `AsyncRBCP`, for the setting classes
+    running in a worker thread.'''
+    def __init__(self, arbcp, loop):
+        self._arbcp = arbcp
+        self._loop = loop
+
+    def _run(self, coro):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            raise RBCPError('rbcp: blocking call in the event loop')
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def read(self, address, length=1):
+        return self._run(self._arbcp.read(address, length))
+
+    def write(self, address, data):
+        return self._run(self._arbcp.write(address, data))
+
+
+class AsyncTCP:
+    '''Awaitable TCP data stream (see `tcp.TCP`).
+
+    Parameters
+    ----------
+    ip_address : str
+        IP address.
+    port_num : int
+        Port number.
+    buff_size : int
+        Buffer limit of the stream reader; `read_packets` is limited to it.
+    '''
+    def __init__(self, ip_address=IP_ADDRESS_DEFAULT, port_num=TCP_PORT_DEFAULT,
+                 buff_size=TCP_RING_SIZE):
+        self.ip_address = ip_address
+        self.port_num = port_num
+        self.buff_size = buff_size
+        self.timeout = TCP_TIMEOUT * TCP_N_TRY
+        self._reader = None
+        self._writer = None
+
+    async def connect(self):
+        '''Open the connection.'''
+        self._reader, self._writer = await asyncio.open_connection(
+            self.ip_address, self.port_num, limit=self.buff_size)
+        return self
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def send(self, data):
+        '''Write data.'''
+        self._writer.write(data)
+        await self._writer.drain()
+
+    async def clear(self):
+        '''Discard the received data until the stream pauses.'''
+        try:
+            while await asyncio.wait_for(self._reader.read(self.buff_size), TCP_TIMEOUT):
+                pass
+        except asyncio.TimeoutError:
+            pass
+
+    async def read_into(self, buffer):
+        '''Fill a writable buffer with the TCP stream.
+
+        Returns
+        -------
+        length : int
+            Number of bytes written (less than len(buffer) when the stream
+            pauses longer than the timeout or ends).
+        '''
+        view = memoryview(buffer).cast('B')
+        length = 0
+        while length < len(view):
+            try:
+                data = await asyncio.wait_for(self._reader.read(len(view) - length), self.timeout)
+            except asyncio.TimeoutError:
+                print(TCPError('tcp.read_into: receive error'))
+                break
+            if not data:
+                break
+            view[length:length + len(data)] = data
+            length += len(data)
+        return length
+
+    async def read(self, length=1):
+        '''Read TCP stream (bytes; shorter on timeout).'''
+        buff = bytearray(length)
+        return bytes(buff[:await self.read_into(buff)])
+
+    async def read_packets(self, n_packets, packet_size):
+        '''Read whole packets (fewer packets on timeout).'''
+        length = n_packets * packet_size
+        if length > self.buff_size:
+            raise TCPError(f'tcp.read_packets: {length} bytes exceed the buffer')
+        try:
+            return await asyncio.wait_for(self._reader.readexactly(length), self.timeout)
+        except asyncio.IncompleteReadError as err:
+            data = err.partial
+        except asyncio.TimeoutError:
+            # readexactly consumes nothing until the whole length is there
+            data = b''
+            print(TCPError('tcp.read_packets: receive error'))
+        return data[:len(data) - len(data) % packet_size]
+
+
+class AsyncFPGAControl:
+    '''FPGA controller on asyncio.
+
+    The setting classes of `FPGAControl` are available as `self.fpga.*`;
+    call them through `call` to run them off the event loop.
+
+    Parameters
+    ----------
+    ip_address : str
+        IP address.
+    verbose : bool
+        Verbosity.
+    rbcp_port, tcp_port : int
+        Port numbers.
+    '''
+    def __init__(self, ip_address=IP_ADDRESS_DEFAULT, verbose=False,
+                 rbcp_port=RBCP_PORT_DEFAULT, tcp_port=TCP_PORT_DEFAULT):
+        self.ip_address = ip_address
+        self._verbose = verbose
+        self.rbcp = AsyncRBCP(ip_address, rbcp_port)
+        self.tcp = AsyncTCP(ip_address, tcp_port)
+        self.fpga = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def connect(self):
+        '''Connect to the board and read its information.'''
+        await self.rbcp.connect()
+        await self.tcp.connect()
+        loop = asyncio.get_running_loop()
+        bridge = _RBCPBridge(self.rbcp, loop)
+        self.fpga = await self.call(FPGAControl, verbose=self._verbose,
+                                    ip_address=self.ip_address, rbcp=bridge, tcp=self.tcp)
+        return self
+
+    async def call(self, func, *args, **kwargs):
+        '''Run a blocking function (e.g. a method of `self.fpga`) in the worker thread of the board.'''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    @property
+    def max_ch(self):
+        return self.fpga.max_ch
+
+    async def init(self, swap_dac=True, swap_adc=True):
+        '''Initialize FPGA (see `FPGAControl.init`).'''
+        await self.call(self.fpga.init, swap_dac=swap_dac, swap_adc=swap_adc)
+
+    async def configure(self, tone_conf, rate_ksps=None):
+        '''Set the read width and the DDS tones, and the sampling rate if given.
+
+        Parameters
+        ----------
+        tone_conf : ToneConf
+            Tone configuration.
+        rate_ksps : int, optional
+            Sampling rate in kSPS.
+        '''
+        await self.call(self.fpga.iq_setting.set_read_width, tone_conf.n_tone)
+        await self.call(self.fpga.dds_setting.configure, tone_conf)
+        if rate_ksps is not None:
+            await self.call(self.fpga.ds_setting.set_accum, floor(200000 / rate_ksps + 0.5))
+
+    async def iq_on(self):
+        await self.call(self.fpga.iq_setting.iq_on)
+
+    async def iq_off(self):
+        await self.call(self.fpga.iq_setting.iq_off)
+
+    async def read(self, length=1):
+        return await self.tcp.read(length)
+
+    async def read_into(self, buffer):
+        return await self.tcp.read_into(buffer)
+
+    async def read_packets(self, n_packets, packet_size):
+        return await self.tcp.read_packets(n_packets, packet_size)
+
+    def close(self):
+        self.tcp.close()
+        self.rbcp.close()
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *args):
+        self.close()
+
+
+async def _init_boards(ip_addresses):
+    boards = [AsyncFPGAControl(ip) for ip in ip_addresses]
+    await asyncio.gather(*[board.connect() for board in boards])
+    try:
+        await asyncio.gather(*[board.init() for board in boards])
+        for board in boards:
+            print(f'{board.ip_address}: max_ch {board.max_ch}')
+    finally:
+        for board in boards:
+            board.close()
+
+
+def main():
+    '''Initialize several boards concurrently.'''
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('ip_addresses',
+                        type=str,
+                        nargs='+',
+                        help='IP-v4 addresses of the boards.')
+    args = parser.parse_args()
+    asyncio.run(_init_boards(args.ip_addresses))
+
+
+if __name__ == '__main__':
+    main()
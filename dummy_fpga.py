@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+'''Firmware stand-in to test the readout software without a board.
+
+`DummyFPGA` answers RBCP on UDP with a register memory and, while the IQ
+stream is on (IQ_STATUS), sends IQ packets on TCP at the rate set by the
+downsampler (FREQ_CLK_HZ / accumulation number) with the read width in
+IQ_READ_WIDTH. Random packet drops can be emulated; they skip timestamps
+and set the FIFO error flag like the firmware does on overflow.
+
+Several stand-ins run side by side on different ports:
+    $ python3 dummy_fpga.py -n 3
+'''
+import socket
+import select
+import threading
+from time import sleep, perf_counter
+import numpy as np
+
+from rhea_pkg import FREQ_CLK_HZ
+from info_setting import INFO_FIRM_VER, INFO_MAX_CH
+from iq_setting import IQ_STATUS, IQ_RESET_TS, IQ_FIFO_ERR, IQ_READ_WIDTH
+from ds_setting import DS_OFFSET
+
+SERVER_IP = '127.0.0.1'
+RBCP_PORT = 4660
+TCP_PORT = 32410
+MAX_CH = 8
+FIRM_VER = 2024_01_01
+SEND_INTERVAL = 0.01 # sec
+SEED = 0
+
+
+class DummyFPGA:
+    '''RBCP register memory and IQ data stream.
+
+    Parameters
+    ----------
+    ip_address : str
+        Address to bind.
+    rbcp_port, tcp_port : int
+        Port numbers.
+    max_ch : int
+        Number of DDS channels reported to the software.
+    drop_prob : float
+        Probability that a packet is dropped.
+    seed : int
+        Seed of the random data.
+    '''
+    def __init__(self, ip_address=SERVER_IP, rbcp_port=RBCP_PORT, tcp_port=TCP_PORT,
+                 max_ch=MAX_CH, drop_prob=0., seed=SEED):
+        self.ip_address = ip_address
+        self.rbcp_port = rbcp_port
+        self.tcp_port = tcp_port
+        self.drop_prob = drop_prob
+        self._rand = np.random.RandomState(seed)
+
+        self._regs = {}
+        self._write_reg(INFO_FIRM_VER, FIRM_VER.to_bytes(4, 'big'))
+        self._write_reg(INFO_MAX_CH, bytes([max_ch]))
+        self._write_reg(DS_OFFSET, (200000).to_bytes(4, 'big'))
+        self._lock = threading.Lock()
+
+        self._ts = 0
+        self.n_sent = 0
+        self.n_dropped = 0
+
+        self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._udp.bind((ip_address, rbcp_port))
+        self._tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._tcp.bind((ip_address, tcp_port))
+        self._tcp.listen(1)
+
+    def _write_reg(self, address, data):
+        for i, byte in enumerate(data):
+            self._regs[address + i] = byte
+
+    def _read_reg(self, address, length=1):
+        return bytes(self._regs.get(address + i, 0) for i in range(length))
+
+    def _reg_int(self, address, length=1):
+        return int.from_bytes(self._read_reg(address, length), 'big')
+
+    def _serve_rbcp(self):
+        while True:
+            data, addr = self._udp.recvfrom(4096)
+            if len(data) < 8: continue
+            length = data[3]
+            address = int.from_bytes(data[4:8], 'big')
+            with self._lock:
+                if data[1] & 0xf0 == 0xc0:
+                    payload = self._read_reg(address, length)
+                else:
+                    payload = bytes(data[8:8 + length])
+                    self._write_reg(address, payload)
+                    if address <= IQ_RESET_TS < address + length:
+                        self._ts = 0
+                pass
+            reply = bytearray(data[:8]) + payload
+            reply[1] |= 0x08
+            self._udp.sendto(bytes(reply), addr)
+
+    def _packets(self, n_packets, n_ch):
+        '''IQ packets with the next `n_packets` timestamps (some dropped).'''
+        ts = self._ts + np.arange(n_packets, dtype=np.int64)
+        self._ts += n_packets
+        if self.drop_prob > 0:
+            keep = self._rand.random_sample(n_packets) >= self.drop_prob
+            self.n_dropped += int(n_packets - keep.sum())
+            if not keep.all():
+                self._write_reg(IQ_FIFO_ERR, b'\x01')
+            ts = ts[keep]
+        if len(ts) == 0: return b''
+        fields = np.empty((len(ts), 1 + 2 * n_ch), dtype='>i8')
+        fields[:, 0] = ts
+        fields[:, 1:] = self._rand.randint(-2**20, 2**20, size=(len(ts), 2 * n_ch))
+        packets = np.empty((len(ts), 7 + 14 * n_ch), dtype=np.uint8)
+        packets[:, 0] = 0xff
+        packets[:, 1:6] = fields[:, :1].view(np.uint8)[:, 3:]
+        iq_bytes = fields[:, 1:].view(np.uint8).reshape(len(ts), 2 * n_ch, 8)
+        packets[:, 6:-1] = iq_bytes[:, :, 1:].reshape(len(ts), -1)
+        packets[:, -1] = 0xee
+        self.n_sent += len(ts)
+        return packets.tobytes()
+
+    def _peer_closed(self, client):
+        '''True when the client has closed the connection (its input is discarded).'''
+        if not select.select([client], [], [], 0)[0]:
+            return False
+        return client.recv(4096) == b''
+
+    def _stream(self, client):
+        running = False
+        start = n_done = 0
+        try:
+            while not self._peer_closed(client):
+                with self._lock:
+                    on = self._reg_int(IQ_STATUS) == 1
+                    n_ch = self._reg_int(IQ_READ_WIDTH)
+                    accum = max(self._reg_int(DS_OFFSET, 4), 1)
+                    if on and not running:
+                        start, n_done = perf_counter(), 0
+                    running = on and n_ch > 0
+                    data = b''
+                    if running:
+                        n_due = int((perf_counter() - start) * FREQ_CLK_HZ / accum)
+                        data = self._packets(n_due - n_done, n_ch)
+                        n_done = n_due
+                    pass
+                if data:
+                    client.sendall(data)
+                sleep(SEND_INTERVAL)
+        except OSError:
+            pass
+        finally:
+            client.close()
+
+    def _serve_tcp(self):
+        while True:
+            client, _ = self._tcp.accept()
+            self._stream(client)
+
+    def start(self):
+        '''Serve RBCP and TCP in daemon threads.'''
+        for target in (self._serve_rbcp, self._serve_tcp):
+            threading.Thread(target=target, daemon=True).start()
+        return self
+
+
+def main():
+    '''Run firmware stand-ins on consecutive ports.'''
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--n_boards',
+                        type=int,
+                        default=1,
+                        help='number of stand-ins. (default=1)')
+    parser.add_argument('--rbcp_port',
+                        type=int,
+                        default=RBCP_PORT,
+                        help=f'RBCP port of the first stand-in. (default={RBCP_PORT})')
+    parser.add_argument('--tcp_port',
+                        type=int,
+                        default=TCP_PORT,
+                        help=f'TCP port of the first stand-in. (default={TCP_PORT})')
+    parser.add_argument('--drop',
+                        type=float,
+                        default=0.,
+                        help='probability of dropping a packet. (default=0)')
+    args = parser.parse_args()
+
+    for k in range(args.n_boards):
+        DummyFPGA(rbcp_port=args.rbcp_port + k, tcp_port=args.tcp_port + k,
+                  drop_prob=args.drop, seed=SEED + k).start()
+        print(f'stand-in {k}: {SERVER_IP} rbcp {args.rbcp_port + k} tcp {args.tcp_port + k}')
+    while True:
+        sleep(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -36,8 +36,12 @@ class FPGAControl:
         Verbosity.
     ip_address : str
         IP address.
+    rbcp : RBCP, optional
+        RBCP handler to be used instead of a new connection.
+    tcp : TCP, optional
+        TCP handler to be used instead of a new connection.
     '''
-    def __init__(self, verbose=False, ip_address=IP_ADDRESS_DEFAULT):
+    def __init__(self, verbose=False, ip_address=IP_ADDRESS_DEFAULT, rbcp=None, tcp=None):
         self._verbose = verbose
         self.__lock_path = '/tmp/.'+ip_address+'.lock'
         self._vprint(f'lock file: {self.__lock_path}')
@@ -65,8 +69,8 @@ class FPGAControl:
             sys.exit(1)
 
 
-        self.rbcp = RBCP(ip_address=ip_address, port_num=RBCP_PORT_DEFAULT)
-        self.tcp = TCP(ip_address=ip_address, port_num=TCP_PORT_DEFAULT)
+        self.rbcp = RBCP(ip_address=ip_address, port_num=RBCP_PORT_DEFAULT) if rbcp is None else rbcp
+        self.tcp = TCP(ip_address=ip_address, port_num=TCP_PORT_DEFAULT) if tcp is None else tcp
 
         self.info = InfoSetting(self.rbcp, verbose=verbose)
         self.max_ch = self.info.max_ch
@@ -1,16 +1,102 @@
 #!/usr/bin/env python3
 
-from .packet_reader import read_file
+from .packet_reader import read_file, read_iq_arrays, decode_file, read_time_window, RawDataFile
+from .packet_reader import get_packet_size, packet_array, check_packets, sign_extend, PacketReaderError
+from .packet_reader import HEADER_DATA, HEADER_SGSYNC, HEADER_SYNC, FOOTER
 from numpy import mean, angle, array, log10
 from enum import Enum
 from datetime import datetime
 from pathlib import Path
+from functools import partial
+from collections.abc import KeysView, ItemsView, ValuesView
 
-from .ReadSgSwp import ReadSgSwpFile
+from .ReadSgSwp import ReadSgSwpFile, average_sgswp_file
+from .rhea_cache import load_cache, CacheError
 
 import numpy as np
 import warnings
 
+class RheaData(dict):
+    '''Readout data of a channel returned by read_rhea_*.
+
+    IQ, amp_rad, phase, pha_rad and ampDB are computed from I and Q on first
+    access and then kept, so they cost nothing unless they are used.
+    With derived=False (miniret) they are not available at all.
+    '''
+    DERIVED = ('IQ', 'amp_rad', 'phase', 'pha_rad', 'ampDB')
+
+    def __init__(self, *args, derived=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._derived = derived
+
+    def _pending(self):
+        if not self._derived: return []
+        if not (dict.__contains__(self, 'I') and dict.__contains__(self, 'Q')): return []
+        return [key for key in self.DERIVED if not dict.__contains__(self, key)]
+
+    def __missing__(self, key):
+        if key not in self._pending():
+            raise KeyError(key)
+        if key == 'IQ':
+            ctype = np.result_type(self['I'].dtype, np.complex64)
+            value = (self['I'] + self['Q'] * 1j).astype(ctype, copy=False)
+        elif key == 'amp_rad':
+            value = abs(self['IQ'])
+        elif key == 'phase':
+            value = angle(self['IQ'])
+        elif key == 'pha_rad':
+            meanIQ = mean(self['IQ'])
+            value = angle(self['IQ'] / meanIQ) * abs(meanIQ)
+        else:
+            value = log10(self['amp_rad']) * 20
+        dict.__setitem__(self, key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in ('I', 'Q'):
+            for derived in self.DERIVED: dict.pop(self, derived, None)
+        dict.__setitem__(self, key, value)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self._pending()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def _keys(self):
+        return list(dict.keys(self)) + self._pending()
+
+    def keys(self):
+        return KeysView(self)
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def items(self):
+        '''Items view; derived quantities are computed as they are reached.'''
+        return ItemsView(self)
+
+    def values(self):
+        return ValuesView(self)
+
+    def __reduce__(self):
+        # derived quantities are not pickled (computed again on access)
+        return (self.__class__, (dict(dict.items(self)),), {'_derived': self._derived})
+
+    def astype(self, dtype):
+        '''Cast I and Q, their standard deviations (sweeps) and what is derived
+        from them to `dtype`, e.g. np.float32.'''
+        for key in ('I', 'Q', 'I_std', 'Q_std'):
+            if dict.__contains__(self, key):
+                self[key] = self[key].astype(dtype, copy=False)
+        return self
+
 def insert_data(ret, freq, data, ind=0):
     if not freq: return ret
     if not data: return ret
@@ -20,47 +106,120 @@ def insert_data(ret, freq, data, ind=0):
     ret['Q'   ].append(mdata[ind*2+1])
     return ret
 
-def read_rhea_mulswp(fname,miniret=False):
-    return read_rhea_swp(fname,ismult=True,miniret=miniret)
-
-def read_rhea_swp(fname,ismult=False,miniret=False):
-    freq_buf = []
-    data_buf = [None,]
-    ret = None
-    for time, data, tmp, tmp1 in read_file(fname, sync=True):
-        if ret is None:
-            ch_num = int(len(data)/2)
-            ret = [dict() for i in range(ch_num)]
-            for i in range(ch_num):
-                ret[i]['name'] = fname
-                ret[i]['freq'] = []
-                ret[i]['I'   ] = []
-                ret[i]['Q'   ] = []
-                pass
-        if time==0:
-            if freq_buf and not data_buf:
-                continue
-            for i in range(ch_num):
-                ret[i] = insert_data(ret[i], freq_buf, data_buf, ind=i)
-            freq_buf = [d for i, d in enumerate(data) if i%2 == 0]
-            data_buf = []
-        else:
-            data_buf += [data]
-            pass
-        pass
+def _reduce_steps(values, step_id, n_steps):
+    '''Mean, standard deviation and count of `values` rows for each step
+    (rows are sorted by step_id).'''
+    count = np.bincount(step_id, minlength=n_steps)
+    starts = np.concatenate(([0], np.cumsum(count)[:-1]))[count > 0]
+    mean_v = np.full((n_steps, values.shape[1]), np.nan)
+    mean_v[count > 0] = np.add.reduceat(values, starts, axis=0) / count[count > 0, None]
+    dev = values - mean_v[step_id]
+    std_v = np.full_like(mean_v, np.nan)
+    std_v[count > 0] = np.sqrt(np.add.reduceat(dev**2, starts, axis=0) / count[count > 0, None])
+    return mean_v, std_v, count
+
+def _swp_steps_uniform(packets):
+    # Same step logic as reader_swp.py: a packet with time 0 starts a step,
+    # and markers directly following another marker are ignored.
+    packets = packets[packets[:, 0] != HEADER_SYNC]
+    ts = sign_extend(packets[:, 1:6])
+    marker = ts == 0
+    accepted = marker & ~np.concatenate(([False], marker[:-1]))
+    step_id = (np.cumsum(accepted) - 1)[~marker]
+    data = packets[~marker]
+    data, step_id = data[step_id >= 0], step_id[step_id >= 0]
+    n_data = (packets.shape[1] - 7) // 7
+    values = sign_extend(data[:, 6:-1].reshape(len(data), n_data, 7)).astype(float)
+    freq = sign_extend(packets[accepted, 6:-1].reshape(-1, n_data, 7))[:, ::2]
+    mean_v, std_v, count = _reduce_steps(values, step_id, len(freq))
+    return freq[count > 0], mean_v[count > 0], std_v[count > 0], count[count > 0]
+
+def _swp_steps_narrow_marker(buff, marker_size, packet_size):
+    # Off-resonance layout (measure_mulswp with f_off): step markers carry
+    # only the tone channels and are shorter than the data packets.
+    n_mean = 1
+    while True:
+        pos = marker_size + n_mean * packet_size
+        if pos + marker_size > len(buff): break
+        if buff[pos] == HEADER_DATA and buff[pos + marker_size - 1] == FOOTER \
+           and sign_extend(buff[pos + 1:pos + 6]) == 0:
+            break
+        n_mean += 1
+    period = marker_size + n_mean * packet_size
+    n_steps = len(buff) // period
+    steps = [(buff[:n_steps * period].reshape(n_steps, period), n_mean)]
+    tail = buff[n_steps * period:]
+    n_tail = (len(tail) - marker_size) // packet_size
+    if n_tail > 0:
+        tail = tail[:marker_size + n_tail * packet_size]
+        steps.append((tail.reshape(1, -1), n_tail))
+
+    freqs, means, stds, counts = [], [], [], []
+    n_marker_ch = (marker_size - 7) // 7
+    n_data = (packet_size - 7) // 7
+    for step, n_sample in steps:
+        markers = step[:, :marker_size]
+        data = step[:, marker_size:].reshape(-1, packet_size)
+        for packets, headers in [(markers, (HEADER_DATA,)), (data, (HEADER_DATA, HEADER_SGSYNC))]:
+            n_valid, error = check_packets(packets, headers)
+            if error is not None:
+                raise PacketReaderError(f'error : read_rhea_swp.{error}', n_valid)
+        values = sign_extend(data[:, 6:-1].reshape(len(data), n_data, 7)).astype(float)
+        step_id = np.repeat(np.arange(len(step)), n_sample)
+        mean_v, std_v, count = _reduce_steps(values, step_id, len(step))
+        freqs.append(sign_extend(markers[:, 6:-1].reshape(-1, n_marker_ch, 7))[:, ::2])
+        means.append(mean_v)
+        stds.append(std_v)
+        counts.append(count)
+    return tuple(np.concatenate(v) for v in (freqs, means, stds, counts))
+
+def _swp_marker_size(buff, packet_size):
+    if len(buff) < 2 * packet_size or (buff[packet_size - 1] == FOOTER and buff[packet_size] == HEADER_DATA
+                                       and buff[2 * packet_size - 1] == FOOTER):
+        return packet_size
+    n_max = (packet_size - 7) // 14
+    for n_ch in range(1, n_max + 1):
+        size = 7 + 14 * n_ch
+        if size + packet_size > len(buff): break
+        if buff[size - 1] == FOOTER and buff[size] == HEADER_DATA \
+           and buff[size + packet_size - 1] == FOOTER:
+            return size
+    return packet_size
+
+def read_rhea_mulswp(fname,miniret=False,dtype=np.float64):
+    return read_rhea_swp(fname,ismult=True,miniret=miniret,dtype=dtype)
+
+def read_rhea_swp(fname,ismult=False,miniret=False,dtype=np.float64):
+    '''
+    Each sweep step is averaged in bulk. I_std/Q_std are the standard deviations
+    and n_sample the number of packets of each step.
+    Channels without frequency in the step markers (off-resonance tones
+    of measure_mulswp) follow the tone channels, with NaN as freq.
+    '''
+    packet_size = get_packet_size(fname)
+    buff = np.fromfile(fname, dtype=np.uint8)
+    marker_size = _swp_marker_size(buff, packet_size)
+    if marker_size == packet_size:
+        packets = packet_array(buff, packet_size)
+        n_valid, error = check_packets(packets, (HEADER_DATA, HEADER_SGSYNC, HEADER_SYNC))
+        if error is not None:
+            print(PacketReaderError(f'error : read_rhea_swp.{error}', n_valid))
+        freq, mdata, sdata, count = _swp_steps_uniform(packets[:n_valid])
+    else:
+        freq, mdata, sdata, count = _swp_steps_narrow_marker(buff, marker_size, packet_size)
 
+    ch_num = mdata.shape[1] // 2
+    ret = []
     for i in range(ch_num):
-        ret[i] = insert_data(ret[i], freq_buf, data_buf, ind=i)
-        ret[i]['freq'] = array(ret[i]['freq']).astype(float)
-        ret[i]['I']    = array(ret[i]['I']).astype(float) / 200000. / (2**28)
-        ret[i]['Q']    = array(ret[i]['Q']).astype(float) / 200000. / (2**28)
-        if not miniret:
-            ret[i]['IQ']   = ret[i]['I'] + ret[i]['Q'] * 1j
-            ret[i]['amp_rad'] = abs(ret[i]['IQ'])
-            ret[i]['phase'  ] = angle(ret[i]['IQ'])
-            meanIQ = mean(ret[i]['IQ'])
-            ret[i]['pha_rad'] = angle(ret[i]['IQ'] / meanIQ) * abs(meanIQ)
-            ret[i]['ampDB' ]  = log10(ret[i]['amp_rad']) * 20
+        r = RheaData(derived=not miniret)
+        r['name'] = fname
+        r['freq'] = freq[:, i].astype(float) if i < freq.shape[1] else np.full(len(freq), np.nan)
+        r['I']    = mdata[:, 2*i] / 200000. / (2**28)
+        r['Q']    = mdata[:, 2*i+1] / 200000. / (2**28)
+        r['I_std'] = sdata[:, 2*i] / 200000. / (2**28)
+        r['Q_std'] = sdata[:, 2*i+1] / 200000. / (2**28)
+        r['n_sample'] = count
+        ret.append(r.astype(dtype))
         pass
 
     if ismult is True:
@@ -68,95 +227,180 @@ def read_rhea_swp(fname,ismult=False,miniret=False):
     else:
         return ret[0]
 
-def read_rhea_tod(fname,nmax=None, miniret=False):
-    initialize = True
-    for it,(time, data) in enumerate(read_file(fname)):
-        if initialize:
-            initialize = False
-            ch_num = int(len(data)/2)
-            ret = [dict() for i in range(ch_num)]
-            for i in range(ch_num):
-                ret[i]['name'] = fname
-                ret[i]['rate'] = float(time)
-                ret[i]['freq'] = float(data[2*i])
-                ret[i]['time'] = []
-                ret[i]['I']    = []
-                ret[i]['Q']    = []
-                pass
-            pass
-        else:
-            for i in range(ch_num):
-                ret[i]['time'].append(time)
-                ret[i]['I'   ].append(data[2*i])
-                ret[i]['Q'   ].append(data[2*i+1])
-                pass
-            pass
-        pass
-        if nmax is not None and it>nmax: break
-    for i in range(ch_num):
-        ret[i]['time'] = array(ret[i]['time']).astype(float) / ret[i]['rate']
-        ret[i]['I']    = array(ret[i]['I']).astype(float)
-        ret[i]['I']   /= (2**28) * 200.e6 / ret[i]['rate']
-        ret[i]['Q']    = array(ret[i]['Q']).astype(float)
-        ret[i]['Q']   /= (2**28) * 200.e6 / ret[i]['rate']
-        if not miniret:
-            ret[i]['IQ']   = ret[i]['I'] + ret[i]['Q'] * 1j
-            ret[i]['amp_rad'] = abs(ret[i]['IQ'])
-            ret[i]['phase'  ] = angle(ret[i]['IQ'])
-            meanIQ = mean(ret[i]['IQ'])
-            ret[i]['pha_rad'] = angle(ret[i]['IQ'] / meanIQ) * abs(meanIQ)
-            ret[i]['ampDB' ]  = log10(ret[i]['amp_rad']) * 20
-        pass
+class RheaTod:
+    '''Multi-channel TOD sharing one time axis.
 
-    return ret
+    Attributes
+    ----------
+    name : str
+        File name.
+    rate : float
+        Sampling rate in SPS.
+    freq : ndarray
+        Tone frequencies in Hz (n_ch).
+    time : ndarray
+        Time in seconds (n_samples).
+    n_rot, sync_off : ndarray or None
+        Rotation state (n_samples), None without sync.
+    I, Q : ndarray
+        Scaled I and Q (n_ch x n_samples).
 
-def read_rhea_tod_sync(fname, nbegin=0, nmax=None, nstep=1, miniret=False):
-    initialize = True
-    for it, (time, data, n_rot, offset) in enumerate(read_file(fname, sync=True, length=nmax, offset=nbegin, step=nstep)):
-        if initialize:
-            initialize = False
-            ch_num = int(len(data)/2)
-            ret = [dict() for i in range(ch_num)]
-            for i in range(ch_num):
-                ret[i]['name']     = fname
-                ret[i]['rate']     = float(time)
-                ret[i]['freq']     = float(data[2*i])
-                ret[i]['time']     = []
-                ret[i]['n_rot']    = []
-                ret[i]['sync_off'] = []
-                ret[i]['I']        = []
-                ret[i]['Q']        = []
-                pass
-            pass
-        else:
-            for i in range(ch_num):
-                ret[i]['time'    ].append(time)
-                ret[i]['n_rot'   ].append(n_rot)
-                ret[i]['sync_off'].append(offset)
-                ret[i]['I'       ].append(data[2*i])
-                ret[i]['Q'       ].append(data[2*i+1])
-                pass
-            pass
-        pass
+    `tod[i]` gives the per-channel RheaData of the other readers, built as
+    views on these arrays (the shared vectors are the same objects).
+    '''
+    def __init__(self, name, rate, freq, time, I, Q, n_rot=None, sync_off=None, derived=True):
+        self.name = name
+        self.rate = rate
+        self.freq = np.asarray(freq, dtype=float)
+        self.time = time
+        self.n_rot = n_rot
+        self.sync_off = sync_off
+        self.I = I
+        self.Q = Q
+        self._derived = derived
 
-    for i in range(ch_num):
-        ret[i]['time']     = array(ret[i]['time']).astype(float) / ret[i]['rate']
-        ret[i]['n_rot'   ] = array(ret[i]['n_rot']).astype(int)
-        ret[i]['sync_off'] = array(ret[i]['sync_off']).astype(int)
-        ret[i]['I']        = array(ret[i]['I']).astype(float)
-        ret[i]['I']       /= (2**28) * 200.e6 / ret[i]['rate']
-        ret[i]['Q']        = array(ret[i]['Q']).astype(float)
-        ret[i]['Q']       /= (2**28) * 200.e6 / ret[i]['rate']
-        if not miniret:
-            ret[i]['IQ']      = ret[i]['I'] + ret[i]['Q'] * 1j
-            ret[i]['amp_rad'] = abs(ret[i]['IQ'])
-            ret[i]['phase'  ] = angle(ret[i]['IQ'])
-            meanIQ = mean(ret[i]['IQ'])
-            ret[i]['pha_rad'] = angle(ret[i]['IQ'] / meanIQ) * abs(meanIQ)
-            ret[i]['ampDB' ]  = log10(ret[i]['amp_rad']) * 20
-        pass
+    @property
+    def n_ch(self):
+        return len(self.freq)
 
-    return ret
+    def __len__(self):
+        return self.n_ch
+
+    def __getitem__(self, ch):
+        return self.channel(ch)
+
+    def __iter__(self):
+        return (self.channel(ch) for ch in range(self.n_ch))
+
+    @property
+    def table(self):
+        '''Per-channel metadata (ch, freq, rate) as a record array.'''
+        return np.rec.fromarrays([np.arange(self.n_ch), self.freq, np.full(self.n_ch, self.rate)],
+                                 names='ch,freq,rate')
+
+    def channel(self, ch, copy=False):
+        '''Per-channel RheaData.
+
+        Parameters
+        ----------
+        ch : int
+            Channel index.
+        copy : bool, optional
+            Give the channel its own copy of time/n_rot/sync_off
+            (I and Q stay views).
+        '''
+        _copy = (lambda v: v.copy()) if copy else (lambda v: v)
+        ret = RheaData(derived=self._derived)
+        ret['name'] = self.name
+        ret['rate'] = self.rate
+        ret['freq'] = float(self.freq[ch])
+        ret['time'] = _copy(self.time)
+        if self.n_rot is not None:
+            ret['n_rot'   ] = _copy(self.n_rot)
+            ret['sync_off'] = _copy(self.sync_off)
+        ret['I'] = self.I[ch]
+        ret['Q'] = self.Q[ch]
+        return ret
+
+    def astype(self, dtype):
+        '''Cast I and Q to `dtype`, e.g. np.float32.'''
+        self.I = self.I.astype(dtype, copy=False)
+        self.Q = self.Q.astype(dtype, copy=False)
+        return self
+
+def _tod_from_arrays(fname, rate, header, time, data, n_rot, sync_off, miniret):
+    rate = float(rate)
+    scale = (2**28) * 200.e6 / rate
+    I = np.ascontiguousarray(data[:, 0::2].T, dtype=float) # rows of a channel contiguous
+    I /= scale
+    Q = np.ascontiguousarray(data[:, 1::2].T, dtype=float)
+    Q /= scale
+    return RheaTod(fname, rate, header[0::2], time.astype(float) / rate, I, Q,
+                   n_rot=None if n_rot is None else n_rot.astype(int),
+                   sync_off=None if sync_off is None else sync_off.astype(int),
+                   derived=not miniret)
+
+def _tod_from_cache(fname, cols, sel, sync, miniret):
+    return RheaTod(fname, cols.rate, cols.freq, cols.column('time')[sel],
+                   cols.column('I')[:, sel], cols.column('Q')[:, sel],
+                   n_rot=cols.column('n_rot')[sel] if sync else None,
+                   sync_off=cols.column('sync_off')[sel] if sync else None,
+                   derived=not miniret)
+
+def _load_cache(fname, cache, whole, **kwargs):
+    '''Columnar cache for the readers; None when it is not used or cannot be created.'''
+    if not cache: return None
+    try:
+        return load_cache(fname, create=cache == 'create' and whole, **kwargs)
+    except CacheError:
+        return None
+
+def read_rhea_tod(fname,nmax=None, miniret=False, cache=True, dtype=np.float64, shared=False):
+    '''
+    Derived quantities (IQ, amp_rad, ...) are computed on first access.
+    dtype: np.float32 gives float32 I/Q and complex64 IQ.
+    cache: use the columnar cache (rhea_cache) of the file if it exists;
+           'create' also creates it when the whole file is read
+           (not for a file with SYNC packets, which this reader rejects).
+    shared: return a RheaTod (n_ch x n_samples I/Q, one time axis)
+            instead of a list of per-channel dicts.
+    '''
+    length = None if nmax is None else nmax + 1
+    cols = _load_cache(fname, cache, nmax is None, allow_sync=False)
+    if cols is not None and cols.n_sync == 0:
+        tod = _tod_from_cache(fname, cols, slice(0, length), sync=False, miniret=miniret)
+    else:
+        (rate, header), time, data, _, _ = read_iq_arrays(fname, length=length)
+        tod = _tod_from_arrays(fname, rate, header, time, data, None, None, miniret)
+
+    tod.astype(dtype)
+    if shared:
+        return tod
+    return [tod.channel(i, copy=True) for i in range(tod.n_ch)]
+
+def read_rhea_tod_sync(fname, nbegin=0, nmax=None, nstep=1, miniret=False, n_workers=1, cache=True,
+                       t_start=None, t_stop=None, dtype=np.float64, shared=False):
+    '''
+    nbegin: number of data packets skipped (SYNC packets are not counted);
+            the same samples are returned for any n_workers, cache or index.
+    Derived quantities (IQ, amp_rad, ...) are computed on first access.
+    dtype: np.float32 gives float32 I/Q and complex64 IQ.
+    n_workers > 1 (or None for all CPUs) decodes the file with several processes.
+    cache: use the columnar cache (rhea_cache) of the file if it exists;
+           'create' also creates it (decoded with n_workers) when the whole
+           file is read.
+    t_start, t_stop: read only t_start <= time < t_stop, in seconds or as datetime
+                     (nbegin and nmax are ignored, nstep is applied to the window).
+    shared: return a RheaTod (n_ch x n_samples I/Q, one time/n_rot/sync_off)
+            instead of a list of per-channel dicts.
+    '''
+    window = t_start is not None or t_stop is not None
+    whole = nbegin == 0 and nmax is None and nstep == 1 and not window
+    cols = _load_cache(fname, cache, whole, n_workers=n_workers)
+    if cols is not None:
+        if window:
+            with RawDataFile(fname) as rawfile:
+                t_start, t_stop = rawfile.to_seconds(t_start), rawfile.to_seconds(t_stop)
+            time = cols.column('time')
+            nbegin = 0 if t_start is None else int(np.searchsorted(time, t_start))
+            stop = None if t_stop is None else int(np.searchsorted(time, t_stop))
+        else:
+            stop = None if nmax is None else nbegin + nmax * nstep
+        tod = _tod_from_cache(fname, cols, slice(nbegin, stop, nstep), sync=True, miniret=miniret)
+    else:
+        if window:
+            (rate, header), time, data, n_rot, offset = read_time_window(fname, t_start, t_stop)
+            time, data, n_rot, offset = time[::nstep], data[::nstep], n_rot[::nstep], offset[::nstep]
+        else:
+            reader = read_iq_arrays if n_workers == 1 else partial(decode_file, n_workers=n_workers)
+            (rate, header), time, data, n_rot, offset = reader(fname, sync=True, length=nmax,
+                                                               offset=nbegin, step=nstep)
+        tod = _tod_from_arrays(fname, rate, header, time, data, n_rot, offset, miniret)
+
+    tod.astype(dtype)
+    if shared:
+        return tod
+    return [tod.channel(i, copy=True) for i in range(tod.n_ch)]
 
 
 def read_rhea_sgswp(fname):
@@ -199,6 +443,38 @@ def read_rhea_sgswp(fname):
 
     return ret
 
+def read_rhea_sgswp_stream(fname, tod=False, **kwargs):
+    '''
+    Streaming version of read_rhea_sgswp: the file is averaged chunk by chunk
+    and only the averaged products are kept (see ReadSgSwp.average_sgswp_file,
+    which also lists how its runs and step windows differ from read_rhea_sgswp).
+    ret includes
+    name, rate, freq, f_start, f_stop, f_step, n_swp_run : len=1
+    swp_freq                                             : array of len=#_of_swp_step.
+    *_avr, I_std, Q_std, n_sample                        : array of (#_of_swp_run, #_of_swp_step).
+    time, n_rot, sync_off, sg_freq, I, Q                 : only if tod is True.
+    '''
+    ret = average_sgswp_file(fname, keep_tod=tod, **kwargs)
+    for i in range(len(ret)):
+        scale = (2**28) * 200.e6 / ret[i]['rate']
+        if tod:
+            ret[i]['time']     = ret[i]['time'].astype(float) / ret[i]['rate']
+            ret[i]['I']        = ret[i]['I'].astype(float) / scale
+            ret[i]['Q']        = ret[i]['Q'].astype(float) / scale
+        ret[i]['I_avr']   = ret[i]['I_avr'] / scale
+        ret[i]['Q_avr']   = ret[i]['Q_avr'] / scale
+        ret[i]['I_std']   = ret[i]['I_std'] / scale
+        ret[i]['Q_std']   = ret[i]['Q_std'] / scale
+        ret[i]['IQ_avr']  = ret[i]['I_avr'] + ret[i]['Q_avr'] * 1j
+        ret[i]['amp_rad_avr'] = abs(ret[i]['IQ_avr'])
+        ret[i]['phase_avr'  ] = angle(ret[i]['IQ_avr'])
+        meanIQ_avr            = mean(ret[i]['IQ_avr'])
+        ret[i]['pha_rad_avr'] = angle(ret[i]['IQ_avr'] / meanIQ_avr) * abs(meanIQ_avr)
+        ret[i]['amp_dBm_avr'] = log10(ret[i]['amp_rad_avr']) * 20 + 10
+        pass
+
+    return ret
+
 class RheaFileType(str, Enum):
     swp = 'swp'
     tod = 'tod'
@@ -207,7 +483,7 @@ class RheaHeader:
     def __init__(self, path):
         self.path = Path(path)
         file_dsc = read_file(self.path)
-        t, data_0 = next(file_dsc)
+        t, data_0 = next(file_dsc)[0:2]
         file_dsc.close()
         
         self.n_ch = len(data_0)/2
@@ -7,6 +7,8 @@ import sys
 import numpy as np
 
 from fpga_control  import FPGAControl
+from acquisition import Acquisition
+from raw_writer import RawWriter
 from packet_reader import read_packet_in_swp
 from common import two_div, packet_size
 
@@ -97,11 +99,11 @@ def measure_mulswp(fpga:FPGAControl, max_ch, dds_f_megahz, width, step, fname,
     print(f'Input len: {input_len}')
     fpga.iq_setting.set_read_width(input_len)
 
-    file_desc = open(fname, 'wb')
-    fpga.tcp.clear()
-
     dfreqs = np.arange(-width/2, width/2, step)
 
+    file_desc = RawWriter(fname, size=len(dfreqs) * (psize + cnt_finish))
+    fpga.tcp.clear()
+
     try:
         for dfreq in dfreqs:
             _vprint(f'{dfreq:8.3f} MHz')
@@ -113,7 +115,6 @@ def measure_mulswp(fpga:FPGAControl, max_ch, dds_f_megahz, width, step, fname,
                 input_freqs = freq_hzs * num_list
                 input_freqs += [0]*(max_ch - len(input_freqs))
 
-            cnt = 0
 
             while True:
                 fpga.dds_setting.set_freqs(input_freqs)
@@ -148,16 +149,7 @@ def measure_mulswp(fpga:FPGAControl, max_ch, dds_f_megahz, width, step, fname,
             dummy_packet += b'\xee'        # footer
             file_desc.write(dummy_packet)
 
-            while True:
-                buff = fpga.tcp.read(min(1024, cnt_finish - cnt))
-                file_desc.write(buff)
-
-                if len(buff) == 0:
-                    break
-
-                cnt += len(buff)
-                if cnt >= cnt_finish:
-                    break
+            Acquisition(fpga.tcp, [file_desc], length=cnt_finish, buff_size=cnt_finish).run()
 
             fpga.iq_setting.iq_off()
 
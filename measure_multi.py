@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+'''Synchronized TOD measurement with several boards.
+
+All boards are configured in parallel, their timestamps are reset and their
+IQ streams are turned on in one round of RBCP requests, and each board is
+recorded to its own file `tod_<run ID>_<name>.rawdata`. The run is described
+in `run_<run ID>.json`: configuration, host times of the start requests and
+replies, and per-board throughput and data loss (timestamp gaps and
+realignments found by `PacketValidator`, and the FIFO error flag of the
+firmware).
+
+The configuration is a JSON file:
+    {"time": 60,
+     "boards": [{"name": "a", "ip_address": "192.168.10.16", "freqs": [10.0, -20.0], "rate": 1},
+                {"name": "b", "ip_address": "192.168.10.17", "freqs": [5.5], "rate": 10,
+                 "amps": [0.5], "power": 2}]}
+Optional keys of a board: rbcp_port, tcp_port, amps, phases, power,
+swap_dac, swap_adc. `dummy_fpga.py` provides local stand-ins:
+    $ python3 dummy_fpga.py -n 2 &
+    $ python3 measure_multi.py boards.json   # with "ip_address": "127.0.0.1" and the ports
+'''
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from math import floor
+from struct import pack
+from time import strftime, time, perf_counter
+from pathlib import Path
+from argparse import ArgumentParser
+import sys
+
+from async_fpga_control import AsyncFPGAControl
+from iq_setting import IQ_STATUS, IQ_RESET_TS
+from tone_conf import ToneConf
+from common import two_div, packet_size
+from acquisition import PacketValidator, ACQ_BUFF_SIZE, LOG_SUFFIX
+from raw_writer import RawWriter
+from rhea_pkg import IP_ADDRESS_DEFAULT, RBCP_PORT_DEFAULT, TCP_PORT_DEFAULT, RATE_KSPS_DEFAULT
+
+TIME_DEFAULT = 10 # sec
+READ_RATE = 0.1   # sec of data per read
+N_BUFF = 16       # read buffers per board
+
+
+class MultiError(Exception):
+    '''Raised when error happens during multi-board measurement.'''
+
+
+class BoardConfig:
+    '''Measurement configuration of a board.
+
+    Parameters
+    ----------
+    name : str
+        Board name used in the file name.
+    freqs : list of float
+        Tone frequencies in MHz.
+    rate : int
+        Sampling rate in kSPS.
+    amps, phases : list of float, optional
+        Tone amplitudes and DDS initial phases in radian.
+    power : int
+        Number of DDSes used for each tone.
+    ip_address : str
+        IP address.
+    rbcp_port, tcp_port : int
+        Port numbers.
+    swap_dac, swap_adc : bool
+        Whether I and Q for DAC/ADC are swapped or not.
+    '''
+    def __init__(self, name, freqs, rate=RATE_KSPS_DEFAULT, amps=None, phases=None, power=1,
+                 ip_address=IP_ADDRESS_DEFAULT, rbcp_port=RBCP_PORT_DEFAULT,
+                 tcp_port=TCP_PORT_DEFAULT, swap_dac=True, swap_adc=True):
+        self.name = name
+        self.freqs = [float(f) for f in freqs]
+        self.rate = int(rate)
+        self.amps = [1.] * len(self.freqs) if amps is None else [float(a) for a in amps]
+        self.phases = [0.] * len(self.freqs) if phases is None else [float(p) for p in phases]
+        self.power = int(power)
+        self.ip_address = ip_address
+        self.rbcp_port = int(rbcp_port)
+        self.tcp_port = int(tcp_port)
+        self.swap_dac = swap_dac
+        self.swap_adc = swap_adc
+
+        if len(self.freqs) == 0:
+            raise MultiError(f'{name}: no frequency.')
+        if len(self.amps) != len(self.freqs):
+            raise MultiError(f'{name}: # of input amp must be same as # of input freqs.')
+        if len(self.phases) != len(self.freqs):
+            raise MultiError(f'{name}: # of input phase must be same as # of input freqs.')
+        if self.rate <= 0 or 200000 % self.rate != 0:
+            raise MultiError(f'{name}: sampling rate [kSPS] should be a divisor of 200000: '
+                             f'input rate = {self.rate} kSPS')
+
+        # the read width is a power of two
+        while len(self.freqs) & (len(self.freqs) - 1):
+            self.freqs.append(0.)
+            self.amps.append(0.)
+            self.phases.append(0.)
+
+    @classmethod
+    def from_dict(cls, conf, index=0):
+        conf = dict(conf)
+        conf.setdefault('name', f'board{index}')
+        return cls(**conf)
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in
+                ['name', 'freqs', 'rate', 'amps', 'phases', 'power', 'ip_address',
+                 'rbcp_port', 'tcp_port', 'swap_dac', 'swap_adc']}
+
+    @property
+    def packet_size(self):
+        return packet_size(len(self.freqs))
+
+    def check(self, max_ch):
+        '''Check the number of channels against the firmware.'''
+        n_tone = len(self.freqs)
+        if n_tone > max_ch:
+            raise MultiError(f'{self.name}: too many frequencies! = {n_tone} / {max_ch}')
+        if self.power > 0 and 2**two_div(n_tone) * self.power > max_ch:
+            raise MultiError(f'{self.name}: exceeding max # of channels = '
+                             f'{n_tone}*{self.power} > {max_ch}')
+
+    def tone_conf(self, max_ch):
+        return ToneConf(max_ch, self.freqs, phases=self.phases, amps=self.amps, power=self.power)
+
+    def header_packet(self):
+        '''Header packet of the TOD file (see measure_tod).'''
+        packet = b'\xff' + b'\x00' + pack('>I', self.rate * 1000)
+        for freq in self.freqs:
+            freq_hz = int(floor(freq * 1e6 + 0.5))
+            freq_packet = (b'\x00' * 3) if freq_hz >= 0 else (b'\xff' * 3)
+            freq_packet += pack('>i', freq_hz)
+            packet += freq_packet * 2
+        return packet + b'\xee'
+
+
+def load_config(path):
+    '''Read a JSON configuration.
+
+    Returns
+    -------
+    boards : list of BoardConfig
+        Board configurations.
+    time : float or None
+        Measurement time in seconds if given.
+    '''
+    with open(path, encoding='utf-8') as conf_file:
+        conf = json.load(conf_file)
+    if isinstance(conf, list):
+        conf = {'boards': conf}
+    boards = [BoardConfig.from_dict(board, k) for k, board in enumerate(conf['boards'])]
+    names = [board.name for board in boards]
+    if len(set(names)) != len(names):
+        raise MultiError('board names must be unique.')
+    return boards, conf.get('time')
+
+
+class BoardRun:
+    '''Acquisition of one board in a multi-board run.
+
+    Parameters
+    ----------
+    conf : BoardConfig
+        Board configuration.
+    fname : str
+        Output file name.
+    n_packets : int
+        Number of packets to be recorded.
+    '''
+    def __init__(self, conf, fname, n_packets):
+        self.conf = conf
+        self.fname = fname
+        self.n_packets = n_packets
+        self.board = AsyncFPGAControl(conf.ip_address, rbcp_port=conf.rbcp_port,
+                                      tcp_port=conf.tcp_port)
+        self.validator = PacketValidator(conf.packet_size, str(fname) + LOG_SUFFIX)
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._pending = set()
+        self._error = None
+        self._stop = False
+        self._file = None
+
+        self.t_arm = None   # host time when the stream start was requested
+        self.t_armed = None # host time when the firmware acknowledged it
+        self.t_stop = None
+        self.n_bytes = 0
+        self.elapsed = 0.
+        self.fifo_error = None
+
+    async def setup(self):
+        '''Connect, initialize and configure the board, and write the file header.'''
+        conf = self.conf
+        await self.board.connect()
+        conf.check(self.board.max_ch)
+        await self.board.init(swap_dac=conf.swap_dac, swap_adc=conf.swap_adc)
+        await self.board.configure(conf.tone_conf(self.board.max_ch), conf.rate)
+        header = conf.header_packet()
+        self._file = RawWriter(self.fname, size=len(header) + conf.packet_size * self.n_packets)
+        self._file.write(header)
+        await self.board.tcp.clear()
+
+    async def arm(self, t_arm):
+        '''Turn on the IQ stream (RBCP write issued without a thread hop).'''
+        self.t_arm = t_arm
+        await self.board.rbcp.write_intn(IQ_STATUS, 1, 1)
+        self.t_armed = time()
+
+    def _write(self, buff, n_read):
+        self._file.write(self.validator.feed(memoryview(buff)[:n_read]))
+
+    def _written(self, future, buff, free):
+        self._pending.discard(future)
+        if future.exception() is not None and self._error is None:
+            self._error = future.exception()
+        free.put_nowait(buff)
+
+    async def acquire(self):
+        '''Record `n_packets` packets (fewer if the stream pauses).'''
+        loop = asyncio.get_running_loop()
+        psize = self.conf.packet_size
+        length = psize * self.n_packets
+        size = min(max(int(psize * self.conf.rate * 1000 * READ_RATE), 1024), ACQ_BUFF_SIZE)
+        free = asyncio.Queue()
+        for _ in range(N_BUFF):
+            free.put_nowait(bytearray(size))
+
+        start = perf_counter()
+        try:
+            while self.n_bytes < length and self._error is None and not self._stop:
+                buff = await free.get()
+                request = min(size, length - self.n_bytes)
+                n_read = await self.board.read_into(memoryview(buff)[:request])
+                self.n_bytes += n_read
+                future = loop.run_in_executor(self._writer, self._write, buff, n_read)
+                self._pending.add(future)
+                future.add_done_callback(lambda f, b=buff: self._written(f, b, free))
+                if n_read < request:
+                    print(f'{self.conf.name}: stream stopped', file=sys.stderr)
+                    break
+                pass
+        finally:
+            self.elapsed = perf_counter() - start
+        if self._error is not None:
+            raise MultiError(f'{self.conf.name}: write error: {self._error}') from self._error
+
+    def stop(self):
+        '''Stop `acquire` before its next read (a cancellation can be lost when
+        it coincides with a completed read).'''
+        self._stop = True
+
+    async def finish(self):
+        '''Stop the stream, flush the file and read the FIFO error flag.'''
+        try:
+            await self.board.iq_off()
+            self.t_stop = time()
+            self.fifo_error = await self.board.call(lambda: self.board.fpga.iq_setting.fifo_error)
+            await self.board.call(self.board.fpga.dac_setting.txenable_off)
+        finally:
+            if self._pending:
+                await asyncio.wait(list(self._pending))
+            self._writer.shutdown()
+            self.validator.close()
+            if self._file is not None:
+                self._file.close()
+            self.board.close()
+
+    @property
+    def n_expected(self):
+        '''Packets expected from the sampling rate during the acquisition.'''
+        return int(self.elapsed * self.conf.rate * 1000)
+
+    def summary(self):
+        stats = self.validator
+        return dict(self.conf.as_dict(), fname=str(self.fname),
+                    t_arm=self.t_arm, t_armed=self.t_armed, t_stop=self.t_stop,
+                    n_bytes=self.n_bytes, elapsed=self.elapsed,
+                    n_packets=stats.n_packets, n_expected=self.n_expected,
+                    n_dropped=stats.n_dropped, n_gaps=stats.n_gaps,
+                    n_realign=stats.n_realign, n_skipped=stats.n_skipped,
+                    first_ts=stats.first_ts, last_ts=stats.last_ts, fifo_error=self.fifo_error)
+
+    def report(self):
+        rate = self.n_bytes / self.elapsed / 1e6 if self.elapsed > 0 else 0.
+        stats = self.validator
+        pps = stats.n_packets / self.elapsed if self.elapsed > 0 else 0.
+        return (f'{self.conf.name}: {stats.n_packets} packets in {self.elapsed:.2f} s '
+                f'({rate:.2f} MB/s, {pps:.0f}/{self.conf.rate * 1000} packets/s), '
+                f'dropped: {stats.n_dropped} in {stats.n_gaps} gaps, '
+                f'realigned: {stats.n_realign}, fifo error: {self.fifo_error}')
+
+
+async def measure_multi(boards, meas_time, run_id=None, outdir='.', verbose=True):
+    '''Synchronized TOD measurement.
+
+    Parameters
+    ----------
+    boards : list of BoardConfig
+        Board configurations.
+    meas_time : float
+        Measurement time in seconds.
+    run_id : str, optional
+        Run ID shared by the files (default: start date and time).
+    outdir : str or Path
+        Output directory.
+
+    Returns
+    -------
+    summary : dict
+        Contents of the run file.
+    '''
+    def _vprint(*pargs, **pkwargs):
+        if verbose:
+            print(*pargs, **pkwargs)
+
+    if run_id is None:
+        run_id = strftime('%Y-%m%d-%H%M%S')
+    outdir = Path(outdir)
+    runs = [BoardRun(conf, outdir / f'tod_{run_id}_{conf.name}.rawdata',
+                     int(meas_time * conf.rate * 1000)) for conf in boards]
+    for run in runs:
+        if run.fname.exists():
+            raise MultiError(f'{run.fname} exists.')
+    summary = {'run_id': run_id, 'time': meas_time}
+
+    try:
+        errors = [err for err in await asyncio.gather(*[run.setup() for run in runs],
+                                                      return_exceptions=True)
+                  if isinstance(err, BaseException)]
+        if errors:
+            raise errors[0]
+        _vprint(f'run {run_id}: {len(runs)} boards configured')
+
+        # reset the timestamps, then start all streams in one round of requests
+        await asyncio.gather(*[run.board.rbcp.write_intn(IQ_RESET_TS, 1, 1) for run in runs])
+        t_arm = time()
+        await asyncio.gather(*[run.arm(t_arm) for run in runs])
+        summary['t_arm'] = t_arm
+        summary['arm_spread'] = max(run.t_armed for run in runs) - t_arm
+        _vprint(f'streams started within {summary["arm_spread"] * 1e3:.2f} ms')
+
+        # on the first failure the other boards are cancelled before finish()
+        # turns the streams off and closes the sockets under them
+        tasks = [asyncio.create_task(run.acquire()) for run in runs]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        except asyncio.CancelledError:
+            print('stop measurement')
+        finally:
+            for run, task in zip(runs, tasks):
+                run.stop()
+                task.cancel()
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        errors = [err for err in results if isinstance(err, Exception)]
+        if errors:
+            raise errors[0]
+    finally:
+        await asyncio.gather(*[run.finish() for run in runs], return_exceptions=True)
+        summary['boards'] = [run.summary() for run in runs]
+        with open(outdir / f'run_{run_id}.json', 'w', encoding='utf-8') as run_file:
+            json.dump(summary, run_file, indent=2)
+        for run in runs:
+            _vprint(run.report())
+        _vprint(f'write run summary to {outdir / f"run_{run_id}.json"}')
+    return summary
+
+
+def main():
+    '''Multi-board TOD measurement'''
+    parser = ArgumentParser()
+
+    parser.add_argument('config',
+                        type=str,
+                        help='JSON file of the board configurations.')
+
+    parser.add_argument('-t', '--time',
+                        type=float,
+                        default=None,
+                        help=f'measurement time in sec. (default: config or {TIME_DEFAULT})')
+
+    parser.add_argument('-o', '--outdir',
+                        type=str,
+                        default='.',
+                        help='output directory. (default=.)')
+
+    parser.add_argument('--run_id',
+                        type=str,
+                        default=None,
+                        help='run ID. (default=start date and time)')
+
+    args = parser.parse_args()
+
+    try:
+        boards, conf_time = load_config(args.config)
+    except (MultiError, KeyError, TypeError, ValueError) as err:
+        print(f'invalid configuration: {err}')
+        sys.exit(1)
+
+    meas_time = args.time if args.time is not None else (conf_time or TIME_DEFAULT)
+    try:
+        asyncio.run(measure_multi(boards, meas_time, run_id=args.run_id, outdir=args.outdir))
+    except MultiError as err:
+        print(err)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,8 @@ from sg_sweep_sync import Sweep
 ## constant
 #from fpga_control import fpga_control
 from fpga_control  import FPGAControl
+from acquisition import Acquisition, PacketValidator, ACQ_BUFF_SIZE, LOG_SUFFIX
+from raw_writer import RawWriter
 
 class FUnit(object):
     mHz, Hz, kHz, MHz, GHz = 1e-3, 1.0, 1e+3, 1e+6, 1e+9
@@ -76,8 +78,6 @@ def measure_sgswp(fpga,
 
     fpga.ds_setting.set_accum(floor(200000 / rate_kSPS+0.5))
 
-    f = open(fname, 'wb')
-
     ## write header
     dummy_packet  = b'\xaa' # header
     dummy_packet += b'\x00' + pack('>I', rate_kSPS * 1000) # timestamp
@@ -93,13 +93,25 @@ def measure_sgswp(fpga,
         dummy_packet += swp_packet
         pass
     dummy_packet += b'\xee' # footer
-    f.write(dummy_packet)
 
-    cnt = 0
     packet_size = 7 + 7 * 2 * len(dds_f_MHz)
     cnt_finish = packet_size * data_length
+
+    f = RawWriter(fname, size=len(dummy_packet) + cnt_finish)
+    f.write(dummy_packet)
     cnt_step = packet_size * rate_kSPS * 1000
     cnt_print = cnt_step
+    buffsize = min(max(1024, cnt_step // 10), ACQ_BUFF_SIZE)
+
+    def _progress(cnt):
+        nonlocal cnt_print
+        while cnt >= cnt_print:
+            print(round(cnt_print/cnt_step), '/', round(cnt_finish/cnt_step))
+            cnt_print += cnt_step
+            pass
+
+    acq = Acquisition(fpga.tcp, [f], length=cnt_finish, buff_size=buffsize, progress=_progress,
+                      validator=PacketValidator(packet_size, fname + LOG_SUFFIX))
 
     fpga.tcp.clear()
     fpga.iq_setting.iq_on()
@@ -107,23 +119,14 @@ def measure_sgswp(fpga,
     tmp = swp.send_command()
 
     try:
-        while True:
-            buff = fpga.tcp.read(min(1024, cnt_finish - cnt))
-            f.write(buff)
-            if not len(buff): break
-            cnt += len(buff)
-            while cnt >= cnt_print:
-                print(round(cnt_print/cnt_step), '/', round(cnt_finish/cnt_step))
-                cnt_print += cnt_step
-                pass
-            if cnt >= cnt_finish: break
-            pass
+        acq.run()
     except KeyboardInterrupt:
         print('stop measurement')
     finally:
         f.close()
         fpga.iq_setting.iq_off()
         fpga.dac_setting.txenable_off()
+        print(acq.report())
         print(f'write raw data to {fname}')
         pass
 
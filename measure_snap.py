@@ -10,6 +10,8 @@ source_default = 'IQ'
 
 ## constant
 from fpga_control import FPGAControl
+from acquisition import Acquisition
+from raw_writer import RawWriter
 fpga = FPGAControl()
 MAX_CH = fpga.max_ch
 
@@ -35,7 +37,7 @@ def measure_snap(dds_f_MHz, source, channel, fname):
     fpga.dds_setting.set_freqs([freq * 1e6 for freq in dds_f_MHz])
     fpga.snap_setting.set_src(source, channel)
 
-    f = open(fname, 'wb')
+    f = RawWriter(fname, size=cnt_finish)
 
     ## write header
     for ch, freq in enumerate(dds_f_MHz):
@@ -49,27 +51,26 @@ def measure_snap(dds_f_MHz, source, channel, fname):
         f.write(dummy_packet)
         pass
 
-    cnt = 0
     cnt_print = cnt_step
-    empty_count = 0
 
-    fpga.tcp.clear()
-    fpga.snap_setting.snap_on()
-
-    while True:
-        buff = fpga.tcp.read(1024)
-        f.write(buff)
-        if not len(buff): break
-        cnt += len(buff)
+    def _progress(cnt):
+        nonlocal cnt_print
         while cnt >= cnt_print:
             print(cnt_print)
             cnt_print += cnt_step
             pass
-        if cnt >= cnt_finish: break
-        pass
 
-    f.close()
-    fpga.dac_setting.txenable_off()
+    acq = Acquisition(fpga.tcp, [f], length=cnt_finish, buff_size=cnt_step, progress=_progress)
+
+    fpga.tcp.clear()
+    fpga.snap_setting.snap_on()
+
+    try:
+        acq.run()
+    finally:
+        f.close()
+        fpga.dac_setting.txenable_off()
+    print(acq.report())
     print(f'write raw data to {fname}')
 
 
@@ -8,6 +8,8 @@ from argparse import ArgumentParser
 import numpy as np
 
 from fpga_control  import FPGAControl
+from acquisition import Acquisition
+from raw_writer import RawWriter
 from packet_reader import read_packet_in_swp
 from common import packet_size
 
@@ -46,14 +48,14 @@ def measure_swp(fpga:FPGAControl, max_ch, f_start, f_end, f_step, fname, power,
     fpga.iq_setting.set_read_width(1)
     cnt_finish = packet_size(1) * 10
 
-    file_desc = open(fname, 'wb')
+    n_step = len(np.arange(f_start, f_end, f_step))
+    file_desc = RawWriter(fname, size=n_step * (packet_size(1) + cnt_finish))
     fpga.tcp.clear()
 
     try:
         for freq in np.arange(f_start, f_end, f_step):
             _vprint(f'{freq:8.3f} MHz')
             freq_hz = int(np.floor(freq * 1e6 + 0.5))
-            cnt = 0
 
             while True:
                 fpga.dds_setting.set_freqs([freq_hz] * power + [0.] * (max_ch - power))
@@ -85,16 +87,7 @@ def measure_swp(fpga:FPGAControl, max_ch, f_start, f_end, f_step, fname, power,
             dummy_packet += b'\xee'        # footer
             file_desc.write(dummy_packet)
 
-            while True:
-                buff = fpga.tcp.read(min(1024, cnt_finish - cnt))
-                file_desc.write(buff)
-
-                if len(buff) == 0:
-                    break
-
-                cnt += len(buff)
-                if cnt >= cnt_finish:
-                    break
+            Acquisition(fpga.tcp, [file_desc], length=cnt_finish, buff_size=cnt_finish).run()
 
             fpga.iq_setting.iq_off()
     except KeyboardInterrupt:
@@ -9,6 +9,10 @@ import sys
 
 from fpga_control import FPGAControl
 from common import two_div, packet_size
+from acquisition import Acquisition, PacketValidator, ACQ_BUFF_SIZE, LOG_SUFFIX
+from raw_writer import RawWriter, RotatingWriter, rotated_name
+from splice_capture import SpliceCapture
+from acq_monitor import AcquisitionMonitor, METRICS_SUFFIX
 
 ## config
 CNT_STEP_PER_SEC    = 1
@@ -21,7 +25,8 @@ class TODError(Exception):
 
 ## main
 def measure_tod(fpga:FPGAControl, max_ch, dds_f_megahz, data_length,
-                rate_ksps, power, fname, amps=None, phases=None, verbose=True, swap_dac=True, swap_adc=True):
+                rate_ksps, power, fname, amps=None, phases=None, verbose=True, swap_dac=True, swap_adc=True,
+                splice=False, metrics=False, prom_path=None, rotate_size=None, rotate_interval=None):
     '''Measure time-ordered data.
 
     Parameters
@@ -32,8 +37,8 @@ def measure_tod(fpga:FPGAControl, max_ch, dds_f_megahz, data_length,
         number of DDS channels in FPGA.
     dds_f_megahz : list of float
         DDS frequency in MHz.
-    data_length : int
-        Data acquisition length.
+    data_length : int or None
+        Data acquisition length (None: until interrupted, with rotation).
     rate_ksps : int
         Data sampling rate in kHz.
     power : int
@@ -48,6 +53,16 @@ def measure_tod(fpga:FPGAControl, max_ch, dds_f_megahz, data_length,
         Whether I and Q for DAC are swapped or not.
     swap_adc : boolean, optional
         Whether I and Q for ADC are swapped or not.
+    splice : boolean, optional
+        Record the stream with `SpliceCapture` (data stay in the kernel).
+    metrics : boolean, optional
+        Write live metrics to `fname` + METRICS_SUFFIX (JSON lines).
+    prom_path : str, optional
+        Write live metrics to this file in the Prometheus text format.
+    rotate_size : float, optional
+        Switch to a new file every `rotate_size` MB (see `RotatingWriter`).
+    rotate_interval : float, optional
+        Switch to a new file every `rotate_interval` seconds.
     '''
     def _vprint(*pargs, **pkwargs):
         if verbose:
@@ -55,6 +70,12 @@ def measure_tod(fpga:FPGAControl, max_ch, dds_f_megahz, data_length,
 
     _vprint('TOD MESUREMENT.')
 
+    rotate = rotate_size is not None or rotate_interval is not None
+    if rotate and splice:
+        raise TODError('file rotation is not supported with splice')
+    if data_length is None and not rotate:
+        raise TODError('data length is required without file rotation')
+
     if amps is None:
         amps = [1.]*len(dds_f_megahz)
 
@@ -99,8 +120,6 @@ def measure_tod(fpga:FPGAControl, max_ch, dds_f_megahz, data_length,
 
     fpga.ds_setting.set_accum(floor(200000 / rate_ksps+0.5))
 
-    file_desc = open(fname, 'wb')
-
     ## write header
     dummy_packet  = b'\xff'
     dummy_packet += b'\x00' + pack('>I', rate_ksps * 1000)
@@ -112,45 +131,66 @@ def measure_tod(fpga:FPGAControl, max_ch, dds_f_megahz, data_length,
         dummy_packet += freq_packet * 2
 
     dummy_packet += b'\xee'
-    file_desc.write(dummy_packet)
 
-    cnt = 0
     psize = packet_size(len(dds_f_megahz))
-    cnt_finish = psize * data_length
+    cnt_finish = None if data_length is None else psize * data_length
+
     cnt_step = psize * rate_ksps * 1000 * CNT_STEP_PER_SEC
     cnt_print = cnt_step
 
     # Buffer size calculation.
     buffsize = psize * rate_ksps * 1000 * READ_RATE
-    buffsize = 1024 if buffsize < 1024 else int(buffsize)
+    buffsize = 1024 if buffsize < 1024 else min(int(buffsize), ACQ_BUFF_SIZE)
+
+    def _progress(cnt):
+        nonlocal cnt_print
+        while cnt >= cnt_print:
+            _vprint(cnt_print / psize)
+            cnt_print += cnt_step
+
+    if splice:
+        file_desc = None
+        acq = SpliceCapture(fpga.tcp, fname, length=cnt_finish, packet_size=psize,
+                            header=dummy_packet, progress=_progress)
+    elif rotate:
+        max_bytes = None if rotate_size is None else int(rotate_size * 1e6)
+        file_desc = RotatingWriter(fname, dummy_packet, psize, max_bytes=max_bytes,
+                                   interval=rotate_interval,
+                                   on_rotate=lambda name: _vprint(f'write raw data to {name}'))
+    else:
+        file_desc = RawWriter(fname, size=len(dummy_packet) + cnt_finish)
+        file_desc.write(dummy_packet)
+    if not splice:
+        acq = Acquisition(fpga.tcp, [file_desc], length=cnt_finish,
+                          buff_size=buffsize, progress=_progress,
+                          validator=PacketValidator(psize, fname + LOG_SUFFIX))
+
+    monitor = None
+    if metrics or prom_path is not None:
+        monitor = AcquisitionMonitor.from_fpga(acq, fpga, prom_path=prom_path,
+                                               jsonl_path=fname + METRICS_SUFFIX if metrics else None)
 
     fpga.tcp.clear()
     fpga.iq_setting.iq_on()
+    if monitor is not None:
+        monitor.start()
 
     try:
-        while True:
-            buff = fpga.tcp.read(min(buffsize, cnt_finish - cnt))
-            file_desc.write(buff)
-
-            if len(buff) == 0:
-                break
-
-            cnt += len(buff)
-
-            while cnt >= cnt_print:
-                _vprint(cnt_print / psize)
-                cnt_print += cnt_step
-
-            if cnt >= cnt_finish:
-                break
-
+        acq.run()
     except KeyboardInterrupt:
         print('stop measurement')
     finally:
-        file_desc.close()
+        if monitor is not None:
+            monitor.stop()
+        if file_desc is not None:
+            file_desc.close()
         fpga.iq_setting.iq_off()
         fpga.dac_setting.txenable_off()
-        _vprint(f'write raw data to {fname}')
+        _vprint(acq.report())
+        if file_desc is not None:
+            _vprint(file_desc.report())
+        if not rotate:
+            _vprint(f'write raw data to {fname}')
 
 
 def main():
@@ -170,7 +210,7 @@ def main():
     parser.add_argument('-l', '--length',
                         type=int,
                         default=DATA_LENGTH_DEFAULT,
-                        help=f'data length. (default={DATA_LENGTH_DEFAULT})')
+                        help=f'data length (0: until Ctrl-C, with rotation). (default={DATA_LENGTH_DEFAULT})')
 
     parser.add_argument('-r', '--rate',
                         type=int,
@@ -201,11 +241,34 @@ def main():
                         default='192.168.10.16',
                         help='IP-v4 address of target SiTCP. (default=192.168.10.16)')
 
+    parser.add_argument('--splice',
+                        action='store_true',
+                        help='record the stream socket-to-file with os.splice (Linux).')
+
+    parser.add_argument('--metrics',
+                        action='store_true',
+                        help=f'write live metrics to FNAME{METRICS_SUFFIX}.')
+
+    parser.add_argument('--prom',
+                        type=str,
+                        default=None,
+                        help='write live metrics to this file in the Prometheus text format.')
+
+    parser.add_argument('--rotate_size',
+                        type=float,
+                        default=None,
+                        help='switch to a new file every ROTATE_SIZE MB (FNAME_0000, FNAME_0001, ...).')
+
+    parser.add_argument('--rotate_interval',
+                        type=float,
+                        default=None,
+                        help='switch to a new file every ROTATE_INTERVAL seconds.')
+
     args = parser.parse_args()
 
     freqs       = args.freqs
     fname       = args.fname
-    data_length = args.length
+    data_length = args.length if args.length > 0 else None
     rate_ksps   = args.rate
     power       = args.power
     amps        = args.amplitude
@@ -243,6 +306,16 @@ def main():
         if isfile(fname):
             raise Exception(f'{fname} exists.')
 
+        rotate = args.rotate_size is not None or args.rotate_interval is not None
+        if data_length is None and not rotate:
+            raise TODError('data length must be positive without file rotation.')
+        if rotate and args.splice:
+            raise TODError('file rotation is not supported with --splice.')
+        if rotate and isfile(rotated_name(fname, 0)):
+            raise Exception(f'{rotated_name(fname, 0)} exists.')
+        if args.rotate_size is not None and args.rotate_size * 1e6 <= 2 * packet_size(input_len):
+            raise TODError(f'rotate size must be larger than {2 * packet_size(input_len)} bytes.')
+
         if amps is not None and len(amps) != len(freqs):
             raise Exception('# of input amp must be same as # of input freqs.')
 
@@ -274,7 +347,12 @@ def main():
                 power       = power,
                 fname       = fname,
                 amps        = amps,
-                phases       = phases)
+                phases       = phases,
+                splice      = args.splice,
+                metrics     = args.metrics,
+                prom_path   = args.prom,
+                rotate_size = args.rotate_size,
+                rotate_interval = args.rotate_interval)
 
 
 if __name__ == '__main__':
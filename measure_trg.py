@@ -14,6 +14,8 @@ from rhea_pkg import RATE_KSPS_DEFAULT, IP_ADDRESS_DEFAULT
 from packet_reader import read_iq_packet
 from tone_conf import ToneConf
 from common import packet_size
+from acquisition import Acquisition, PacketValidator, LOG_SUFFIX
+from raw_writer import RawWriter
 
 PREMEAN_LEN_DEFAULT = 10000
 DATA_LEN_DEFAULT = 1024
@@ -144,25 +146,21 @@ def measure_trg(fpga:FPGAControl, tone_conf:ToneConf, data_length,
 
     _vprint('triggerd')
 
-    file_desc = open(fname, 'wb')
-    file_desc.write(dummy_packet)
-
-    cnt = 0
     cnt_finish = psize * data_length
 
-    while True:
-        buff = fpga.tcp.read(min(1024, cnt_finish - cnt))
-        file_desc.write(buff)
-        if len(buff) == 0:
-            break
-        cnt += len(buff)
-        if cnt >= cnt_finish:
-            break
-
-    file_desc.close()
-    fpga.iq_setting.iq_off()
-    fpga.dac_setting.txenable_off()
+    file_desc = RawWriter(fname, size=len(dummy_packet) + cnt_finish)
+    file_desc.write(dummy_packet)
+
+    acq = Acquisition(fpga.tcp, [file_desc], length=cnt_finish, buff_size=min(cnt_finish, 2**16),
+                      validator=PacketValidator(psize, str(fname) + LOG_SUFFIX))
+    try:
+        acq.run()
+    finally:
+        file_desc.close()
+        fpga.iq_setting.iq_off()
+        fpga.dac_setting.txenable_off()
 
+    _vprint(acq.report())
     _vprint(f'Write raw data to {fname}')
 
 
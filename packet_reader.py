@@ -3,8 +3,15 @@
 from struct import unpack
 from numpy import median
 from sys import stderr
+from os import stat, remove, cpu_count
+from pathlib import Path
+from math import ceil
+from datetime import datetime, timedelta
+import tempfile
+import numpy as np
 
 BUFFSIZE = 4096
+CHUNK_PACKETS = 2**14 # packets decoded at once in the bulk readers
 HEADER_DATA = 0xff
 HEADER_SGSYNC = 0xaa
 HEADER_SYNC = 0xf5
@@ -15,6 +22,9 @@ class PacketReaderError(Exception):
 
 
 def get_packet_size(filename):
+    index = load_index(filename)
+    if index is not None: return index.packet_size
+
     ret = []
     offset = 0
 
@@ -47,36 +57,156 @@ def get_packet_size(filename):
     return int(median(ret_diff))
 
 
-def get_length(filename, packet_size = None):
-    if packet_size is None: packet_size = get_packet_size(filename)
-    f = open(filename, 'rb')
+N_SPOT_CHECK = 16 # random packets checked by get_length besides the first and the last
 
-    buff = b''
+def _count_valid(filename, packet_size):
     cnt = 0
-    try:
-        while True:
-            buff += f.read(BUFFSIZE)
-            if len(buff) < packet_size: break
-
-            while True:
-                if buff[0] not in [HEADER_DATA, HEADER_SYNC]:
-                    raise PacketReaderError('error : get_length.HEADER_DATA', cnt)
-                if buff[packet_size - 1] != FOOTER:
-                    raise PacketReaderError('error : get_length.FOOTER', cnt)
-                cnt += 1
-                buff = buff[packet_size:]
-                if len(buff) < packet_size: break
-                pass
+    with open(filename, 'rb') as f:
+        for packets in _packet_blocks(f, packet_size):
+            n_valid, error = check_packets(packets, (HEADER_DATA, HEADER_SGSYNC, HEADER_SYNC))
+            cnt += n_valid
+            if error is not None:
+                print(PacketReaderError(f'error : get_length.{error}', cnt))
+                print(f'packet error: {cnt}', file=stderr)
+                break
+            pass
+    return cnt
 
+def _spot_check(filename, packet_size, n_packets, n_check = N_SPOT_CHECK):
+    if n_packets == 0: return True
+    positions = np.unique(np.concatenate(([0, n_packets - 1],
+                                          np.random.RandomState(0).randint(0, n_packets, n_check))))
+    with open(filename, 'rb') as f:
+        for pos in positions:
+            f.seek(packet_size * int(pos))
+            buff = f.read(packet_size)
+            if buff[0] not in [HEADER_DATA, HEADER_SGSYNC, HEADER_SYNC]: return False
+            if buff[-1] != FOOTER: return False
             pass
-    except PacketReaderError as e:
-        print(e)
-        print(f'packet error: {cnt}', file=stderr)
-        pass
+    return True
 
-    f.close()
-    return cnt
+def get_length(filename, packet_size = None, validate = False, n_check = N_SPOT_CHECK):
+    '''Number of packets in a file (header packet included).
+
+    The length is taken from the `.rawidx` index, or from the file size after
+    checking the headers and footers of the first, the last and `n_check`
+    random packets. All packets are validated only when `validate` is True
+    or the spot check fails; then the length is counted up to the first
+    broken packet.
+
+    Parameters
+    ----------
+    filename : str or Path
+        Path of the rawdata file.
+    packet_size : int, optional
+        Packet length in bytes (default: guessed by `get_packet_size`).
+    validate : bool, optional
+        Validate all packets (default: False).
+    n_check : int, optional
+        Number of random packets to be spot-checked.
+
+    Returns
+    -------
+    length : int
+        Number of packets.
+    '''
+    if packet_size is None: packet_size = get_packet_size(filename)
+    index = load_index(filename)
+    if index is not None and index.packet_size == packet_size:
+        return index.n_packets
+    n_packets = stat(filename).st_size // packet_size
+    if not validate and _spot_check(filename, packet_size, n_packets, n_check):
+        return n_packets
+    return _count_valid(filename, packet_size)
+
+class FileInfo:
+    '''Metadata of a rawdata file returned by `get_file_info`.
 
+    Attributes
+    ----------
+    type : str
+        'tod', 'swp' (zero rate in the header), 'sgswp' or 'snap'.
+    rate : int
+        Sampling rate in SPS written in the header packet (0 for sweeps).
+    freqs : list of int
+        Tone frequencies in Hz (empty for snapshot files).
+    packet_size : int
+        Packet length in bytes.
+    n_packets : int
+        Number of packets including the header packet.
+    length : int
+        Number of data packets (header and known SYNC packets excluded).
+    duration : float or None
+        length / rate in seconds (None without a rate).
+    truncated : int
+        Bytes after the last whole packet.
+    validated : bool
+        True if every packet was checked.
+    '''
+    def __init__(self, filename, type, rate, freqs, packet_size, n_packets, length, truncated, validated):
+        self.filename = filename
+        self.type = type
+        self.rate = rate
+        self.freqs = freqs
+        self.packet_size = packet_size
+        self.n_packets = n_packets
+        self.length = length
+        self.truncated = truncated
+        self.validated = validated
+
+    @property
+    def n_ch(self):
+        return len(self.freqs)
+
+    @property
+    def duration(self):
+        if self.type != 'tod': return None
+        return self.length / self.rate
+
+    def __repr__(self):
+        return (f'FileInfo(type={self.type!r}, rate={self.rate}, n_ch={self.n_ch}, '
+                f'length={self.length}, duration={self.duration}, truncated={self.truncated})')
+
+def get_file_info(filename, packet_size = None, validate = False):
+    '''Inspect a rawdata file from its header packet and size.
+
+    Parameters
+    ----------
+    filename : str or Path
+        Path of the rawdata file.
+    packet_size : int, optional
+        Packet length in bytes (default: guessed by `get_packet_size`).
+    validate : bool, optional
+        Validate all packets instead of spot-checking (default: False).
+
+    Returns
+    -------
+    info : FileInfo
+        Metadata of the file.
+    '''
+    if packet_size is None: packet_size = get_packet_size(filename)
+    file_size = stat(filename).st_size
+    with open(filename, 'rb') as f:
+        buff = f.read(packet_size)
+    index = load_index(filename)
+    if index is None or index.packet_size != packet_size: index = None
+
+    n_packets = get_length(filename, packet_size = packet_size, validate = validate)
+    n_sync = 0 if index is None else len(index.sync_pos)
+    validated = validate or index is not None or n_packets < file_size // packet_size
+
+    if packet_size == 15:
+        file_type, rate, freqs = 'snap', -1, []
+    else:
+        rate, data = read_iq_packet(buff)[0:2]
+        freqs = data[::2]
+        if buff[0] == HEADER_SGSYNC: file_type = 'sgswp'
+        elif rate == 0: file_type = 'swp'
+        else: file_type = 'tod'
+
+    return FileInfo(filename, file_type, rate, freqs, packet_size, n_packets,
+                    max(n_packets - 1 - n_sync, 0), file_size - n_packets * packet_size,
+                    validated)
 
 def read_packet_in_swp(buff):
     dlen = (len(buff) - 7) / 7
@@ -136,65 +266,366 @@ def read_snap_packet(buff, n_rot = -1, sync_off = 0):
     d2 = unpack('>i', buff[10:14])[0]
     return t, [d1, d2]
 
-def seek_sync(fd, read_packet, packet_size, offset=0):
-    buff = b''
+def packet_array(buff, packet_size):
+    '''View a byte buffer as an array of packets.
+    Trailing bytes that do not fill a whole packet are dropped.
+
+    Parameters
+    ----------
+    buff : bytes, bytearray or ndarray
+        Byte stream starting at a packet boundary.
+    packet_size : int
+        Packet length in bytes.
+
+    Returns
+    -------
+    packets : ndarray
+        uint8 array of shape (n_packets, packet_size).
+    '''
+    arr = np.frombuffer(buff, dtype=np.uint8)
+    n_packets = len(arr) // packet_size
+    return arr[:n_packets * packet_size].reshape(n_packets, packet_size)
+
+def check_packets(packets, headers=(HEADER_DATA, HEADER_SGSYNC)):
+    '''Check headers and footers of all packets at once.
+
+    Parameters
+    ----------
+    packets : ndarray
+        uint8 array of shape (n_packets, packet_size).
+    headers : tuple of int
+        Allowed header bytes.
+
+    Returns
+    -------
+    n_valid : int
+        Number of valid packets before the first broken one.
+    error : str or None
+            'HEADER_DATA' or 'FOOTER' for the first broken packet,
+            None if all packets are valid.
+    '''
+    bad_header = ~np.isin(packets[:, 0], headers)
+    bad = np.flatnonzero(bad_header | (packets[:, -1] != FOOTER))
+    if len(bad) == 0:
+        return len(packets), None
+    n_valid = int(bad[0])
+    return n_valid, 'HEADER_DATA' if bad_header[n_valid] else 'FOOTER'
+
+def sign_extend(fields):
+    '''Interpret big-endian signed integer fields (<= 8 bytes) as int64.
+
+    Parameter
+    ---------
+    fields : ndarray
+        uint8 array whose last axis holds the bytes of each field.
+
+    Returns
+    -------
+    values : ndarray
+        int64 array of shape fields.shape[:-1].
+    '''
+    width = fields.shape[-1]
+    ext = np.empty(fields.shape[:-1] + (8,), dtype=np.uint8)
+    ext[..., 8 - width:] = fields
+    ext[..., :8 - width] = np.where(fields[..., :1] & 0x80, 0xff, 0x00)
+    return ext.view('>i8')[..., 0].astype(np.int64)
 
-    # Find real offset
-    it_begin = 1
-    it_end = offset + 1
-    ts_begin = None
+def _decode_iq(packets):
+    n_packets, packet_size = packets.shape
+    if (packet_size - 7) % 7 != 0:
+        raise PacketReaderError('error : decode_iq_packets.size')
+    ts = sign_extend(packets[:, 1:6])
+    data = sign_extend(packets[:, 6:-1].reshape(n_packets, (packet_size - 7) // 7, 7))
+    return ts, data
+
+def decode_iq_packets(buff, packet_size, headers=(HEADER_DATA, HEADER_SGSYNC)):
+    '''Bulk version of `read_iq_packet`.
+
+    Parameters
+    ----------
+    buff : bytes, bytearray or ndarray
+        Consecutive IQ packets.
+    packet_size : int
+        Packet length in bytes.
+    headers : tuple of int
+        Allowed header bytes.
+
+    Returns
+    -------
+    ts : ndarray
+        40-bit timestamps (int64, n_packets).
+    data : ndarray
+        56-bit I/Q values (int64, n_packets x 2*n_ch).
+    '''
+    packets = packet_array(buff, packet_size)
+    n_valid, error = check_packets(packets, headers)
+    if error is not None:
+        raise PacketReaderError(f'error : decode_iq_packets.{error}', n_valid)
+    return _decode_iq(packets)
+
+def forward_fill_sync(packets, n_rot = -1, sync_off = 0):
+    '''Carry n_rot and sync_off of SYNC packets forward onto the following packets.
+
+    Parameters
+    ----------
+    packets : ndarray
+        uint8 array of shape (n_packets, packet_size).
+    n_rot, sync_off : int
+        Rotation state before the first packet.
+
+    Returns
+    -------
+    is_sync : ndarray
+        True for SYNC packets.
+    n_rot, sync_off : ndarray
+        Rotation state of each packet (a SYNC packet carries its own values).
+    '''
+    is_sync = packets[:, 0] == HEADER_SYNC
+    sync_idx = np.flatnonzero(is_sync)
+    n_rots = np.concatenate(([n_rot], sign_extend(packets[sync_idx, 1:6])))
+    offs = np.concatenate(([sync_off], sign_extend(packets[sync_idx, 6:13])))
+    # index of the latest SYNC packet (+1, 0 for the initial state)
+    latest = np.zeros(len(packets), dtype=np.int64)
+    latest[sync_idx] = np.arange(1, len(sync_idx) + 1)
+    np.maximum.accumulate(latest, out=latest)
+    return is_sync, n_rots[latest], offs[latest]
+
+def _packet_blocks(fd, packet_size, chunk=CHUNK_PACKETS):
     while True:
-        fd.seek(packet_size * it_begin)
-        buff = fd.read(packet_size)
-        if buff[0] == HEADER_DATA:
-            ts_begin, _, _, _ = read_packet(buff)
-            break
-        else:
-            it_begin += 1
-            it_end   += 1
-
-    ts_end = ts_begin
-    while ts_end - ts_begin != offset:
-        fd.seek(packet_size * it_end)
-        buff = fd.read(packet_size)
-        if buff[0] == HEADER_DATA:
-            ts_end, _, _, _ = read_packet(buff)
-            it_end += offset - (ts_end - ts_begin)
+        packets = packet_array(fd.read(packet_size * chunk), packet_size)
+        if len(packets) == 0: break
+        yield packets
+        if len(packets) < chunk: break
+        pass
+
+def _iq_blocks(fd, packet_size, length = None, step = 1, sync = False, n_rot = -1, sync_off = 0):
+    '''Decode IQ packets from the current position of `fd` block by block.
+    Yields (ts, data, n_rot, sync_off) arrays; SYNC packets only update the
+    rotation state when `sync` is True.'''
+    headers = (HEADER_DATA, HEADER_SGSYNC, HEADER_SYNC) if sync else (HEADER_DATA, HEADER_SGSYNC)
+    cnt = 0
+    readcnt = 0
+    for packets in _packet_blocks(fd, packet_size):
+        n_valid, error = check_packets(packets, headers)
+        packets = packets[:n_valid]
+        if sync:
+            is_sync, n_rots, offs = forward_fill_sync(packets, n_rot, sync_off)
+            if len(packets): n_rot, sync_off = int(n_rots[-1]), int(offs[-1])
+            packets, n_rots, offs = packets[~is_sync], n_rots[~is_sync], offs[~is_sync]
         else:
-            it_end += 1
-    cnt = it_end
+            n_rots = np.full(len(packets), n_rot, dtype=np.int64)
+            offs = np.full(len(packets), sync_off, dtype=np.int64)
 
-    # Find n_rot, sync_off
+        sel = slice((-readcnt) % step, None, step)
+        readcnt += len(packets)
+        packets, n_rots, offs = packets[sel], n_rots[sel], offs[sel]
+        if length is not None:
+            packets, n_rots, offs = packets[:length - cnt], n_rots[:length - cnt], offs[:length - cnt]
+        cnt += len(packets)
+
+        ts, data = _decode_iq(packets)
+        yield ts, data, n_rots, offs
+        if length is not None and cnt >= length: break
+        if error is not None:
+            raise PacketReaderError(f'error : decode_iq_packets.{error}', readcnt)
+        pass
+
+def seek_sync(fd, read_packet, packet_size, offset=0):
+    '''Find the `offset`-th data packet by scanning the header bytes from the
+    beginning of the file, as `RawIndex.seek` does with the index.
+
+    `offset` counts data packets (SYNC packets excluded). The SYNC packets in
+    front of the packet found, including those right after the header
+    packet, give the rotation state. `read_packet` is not used.
+
+    Returns
+    -------
+    n_rot, sync_off : int
+        Rotation state at the `offset`-th data packet.
+    position : int
+        Packet position of the `offset`-th data packet (past the end of the
+        file when there are fewer data packets).
+    '''
     n_rot = -1
     sync_off = 0
+    position = 1
+    n_data = 0
+    fd.seek(packet_size)
+    for packets in _packet_blocks(fd, packet_size):
+        is_sync = packets[:, 0] == HEADER_SYNC
+        data_pos = np.flatnonzero(~is_sync)
+        if offset - n_data < len(data_pos):
+            end = int(data_pos[offset - n_data])
+            found = True
+        else:
+            end = len(packets)
+            found = False
+        sync_pos = np.flatnonzero(is_sync[:end])
+        if len(sync_pos):
+            n_rot, sync_off = read_sync_packet(packets[sync_pos[-1]].tobytes())
+        position += end
+        if found: break
+        n_data += len(data_pos)
+        pass
+    else:
+        position += offset - n_data
+
+    return n_rot, sync_off, position
+
+INDEX_SUFFIX = '.rawidx'
 
-    if it_end - it_begin == offset: # no sync lines before `offset`
-        return n_rot, sync_off, cnt
-
-    # binary search
-    while it_begin < it_end:
-        n_rot = None
-        it = (it_begin + it_end) // 2
-        ## check sync lines
-        while it < it_end:
-            fd.seek(packet_size * it)
-            buff = fd.read(packet_size)
-            if buff[0] == HEADER_DATA:
-                ts, _, _, _ = read_packet(buff)
+class RawIndex:
+    '''Packet layout and SYNC packets of a rawdata file (`.rawidx` sidecar).
+
+    Attributes
+    ----------
+    packet_size : int
+        Packet length in bytes.
+    header : ndarray
+        Bytes of the header packet.
+    n_packets : int
+        Number of valid packets including the header packet.
+    file_size : int
+        Size of the data file when the index was built.
+    sync_pos : ndarray
+        Packet positions of the SYNC packets (header packet = 0).
+    sync_n_rot, sync_off : ndarray
+        n_rot and sync_off carried by each SYNC packet.
+    '''
+    def __init__(self, packet_size, header, n_packets, file_size, sync_pos, sync_n_rot, sync_off):
+        self.packet_size = int(packet_size)
+        self.header = np.asarray(header, dtype=np.uint8)
+        self.n_packets = int(n_packets)
+        self.file_size = int(file_size)
+        self.sync_pos = np.asarray(sync_pos, dtype=np.int64)
+        self.sync_n_rot = np.asarray(sync_n_rot, dtype=np.int64)
+        self.sync_off = np.asarray(sync_off, dtype=np.int64)
+        # number of data packets (+1 for the header) in front of each SYNC packet
+        self._sync_key = self.sync_pos - np.arange(len(self.sync_pos))
+
+    @property
+    def n_data(self):
+        '''Number of data packets (header and SYNC packets excluded).'''
+        return self.n_packets - 1 - len(self.sync_pos)
+
+    def sync_state(self, position):
+        '''n_rot and sync_off in effect at a packet position.'''
+        i = np.searchsorted(self.sync_pos, position, side='left')
+        if i == 0: return -1, 0
+        return int(self.sync_n_rot[i - 1]), int(self.sync_off[i - 1])
+
+    def seek(self, offset = 0):
+        '''Index-based equivalent of `seek_sync`.
+        `offset` counts data packets (SYNC packets excluded).
+
+        Returns
+        -------
+        n_rot, sync_off : int
+            Rotation state at the `offset`-th data packet.
+        position : int
+            Packet position of the `offset`-th data packet.
+        '''
+        n_sync = int(np.searchsorted(self._sync_key, offset + 1, side='right'))
+        position = offset + 1 + n_sync
+        if n_sync == 0: return -1, 0, position
+        return int(self.sync_n_rot[n_sync - 1]), int(self.sync_off[n_sync - 1]), position
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, packet_size=self.packet_size, header=self.header,
+                     n_packets=self.n_packets, file_size=self.file_size,
+                     sync_pos=self.sync_pos, sync_n_rot=self.sync_n_rot,
+                     sync_off=self.sync_off)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as npz:
+            return cls(npz['packet_size'], npz['header'], npz['n_packets'], npz['file_size'],
+                       npz['sync_pos'], npz['sync_n_rot'], npz['sync_off'])
+
+def index_path(filename):
+    '''Path of the `.rawidx` sidecar of a rawdata file.'''
+    return Path(filename).with_suffix(INDEX_SUFFIX)
+
+def build_index(filename, packet_size = None, save = True):
+    '''Scan a rawdata file once and build its `RawIndex`.
+
+    Parameters
+    ----------
+    filename : str or Path
+        Path of the rawdata file.
+    packet_size : int, optional
+        Packet length in bytes (default: guessed by `get_packet_size`).
+    save : bool, optional
+        Write the index next to the file (default: True).
+
+    Returns
+    -------
+    index : RawIndex
+        Index of the file.
+    '''
+    if packet_size is None: packet_size = get_packet_size(filename)
+    file_size = stat(filename).st_size
+    sync_pos = []
+    sync_n_rot = []
+    sync_off = []
+    with open(filename, 'rb') as f:
+        header = np.frombuffer(f.read(packet_size), dtype=np.uint8)
+        n_packets = 1
+        for packets in _packet_blocks(f, packet_size):
+            n_valid, error = check_packets(packets, (HEADER_DATA, HEADER_SGSYNC, HEADER_SYNC))
+            packets = packets[:n_valid]
+            pos = np.flatnonzero(packets[:, 0] == HEADER_SYNC)
+            sync_pos.append(pos + n_packets)
+            sync_n_rot.append(sign_extend(packets[pos, 1:6]))
+            sync_off.append(sign_extend(packets[pos, 6:13]))
+            n_packets += n_valid
+            if error is not None:
+                print(f'packet error: {n_packets}', file=stderr)
                 break
-            elif buff[0] == HEADER_SYNC:
-                n_rot, sync_off = read_sync_packet(buff)
-            it += 1
-
-        if it_end - it == ts_end - ts:
-            if n_rot is not None: break
-            it_end = it
-            ts_end = ts
-        else:
-            it_begin = it
-            ts_begin = ts
+            pass
+
+    empty = [np.empty(0, dtype=np.int64)]
+    index = RawIndex(packet_size, header, n_packets, file_size,
+                     np.concatenate(empty + sync_pos),
+                     np.concatenate(empty + sync_n_rot),
+                     np.concatenate(empty + sync_off))
+    if save: index.save(index_path(filename))
+    return index
+
+def load_index(filename):
+    '''Load the `.rawidx` sidecar of a rawdata file.
 
-    return n_rot, sync_off, cnt
+    Returns
+    -------
+    index : RawIndex or None
+        None when there is no index, or it is older than the data file
+        or was built for a different file size.
+    '''
+    path = index_path(filename)
+    if path == Path(filename): return None
+    try:
+        data_stat = stat(filename)
+        if stat(path).st_mtime < data_stat.st_mtime: return None
+        index = RawIndex.load(path)
+    except (OSError, ValueError, KeyError):
+        return None
+    if index.file_size != data_stat.st_size: return None
+    return index
+
+def _seek_sync(filename, fd, read_packet, packet_size, offset = 0):
+    '''`RawIndex.seek` with the `.rawidx` index, which is built and saved on
+    the first seek past the beginning; `seek_sync` only for offset 0.'''
+    index = load_index(filename)
+    if index is None or index.packet_size != packet_size:
+        if offset == 0:
+            return seek_sync(fd, read_packet, packet_size, offset)
+        index = build_index(filename, packet_size = packet_size, save = False)
+        try:
+            index.save(index_path(filename))
+        except OSError:
+            pass # read-only directory: scanned again on the next seek
+    return index.seek(offset)
 
 def _read_file(filename, packet_size = None, length = None, offset = 0, read_packet = read_iq_packet, step=1):
     if packet_size is None: packet_size = get_packet_size(filename)
@@ -210,6 +641,12 @@ def _read_file(filename, packet_size = None, length = None, offset = 0, read_pac
     buff = b''
     f.seek(packet_size * (offset + 1))
 
+    if read_packet is read_iq_packet:
+        for ts, data, _, _ in _iq_blocks(f, packet_size, length = length, step = step):
+            yield from zip(ts.tolist(), data.tolist())
+        f.close()
+        return
+
     while True:
         if type(length) == int and cnt >= length: break
         if len(buff) < packet_size: buff += f.read(BUFFSIZE)
@@ -236,9 +673,16 @@ def _read_file_sync(filename, packet_size = None, length = None, offset = 0, rea
 
     ## BODY
     buff = b''
-    n_rot,sync_off,offset = seek_sync(f,read_packet,packet_size,offset)
+    n_rot,sync_off,offset = _seek_sync(filename,f,read_packet,packet_size,offset)
     f.seek(packet_size * offset)
     try:
+        if read_packet is read_iq_packet:
+            for block in _iq_blocks(f, packet_size, length = length, step = step,
+                                    sync = True, n_rot = n_rot, sync_off = sync_off):
+                yield from zip(*(b.tolist() for b in block))
+            f.close()
+            return
+
         while True:
             if type(length) == int and cnt >= length: break
             if len(buff) < packet_size: buff += f.read(BUFFSIZE)
@@ -259,6 +703,47 @@ def _read_file_sync(filename, packet_size = None, length = None, offset = 0, rea
         print(e)
 
 
+def read_iq_arrays(filename, packet_size = None, length = None, offset = 0, sync = False, step = 1):
+    '''Read IQ packets of a file into arrays at once.
+    Arguments are the same as `read_file`.
+
+    Returns
+    -------
+    header : tuple
+        (timestamp, data) of the header packet.
+    ts : ndarray
+        Timestamps (int64, n_packets).
+    data : ndarray
+        I/Q values (int64, n_packets x 2*n_ch).
+    n_rot, sync_off : ndarray
+        Rotation state of each packet (-1 and 0 without `sync`).
+    '''
+    if packet_size is None: packet_size = get_packet_size(filename)
+    blocks = []
+    with open(filename, 'rb') as f:
+        header = read_iq_packet(f.read(packet_size))[0:2]
+        if sync:
+            n_rot, sync_off, offset = _seek_sync(filename, f, read_iq_packet, packet_size, offset)
+        else:
+            n_rot, sync_off, offset = -1, 0, offset + 1
+        f.seek(packet_size * offset)
+        try:
+            for block in _iq_blocks(f, packet_size, length = length, step = step,
+                                    sync = sync, n_rot = n_rot, sync_off = sync_off):
+                blocks.append(block)
+                pass
+        except PacketReaderError as e:
+            if not sync: raise
+            print(e)
+
+    if not blocks:
+        n_data = (packet_size - 7) // 7
+        blocks = [(np.empty(0, dtype=np.int64), np.empty((0, n_data), dtype=np.int64),
+                   np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))]
+    ts, data, n_rot, sync_off = (np.concatenate(b) for b in zip(*blocks))
+    return header, ts, data, n_rot, sync_off
+
+
 def read_iq_file(filename, packet_size = None, length = None, offset = 0):
     return _read_file(filename, packet_size = packet_size,
                       length = length, offset = offset,
@@ -271,6 +756,478 @@ def read_snap_file(filename, length = None, offset = 0):
                       read_packet = read_snap_packet)
 
 
+def _decode_range(filename, packet_size, position, length, step, sync, n_rot, sync_off,
+                  out_paths, out_begin, n_out, n_data):
+    '''Worker of `decode_file`: decode `length` packets from `position` into the outputs.'''
+    outs = [np.memmap(path, dtype=np.int64, mode='r+', shape=shape)
+            for path, shape in zip(out_paths, [(n_out,), (n_out, n_data), (n_out,), (n_out,)])]
+    begin = out_begin
+    with open(filename, 'rb') as f:
+        f.seek(packet_size * position)
+        for block in _iq_blocks(f, packet_size, length = length, step = step,
+                                sync = sync, n_rot = n_rot, sync_off = sync_off):
+            end = begin + len(block[0])
+            for out, values in zip(outs, block):
+                out[begin:end] = values
+            begin = end
+            pass
+    for out in outs: out.flush()
+    return begin - out_begin
+
+def decode_file(filename, packet_size = None, length = None, offset = 0, sync = True, step = 1,
+                n_workers = None, tmpdir = None):
+    '''Decode IQ packets of a file with several processes.
+
+    The packets to be read are split into packet-aligned ranges, and each
+    range is decoded by a worker of a `ProcessPoolExecutor`, starting from the
+    rotation state taken from the SYNC packets of the file (`.rawidx` index,
+    or a pre-scan when there is no index). Workers write into output arrays
+    shared through memory-mapped temporary files.
+
+    Parameters
+    ----------
+    filename : str or Path
+        Path of the rawdata file.
+    packet_size, length, offset, sync, step :
+        Same as `read_file`. `offset` counts data packets.
+    n_workers : int, optional
+        Number of worker processes (default: number of CPUs).
+    tmpdir : str, optional
+        Directory of the temporary output files (e.g. '/dev/shm').
+
+    Returns
+    -------
+    Same as `read_iq_arrays`.
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+
+    if packet_size is None: packet_size = get_packet_size(filename)
+    if n_workers is None: n_workers = cpu_count() or 1
+    index = load_index(filename)
+    if index is None or index.packet_size != packet_size:
+        index = build_index(filename, packet_size = packet_size, save = False)
+    with open(filename, 'rb') as f:
+        header = read_iq_packet(f.read(packet_size))[0:2]
+
+    full_packets = (index.file_size - packet_size) // packet_size + 1
+    if not sync and (len(index.sync_pos) > 0 or index.n_packets < full_packets):
+        raise PacketReaderError('error : decode_file.HEADER_DATA', index.n_packets)
+
+    n_data = (packet_size - 7) // 7
+    n_out = max(0, -(-(index.n_data - offset) // step))
+    if length is not None: n_out = min(n_out, length)
+    n_workers = max(1, min(n_workers, -(-n_out // CHUNK_PACKETS)))
+    bounds = np.linspace(0, n_out, n_workers + 1).astype(np.int64)
+
+    workdir = tempfile.mkdtemp(dir = tmpdir)
+    out_paths = [str(Path(workdir) / f'{name}.bin') for name in ['ts', 'data', 'n_rot', 'sync_off']]
+    shapes = [(n_out,), (n_out, n_data), (n_out,), (n_out,)]
+    for path, shape in zip(out_paths, shapes):
+        with open(path, 'wb') as f:
+            f.truncate(8 * int(np.prod(shape)))
+
+    try:
+        jobs = []
+        with ProcessPoolExecutor(max_workers = n_workers) as pool:
+            for begin, end in zip(bounds[:-1], bounds[1:]):
+                if end == begin: continue
+                n_rot, sync_off, position = index.seek(offset + step * int(begin))
+                if not sync: n_rot, sync_off = -1, 0
+                jobs.append(pool.submit(_decode_range, filename, packet_size, position,
+                                        int(end - begin), step, sync, n_rot, sync_off,
+                                        out_paths, int(begin), n_out, n_data))
+                pass
+            for job in jobs: job.result()
+        outs = [np.memmap(path, dtype=np.int64, mode='r+', shape=shape) if n_out
+                else np.empty(shape, dtype=np.int64)
+                for path, shape in zip(out_paths, shapes)]
+    finally:
+        # the memory maps stay valid after the files are removed (POSIX)
+        for path in out_paths:
+            try: remove(path)
+            except OSError: pass
+        try: Path(workdir).rmdir()
+        except OSError: pass
+
+    ts, data, n_rot, sync_off = outs
+    return header, ts, data, n_rot, sync_off
+
+
+class TodChunk:
+    '''Block of decoded IQ packets yielded by `iter_chunks`.
+
+    The arrays are views on buffers that are overwritten by the next chunk;
+    copy what has to be kept.
+
+    Attributes
+    ----------
+    header : tuple
+        (timestamp, data) of the header packet.
+    start : int
+        Index of the first packet of this chunk among the packets read.
+    '''
+    def __init__(self, size, n_data, header):
+        self.header = header
+        self.start = 0
+        self._n = 0
+        self._ts = np.empty(size, dtype=np.int64)
+        self._iq = np.empty((size, n_data), dtype=np.int64)
+        self._n_rot = np.empty(size, dtype=np.int64)
+        self._sync_off = np.empty(size, dtype=np.int64)
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def full(self):
+        return self._n == len(self._ts)
+
+    def _append(self, ts, iq, n_rot, sync_off):
+        n = min(len(self._ts) - self._n, len(ts))
+        sel = slice(self._n, self._n + n)
+        self._ts[sel] = ts[:n]
+        self._iq[sel] = iq[:n]
+        self._n_rot[sel] = n_rot[:n]
+        self._sync_off[sel] = sync_off[:n]
+        self._n += n
+        return n
+
+    def _reset(self):
+        self.start += self._n
+        self._n = 0
+
+    @property
+    def ts(self):
+        '''Timestamps.'''
+        return self._ts[:self._n]
+
+    @property
+    def iq(self):
+        '''I/Q values (n_packets x 2*n_ch).'''
+        return self._iq[:self._n]
+
+    @property
+    def I(self):
+        '''I values (n_ch x n_packets).'''
+        return self._iq[:self._n, 0::2].T
+
+    @property
+    def Q(self):
+        '''Q values (n_ch x n_packets).'''
+        return self._iq[:self._n, 1::2].T
+
+    @property
+    def n_rot(self):
+        return self._n_rot[:self._n]
+
+    @property
+    def sync_off(self):
+        return self._sync_off[:self._n]
+
+def iter_chunks(filename, chunk_packets = CHUNK_PACKETS, sync = True, packet_size = None,
+                length = None, offset = 0):
+    '''Read IQ packets of a file in fixed-size NumPy blocks.
+
+    The file is read into a preallocated buffer, and packets split across two
+    reads are carried over to the next one. Every chunk holds
+    `chunk_packets` data packets except the last one.
+
+    Parameters
+    ----------
+    filename : str or Path
+        Path of the rawdata file.
+    chunk_packets : int, optional
+        Number of data packets in a chunk.
+    sync : bool, optional
+        Track n_rot/sync_off of SYNC packets (default: True).
+    packet_size, length, offset :
+        Same as `read_file`.
+
+    Yields
+    ------
+    chunk : TodChunk
+        Decoded packets (the same object is reused for every chunk).
+    '''
+    if packet_size is None: packet_size = get_packet_size(filename)
+    headers = (HEADER_DATA, HEADER_SGSYNC, HEADER_SYNC) if sync else (HEADER_DATA, HEADER_SGSYNC)
+    raw = bytearray(chunk_packets * packet_size)
+    view = memoryview(raw)
+    cnt = 0
+    with open(filename, 'rb') as f:
+        header = read_iq_packet(f.read(packet_size))[0:2]
+        chunk = TodChunk(chunk_packets, (packet_size - 7) // 7, header)
+        if sync:
+            n_rot, sync_off, position = _seek_sync(filename, f, read_iq_packet, packet_size, offset)
+        else:
+            n_rot, sync_off, position = -1, 0, offset + 1
+        f.seek(packet_size * position)
+
+        carry = 0
+        error = None
+        while error is None:
+            n_read = f.readinto(view[carry:])
+            if not n_read: break
+            filled = carry + n_read
+            carry = filled % packet_size
+            packets = packet_array(view[:filled - carry], packet_size)
+            n_valid, error = check_packets(packets, headers)
+            packets = packets[:n_valid]
+            if sync:
+                is_sync, n_rots, offs = forward_fill_sync(packets, n_rot, sync_off)
+                if len(packets): n_rot, sync_off = int(n_rots[-1]), int(offs[-1])
+                packets, n_rots, offs = packets[~is_sync], n_rots[~is_sync], offs[~is_sync]
+            else:
+                n_rots = np.full(len(packets), n_rot, dtype=np.int64)
+                offs = np.full(len(packets), sync_off, dtype=np.int64)
+            if length is not None:
+                packets, n_rots, offs = packets[:length - cnt], n_rots[:length - cnt], offs[:length - cnt]
+            cnt += len(packets)
+            ts, data = _decode_iq(packets)
+            raw[:carry] = raw[filled - carry:filled]
+
+            while len(ts):
+                n = chunk._append(ts, data, n_rots, offs)
+                ts, data, n_rots, offs = ts[n:], data[n:], n_rots[n:], offs[n:]
+                if chunk.full:
+                    yield chunk
+                    chunk._reset()
+                pass
+            if length is not None and cnt >= length:
+                error = None
+                break
+            pass
+
+    if len(chunk): yield chunk
+    if error is not None:
+        err = PacketReaderError(f'error : iter_chunks.{error}', cnt)
+        if not sync: raise err
+        print(err)
+
+
+class RawDataFile:
+    '''Random access to the packets of a rawdata file through `np.memmap`.
+    Packets are decoded only when they are accessed, so opening a file does
+    not depend on its size.
+
+    Indices count the packets after the header packet, SYNC packets included
+    (see `headers` to tell them apart).
+
+    Parameters
+    ----------
+    filename : str or Path
+        Path of the rawdata file.
+    packet_size : int, optional
+        Packet length in bytes (default: guessed by `get_packet_size`).
+
+    Examples
+    --------
+    >>> f = RawDataFile('tod.rawdata')
+    >>> ts, data = f[1000:2000]
+    >>> iq_ch3 = f.channels[3]           # (n_packets, 2) of I and Q
+    >>> iq_ch3 = f.channels[3, 0:1000]
+    >>> ts = f.timestamps
+    '''
+    def __init__(self, filename, packet_size = None):
+        if packet_size is None: packet_size = get_packet_size(filename)
+        self.filename = filename
+        self.packet_size = packet_size
+        self.n_ch = (packet_size - 7) // 14
+        self._mmap = np.memmap(filename, dtype=np.uint8, mode='r')
+        n_packets = len(self._mmap) // packet_size
+        if n_packets == 0:
+            raise PacketReaderError('error : RawDataFile.size')
+        self._packets = self._mmap[:n_packets * packet_size].reshape(n_packets, packet_size)
+        self.header = read_iq_packet(self._packets[0].tobytes())[0:2]
+        self.channels = _RawChannels(self)
+
+    def __len__(self):
+        return len(self._packets) - 1
+
+    def __getitem__(self, key):
+        '''Decode packets selected by an index, a slice or an index array.
+
+        Returns
+        -------
+        ts : int or ndarray
+            Timestamps.
+        data : ndarray
+            I/Q values (2*n_ch or n_packets x 2*n_ch).
+        '''
+        packets = self.packets(key)
+        if packets.ndim == 1:
+            ts, data = self._decode(packets[np.newaxis])
+            return int(ts[0]), data[0]
+        return self._decode(packets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        '''Release the memory map (it is unmapped once no array refers to it).'''
+        self._packets = self._packets[:1].copy()
+        self._mmap = None
+
+    def packets(self, key = slice(None)):
+        '''Raw bytes of the selected packets (uint8, n_packets x packet_size).'''
+        return self._packets[1:][key]
+
+    @property
+    def rate(self):
+        '''Sampling rate written in the header packet (0 for sweep files).'''
+        return self.header[0]
+
+    @property
+    def freqs(self):
+        '''Tone frequencies written in the header packet.'''
+        return self.header[1][::2]
+
+    @property
+    def headers(self):
+        '''Header byte of every packet (memory-mapped, not copied).'''
+        return self._packets[1:, 0]
+
+    @property
+    def timestamps(self):
+        '''Timestamps of all packets.'''
+        return sign_extend(self._packets[1:, 1:6])
+
+    def _decode(self, packets):
+        n_valid, error = check_packets(packets, (HEADER_DATA, HEADER_SGSYNC, HEADER_SYNC))
+        if error is not None:
+            raise PacketReaderError(f'error : RawDataFile.{error}', n_valid)
+        return _decode_iq(packets)
+
+    def _timestamp(self, position):
+        return int(sign_extend(self._packets[1 + position, 1:6]))
+
+    def _data_position(self, position, direction = 1):
+        '''Nearest data (non-SYNC) packet from `position` in `direction`, -1 if none.'''
+        headers = self.headers
+        while 0 <= position < len(headers):
+            if headers[position] != HEADER_SYNC: return position
+            position += direction
+        return -1
+
+    def search_timestamp(self, ts):
+        '''Binary search of the first data packet whose timestamp is >= `ts`.
+        SYNC packets are skipped; timestamps may have gaps.
+
+        Returns
+        -------
+        position : int
+            Packet index (len(self) if every timestamp is smaller).
+        '''
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = self._data_position(mid)
+            if pos < 0 or pos >= hi:
+                hi = mid
+            elif self._timestamp(pos) < ts:
+                lo = pos + 1
+            else:
+                hi = mid
+            pass
+        return lo
+
+    def sync_state(self, position):
+        '''n_rot and sync_off in effect at a packet index.
+        Taken from the `.rawidx` index if available, otherwise by scanning
+        the header bytes backward from `position`.'''
+        index = load_index(self.filename)
+        if index is not None and index.packet_size == self.packet_size:
+            return index.sync_state(position + 1)
+        headers = self.headers
+        end = position
+        while end > 0:
+            begin = max(0, end - CHUNK_PACKETS)
+            found = np.flatnonzero(headers[begin:end] == HEADER_SYNC)
+            if len(found):
+                n_rot, sync_off = read_sync_packet(self.packets(begin + found[-1]).tobytes())
+                return n_rot, sync_off
+            end = begin
+        return -1, 0
+
+    @property
+    def start_time(self):
+        '''Absolute time of timestamp 0, estimated from the file mtime
+        (end of the measurement) and the last timestamp.'''
+        last = self._data_position(len(self) - 1, direction = -1)
+        duration = 0 if last < 0 else self._timestamp(last) / self.rate
+        return datetime.fromtimestamp(stat(self.filename).st_mtime) - timedelta(seconds = duration)
+
+    def to_seconds(self, time):
+        '''Convert a datetime into seconds from timestamp 0 (seconds are returned as is).'''
+        if isinstance(time, datetime):
+            return (time - self.start_time).total_seconds()
+        return time
+
+    def time_window(self, t_start = None, t_stop = None, sync = True):
+        '''Decode data packets with t_start <= timestamp / rate < t_stop.
+
+        Parameters
+        ----------
+        t_start, t_stop : float or datetime, optional
+            Window in seconds (timestamp / rate) or in absolute time.
+        sync : bool, optional
+            Track n_rot/sync_off of SYNC packets (default: True).
+
+        Returns
+        -------
+        ts, data, n_rot, sync_off : ndarray
+            Same as `read_iq_arrays`.
+        '''
+        if self.rate <= 0:
+            raise PacketReaderError('error : RawDataFile.time_window: no sampling rate')
+        begin = 0 if t_start is None else self.search_timestamp(ceil(self.to_seconds(t_start) * self.rate))
+        end = len(self) if t_stop is None else self.search_timestamp(ceil(self.to_seconds(t_stop) * self.rate))
+        packets = self.packets(slice(begin, max(begin, end)))
+        n_valid, error = check_packets(packets, (HEADER_DATA, HEADER_SGSYNC, HEADER_SYNC))
+        if error is not None:
+            raise PacketReaderError(f'error : RawDataFile.{error}', begin + n_valid)
+        if sync:
+            is_sync, n_rots, offs = forward_fill_sync(packets, *self.sync_state(begin))
+        else:
+            is_sync = packets[:, 0] == HEADER_SYNC
+            n_rots = np.full(len(packets), -1, dtype=np.int64)
+            offs = np.zeros(len(packets), dtype=np.int64)
+        ts, data = _decode_iq(packets[~is_sync])
+        return ts, data, n_rots[~is_sync], offs[~is_sync]
+
+class _RawChannels:
+    '''Accessor for `RawDataFile.channels[ch]` and `RawDataFile.channels[ch, key]`.'''
+    def __init__(self, rawfile):
+        self._rawfile = rawfile
+
+    def __len__(self):
+        return self._rawfile.n_ch
+
+    def __getitem__(self, index):
+        ch, key = index if isinstance(index, tuple) else (index, slice(None))
+        if not -self._rawfile.n_ch <= ch < self._rawfile.n_ch:
+            raise IndexError(f'channel {ch} out of range')
+        ch %= self._rawfile.n_ch
+        packets = self._rawfile.packets(key)
+        if packets.ndim == 1: packets = packets[np.newaxis]
+        fields = packets[:, 6 + 14 * ch : 6 + 14 * (ch + 1)]
+        return sign_extend(fields.reshape(len(packets), 2, 7))
+
+
+def read_time_window(filename, t_start = None, t_stop = None, sync = True, packet_size = None):
+    '''Read data packets in a time window by binary search of the timestamps.
+    See `RawDataFile.time_window`.
+
+    Returns
+    -------
+    Same as `read_iq_arrays`.
+    '''
+    with RawDataFile(filename, packet_size = packet_size) as rawfile:
+        return (rawfile.header,) + rawfile.time_window(t_start, t_stop, sync = sync)
+
+
 def read_file(filename, packet_size = None, length = None, offset = 0, sync=False, step=1):
     if packet_size is None: packet_size = get_packet_size(filename)
     read_packet = read_iq_packet
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+'''Output file writer for the acquisition.
+
+`RawWriter` is an acquisition sink (see `acquisition`) that turns the stream
+of small pieces into a few large sequential writes:
+- the expected file size is reserved with posix_fallocate, so the file
+  system allocates contiguous extents up front (the file is truncated to
+  the written size on close);
+- data are coalesced in a buffer and written in chunks of `chunk_size`
+  bytes at offsets aligned to WRITE_ALIGN;
+- with `use_writev`, a piece overflowing the buffer is written together with
+  the buffered data by one os.writev instead of being copied first;
+- `fsync` selects when the data are flushed to the disk.
+
+`RotatingWriter` records an unbounded packet stream to a series of files,
+switching at packet boundaries when a file reaches a size or an age. Every
+file starts with the header packet followed by the last SYNC packet seen,
+so it can be read alone with the current rotation state, and consecutive
+files join without missing samples.
+
+Example
+-------
+    with RawWriter(fname, size=len(header_packet) + psize * data_length) as writer:
+        writer.write(header_packet)
+        Acquisition(fpga.tcp, [writer], length=psize * data_length).run()
+'''
+import os
+from sys import stderr
+from time import perf_counter
+from pathlib import Path
+import numpy as np
+
+from packet_reader import HEADER_SYNC, get_packet_size, read_iq_arrays
+
+WRITE_CHUNK = 2**23 # bytes per write (8 MiB)
+WRITE_ALIGN = 2**12 # bytes
+
+FSYNC_NEVER = 'never'   # left to the OS
+FSYNC_CLOSE = 'close'   # once on close
+FSYNC_ALWAYS = 'always' # after every chunk
+
+
+class RawWriter:
+    '''Coalescing, preallocating file sink.
+
+    Parameters
+    ----------
+    fname : str
+        Output file name (overwritten).
+    size : int, optional
+        Expected file size in bytes to be preallocated.
+    chunk_size : int
+        Size of each write in bytes (multiple of WRITE_ALIGN).
+    use_writev : bool
+        Write the buffer and the incoming piece with one os.writev.
+    fsync : str or float
+        FSYNC_NEVER, FSYNC_CLOSE, FSYNC_ALWAYS, or the interval in seconds
+        between fsyncs.
+
+    Attributes
+    ----------
+    n_bytes : int
+        Bytes accepted by `write`.
+    n_writes : int
+        Number of system calls writing data.
+    write_time, fsync_time : float
+        Seconds spent in writing and in fsync.
+    '''
+    def __init__(self, fname, size=None, chunk_size=WRITE_CHUNK, use_writev=False,
+                 fsync=FSYNC_CLOSE):
+        if chunk_size <= 0 or chunk_size % WRITE_ALIGN != 0:
+            raise ValueError(f'chunk_size must be a multiple of {WRITE_ALIGN}')
+        if not (fsync in (FSYNC_NEVER, FSYNC_CLOSE, FSYNC_ALWAYS) or
+                (isinstance(fsync, (int, float)) and fsync > 0)):
+            raise ValueError(f'invalid fsync policy: {fsync}')
+        self.fname = fname
+        self.chunk_size = chunk_size
+        self.use_writev = use_writev and hasattr(os, 'writev')
+        self.fsync = fsync
+
+        self._buff = bytearray(chunk_size)
+        self._view = memoryview(self._buff)
+        self._fill = 0
+        self._offset = 0
+        self._last_sync = perf_counter()
+
+        self.n_bytes = 0
+        self.n_writes = 0
+        self.write_time = 0.
+        self.fsync_time = 0.
+
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+        self._fd = os.open(fname, flags, 0o644)
+        if size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self._fd, 0, size)
+            except OSError as err:
+                print(f'raw_writer: no preallocation: {err}', file=stderr)
+
+    @property
+    def closed(self):
+        return self._fd is None
+
+    def _write_all(self, views):
+        start = perf_counter()
+        views = [view for view in views if len(view)]
+        while views:
+            if len(views) > 1:
+                n_written = os.writev(self._fd, views)
+            else:
+                n_written = os.write(self._fd, views[0])
+            self.n_writes += 1
+            self._offset += n_written
+            while views and n_written >= len(views[0]):
+                n_written -= len(views[0])
+                views.pop(0)
+            if views:
+                views[0] = views[0][n_written:]
+            pass
+        self.write_time += perf_counter() - start
+        self._sync(self.fsync == FSYNC_ALWAYS)
+
+    def _sync(self, force=False):
+        if self.fsync == FSYNC_NEVER: return
+        if not force:
+            if not isinstance(self.fsync, (int, float)): return
+            if perf_counter() - self._last_sync < self.fsync: return
+        start = perf_counter()
+        if hasattr(os, 'fdatasync'):
+            os.fdatasync(self._fd)
+        else:
+            os.fsync(self._fd)
+        self._last_sync = perf_counter()
+        self.fsync_time += self._last_sync - start
+
+    def write(self, data):
+        '''Append data (any bytes-like object; it is not referenced after the call).'''
+        n_data = len(data) if isinstance(data, (bytes, bytearray)) else memoryview(data).nbytes
+        self.n_bytes += n_data
+        if self._fill + n_data < self.chunk_size:
+            self._buff[self._fill:self._fill + n_data] = data
+            self._fill += n_data
+            return
+        view = memoryview(data).cast('B')
+        if self.use_writev:
+            # write the buffer and the head of the piece up to an aligned offset
+            end = self._offset + self._fill + len(view)
+            n_head = end - end % WRITE_ALIGN - self._offset - self._fill
+            if n_head >= 0:
+                self._write_all([self._view[:self._fill], view[:n_head]])
+                self._fill = 0
+                view = view[n_head:]
+            pass
+        while len(view):
+            n_copy = min(self.chunk_size - self._fill, len(view))
+            self._view[self._fill:self._fill + n_copy] = view[:n_copy]
+            self._fill += n_copy
+            view = view[n_copy:]
+            if self._fill == self.chunk_size:
+                self._write_all([self._view])
+                self._fill = 0
+            pass
+
+    def flush(self):
+        '''Write the buffered data (the next writes may be unaligned).'''
+        if self._fill:
+            self._write_all([self._view[:self._fill]])
+            self._fill = 0
+
+    def close(self):
+        '''Flush, drop the unused preallocated space, fsync per the policy and close.'''
+        if self._fd is None: return
+        try:
+            self.flush()
+            os.ftruncate(self._fd, self._offset)
+            self._sync(self.fsync != FSYNC_NEVER)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+            self._view.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def report(self):
+        '''Summary of the write calls.'''
+        return (f'{self.n_bytes} bytes in {self.n_writes} writes '
+                f'({self.write_time:.3f} s, fsync {self.fsync_time:.3f} s)')
+
+
+def rotated_name(fname, index):
+    '''Name of the `index`-th file of a `RotatingWriter` (<stem>_NNNN<suffix>).'''
+    fname = Path(fname)
+    return str(fname.with_name(f'{fname.stem}_{index:04d}{fname.suffix}'))
+
+
+class RotatingWriter:
+    '''Packet stream sink writing a series of `RawWriter` files.
+
+    The stream must start at a packet boundary (e.g. the output of a
+    `PacketValidator`).
+
+    Parameters
+    ----------
+    fname : str
+        Base file name; the files are <stem>_0000<suffix>, <stem>_0001<suffix>, ...
+    header : bytes
+        Header packet written at the beginning of each file.
+    packet_size : int
+        Packet length in bytes.
+    max_bytes : int, optional
+        Rotate when a file reaches this size (larger than the header and
+        a SYNC packet).
+    interval : float, optional
+        Rotate when the first data in a file are older than this (seconds).
+    on_rotate : callable, optional
+        Called with the name of each file closed.
+    **kwargs
+        Passed to `RawWriter` (chunk_size, use_writev, fsync).
+
+    Attributes
+    ----------
+    files : list of str
+        Names of the files opened so far.
+    '''
+    def __init__(self, fname, header, packet_size, max_bytes=None, interval=None,
+                 on_rotate=None, **kwargs):
+        if max_bytes is not None and max_bytes <= len(header) + packet_size:
+            raise ValueError(f'max_bytes must be larger than {len(header) + packet_size} bytes')
+        self.fname = fname
+        self.header = bytes(header)
+        self.packet_size = packet_size
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.on_rotate = on_rotate
+        self._kwargs = kwargs
+
+        self.files = []
+        self.n_bytes = 0
+        self._writer = None
+        self._opened = None      # time of the first data in the current file
+        self._size = 0
+        self._phase = 0          # bytes of the current packet already written
+        self._partial = b''      # head of the current packet (to catch a SYNC packet)
+        self._sync_packet = b''  # last SYNC packet
+        self._open()
+
+    def _open(self):
+        name = rotated_name(self.fname, len(self.files))
+        self._writer = RawWriter(name, size=self.max_bytes, **self._kwargs)
+        self._writer.write(self.header)
+        self._writer.write(self._sync_packet)
+        self._size = len(self.header) + len(self._sync_packet)
+        self._opened = None
+        self.files.append(name)
+
+    def _close(self):
+        self._writer.close()
+        if self.on_rotate is not None:
+            self.on_rotate(self.files[-1])
+
+    def _due(self):
+        if self.max_bytes is not None and self._size >= self.max_bytes: return True
+        if (self.interval is not None and self._opened is not None and
+                perf_counter() - self._opened >= self.interval): return True
+        return False
+
+    def _track_sync(self, view):
+        '''Keep the last complete SYNC packet of the stream.'''
+        psize = self.packet_size
+        head = (psize - self._phase) % psize
+        if self._phase:
+            self._partial += bytes(view[:head])
+            if len(self._partial) == psize and self._partial[0] == HEADER_SYNC:
+                self._sync_packet = self._partial
+        arr = np.frombuffer(view, dtype=np.uint8)[head:]
+        n_packets = len(arr) // psize
+        idx = np.flatnonzero(arr[:n_packets * psize:psize] == HEADER_SYNC)
+        if len(idx):
+            self._sync_packet = arr[idx[-1] * psize:(idx[-1] + 1) * psize].tobytes()
+        if head <= len(view):
+            self._partial = arr[n_packets * psize:].tobytes()
+        self._phase = (self._phase + len(view)) % psize
+
+    def write(self, data):
+        '''Append data; the file is switched at the first packet boundary
+        once the size or the age limit is reached.'''
+        view = memoryview(data).cast('B')
+        self.n_bytes += len(view)
+        while len(view):
+            if self._phase == 0 and self._due():
+                self._close()
+                self._open()
+            psize = self.packet_size
+            if self._due():
+                # finish the current packet in this file
+                n_write = min((psize - self._phase) % psize, len(view))
+            elif self.max_bytes is not None:
+                # up to the first packet boundary after max_bytes
+                n_write = self.max_bytes - self._size
+                n_write += (psize - (self._phase + n_write) % psize) % psize
+                n_write = min(n_write, len(view))
+            else:
+                n_write = len(view)
+            if self._opened is None:
+                self._opened = perf_counter()
+            piece = view[:n_write]
+            self._track_sync(piece)
+            self._writer.write(piece)
+            self._size += n_write
+            view = view[n_write:]
+            pass
+
+    def close(self):
+        if self._writer is not None and not self._writer.closed:
+            self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def report(self):
+        '''Summary of the files written.'''
+        return f'{self.n_bytes} bytes in {len(self.files)} files'
+
+
+def check_rotation(src, fname, max_bytes):
+    '''Split a TOD file with `RotatingWriter` and read each file alone.
+
+    Parameters
+    ----------
+    src : str
+        TOD rawdata file.
+    fname : str
+        Base name of the rotated files (overwritten).
+    max_bytes : int
+        Size limit of the rotated files.
+
+    Returns
+    -------
+    files : list of str
+        Rotated files, each of which gives the same timestamps, I/Q values
+        and rotation state (n_rot, sync_off) as the corresponding samples
+        of `src`.
+    '''
+    psize = get_packet_size(src)
+    _, *whole = read_iq_arrays(src, packet_size=psize, sync=True)
+    with open(src, 'rb') as src_file:
+        header = src_file.read(psize)
+        with RotatingWriter(fname, header, psize, max_bytes=max_bytes, fsync=FSYNC_NEVER) as writer:
+            while True:
+                data = src_file.read(WRITE_CHUNK - WRITE_CHUNK % psize)
+                if not data: break
+                writer.write(data)
+            pass
+
+    begin = 0
+    for name in writer.files:
+        _, *part = read_iq_arrays(name, packet_size=psize, sync=True)
+        end = begin + len(part[0])
+        for key, values, expected in zip(['ts', 'data', 'n_rot', 'sync_off'], part, whole):
+            if not np.array_equal(values, expected[begin:end]):
+                raise ValueError(f'{name}: {key} differs from {src}')
+        begin = end
+    if begin != len(whole[0]):
+        raise ValueError(f'{begin} samples in the rotated files, {len(whole[0])} in {src}')
+    return writer.files
+
+
+def main():
+    '''Write benchmark: small pieces through RawWriter vs a buffered file.'''
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('fname',
+                        type=str,
+                        help='output file (overwritten).')
+    parser.add_argument('-s', '--size',
+                        type=int,
+                        default=2**30,
+                        help='total bytes. (default=1 GiB)')
+    parser.add_argument('-p', '--piece',
+                        type=int,
+                        default=1024,
+                        help='bytes per write call. (default=1024)')
+    parser.add_argument('--writev',
+                        action='store_true',
+                        help='use os.writev.')
+    parser.add_argument('--check_rotation',
+                        type=str,
+                        default=None,
+                        metavar='SRC',
+                        help='instead of the benchmark, split the TOD file SRC into files of SIZE bytes '
+                             'named after FNAME and check that each file reads like SRC.')
+    args = parser.parse_args()
+
+    if args.check_rotation is not None:
+        files = check_rotation(args.check_rotation, args.fname, args.size)
+        print(f'{len(files)} files ok')
+        return
+
+    piece = os.urandom(args.piece)
+    n_piece = args.size // args.piece
+
+    start = perf_counter()
+    with open(args.fname, 'wb') as file_desc:
+        for _ in range(n_piece):
+            file_desc.write(piece)
+        os.fsync(file_desc.fileno())
+    elapsed = perf_counter() - start
+    print(f'file  : {n_piece * args.piece / elapsed / 1e6:8.1f} MB/s')
+
+    start = perf_counter()
+    with RawWriter(args.fname, size=n_piece * args.piece, use_writev=args.writev) as writer:
+        for _ in range(n_piece):
+            writer.write(piece)
+    elapsed = perf_counter() - start
+    print(f'writer: {n_piece * args.piece / elapsed / 1e6:8.1f} MB/s, {writer.report()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-from packet_reader import read_file, get_length
+from packet_reader import read_file, get_file_info, build_index
 from sys   import argv, stderr
 from numpy import mean
 from os.path import isfile
@@ -17,6 +17,9 @@ try:
         elif args[0] == '-r':
             mode = 'raw'
             args = args[1:]
+        elif args[0] == '-i':
+            mode = 'index'
+            args = args[1:]
         elif args[0] == '-n':
             isNormalize = True
             args = args[1:]
@@ -43,6 +46,7 @@ except Exception as e:
     print('       option: -h: output of measurement setting (header)', file=stderr)
     print('               -r: output of raw_data with header', file=stderr)
     print('               -n: normalize to 1-ch-readout', file=stderr)
+    print('               -i: build .rawidx index for fast seek', file=stderr)
     exit(1)
     pass
 
@@ -75,9 +79,10 @@ def header_read_snap():
 
 def setting_read():
     rate_SPS, freq_Hz = header_read()
+    info = get_file_info(fname)
     if rate_SPS == 0:
         print( 'It is old-version file.')
-        print(f'length: {get_length(fname):d})')
+        print(f'length: {info.n_packets:d})')
         exit(0)
         pass
     if rate_SPS > 0:
@@ -90,7 +95,11 @@ def setting_read():
     for i, v in enumerate(freq_Hz):
         print(f'ch{i:03d}: {(float(v) / 1e6):7.3f} MHz')
         pass
-    print(f'length: {(get_length(fname)-1):d}')
+    print(f'length: {info.length:d}')
+    if info.duration is not None:
+        print(f'duration: {info.duration:f} sec')
+    if info.truncated:
+        print(f'truncated: {info.truncated:d} bytes')
     return
 
 
@@ -100,6 +109,12 @@ if mode == 'header':
     exit(0)
     pass
 
+if mode == 'index':
+    index = build_index(fname)
+    print(f'packets: {index.n_packets:d} (sync: {len(index.sync_pos):d})')
+    exit(0)
+    pass
+
 ## 'normal', 'snap', 'raw'
 norm_factor = 1
 if mode != 'raw':
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+'''Columnar cache of TOD rawdata files.
+
+A rawdata file is transcoded once into a directory of `.npy` columns:
+    meta.json            : header information (rate, tone frequencies, ...)
+    time.npy             : time in seconds (shared by all channels)
+    n_rot.npy            : rotation number (shared)
+    sync_off.npy         : sync offset (shared)
+    I.npy, Q.npy         : scaled I and Q (n_ch x length)
+Columns are loaded lazily with `np.load(..., mmap_mode='c')`.
+
+The cache directory is given by the environment variable RHEA_CACHE_DIR
+(default: ~/.cache/rhea_comm), and each entry is keyed by the path,
+size and mtime of the rawdata file. Entries are only created on request
+(`load_cache(..., create=True)`); `prune_cache` removes the entries of
+files that were modified or removed and keeps the cache under
+RHEA_CACHE_MAX_GB (default: 16), dropping the least recently used first.
+'''
+from pathlib import Path
+from hashlib import sha1
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from .packet_reader import iter_chunks, decode_file, get_packet_size, load_index, build_index
+from .packet_reader import read_iq_packet
+
+CACHE_DIR = Path(os.environ.get('RHEA_CACHE_DIR', Path.home() / '.cache' / 'rhea_comm'))
+CACHE_MAX_BYTES = int(float(os.environ.get('RHEA_CACHE_MAX_GB', 16)) * 2**30)
+CACHE_VERSION = 2
+CHUNK_PACKETS = 2**16
+TMP_MAX_AGE = 24 * 3600 # sec, unfinished entries older than this are removed
+
+class CacheError(Exception):
+    '''Cache error.'''
+
+
+def iq_scale(rate):
+    '''Conversion factor from raw I/Q values to the values of `read_rhea_tod`.'''
+    return (2**28) * 200.e6 / rate
+
+
+class TodColumns:
+    '''Transcoded TOD file.
+
+    Parameter
+    ---------
+    path : str or Path
+        Directory of the columns.
+    '''
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / 'meta.json', encoding='utf-8') as meta_file:
+            self.meta = json.load(meta_file)
+
+    @property
+    def name(self):
+        return self.meta['name']
+
+    @property
+    def rate(self):
+        return self.meta['rate']
+
+    @property
+    def freq(self):
+        return self.meta['freq']
+
+    @property
+    def n_ch(self):
+        return len(self.meta['freq'])
+
+    @property
+    def length(self):
+        return self.meta['length']
+
+    @property
+    def n_sync(self):
+        return self.meta['n_sync']
+
+    def column(self, name):
+        '''Memory-mapped (copy-on-write) column.
+
+        Parameter
+        ---------
+        name : str
+            'time', 'n_rot', 'sync_off', 'I' or 'Q'.
+        '''
+        return np.load(self.path / f'{name}.npy', mmap_mode='c')
+
+
+def cache_path(fname, cache_dir=None):
+    '''Directory of the cache entry of a rawdata file.'''
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    fname = Path(fname).resolve()
+    info = fname.stat()
+    key = sha1(f'{fname}:{info.st_size}:{info.st_mtime_ns}'.encode()).hexdigest()[:16]
+    return Path(cache_dir) / f'{fname.stem}-{key}'
+
+
+def _entry_size(path):
+    return sum(f.stat().st_size for f in Path(path).iterdir() if f.is_file())
+
+
+def transcode(fname, path, n_workers=1, allow_sync=True):
+    '''Transcode a TOD rawdata file into columns.
+
+    Parameters
+    ----------
+    fname : str or Path
+        Path of the rawdata file.
+    path : str or Path
+        Output directory (created). When another process has created it
+        meanwhile, that entry is returned.
+    n_workers : int, optional
+        Decode with `decode_file` and this many processes (None: all CPUs).
+    allow_sync : bool, optional
+        False raises CacheError for a file with SYNC packets before decoding.
+
+    Returns
+    -------
+    columns : TodColumns
+        Transcoded file.
+    '''
+    path = Path(path)
+    packet_size = get_packet_size(fname)
+    with open(fname, 'rb') as rawfile:
+        rate, header = read_iq_packet(rawfile.read(packet_size))[0:2]
+    if rate <= 0:
+        raise CacheError(f'Not a TOD file: {fname}')
+    index = load_index(fname)
+    if index is None or index.packet_size != packet_size:
+        index = build_index(fname, packet_size=packet_size, save=False)
+    length = index.n_data
+    if length == 0:
+        raise CacheError(f'No data packet: {fname}')
+    if not allow_sync and len(index.sync_pos):
+        raise CacheError(f'SYNC packets in {fname}')
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    workdir = Path(tempfile.mkdtemp(dir=path.parent, prefix='.tmp-'))
+    try:
+        def _open(name, shape, dtype):
+            return np.lib.format.open_memmap(workdir / f'{name}.npy', mode='w+',
+                                             dtype=dtype, shape=shape)
+        if n_workers == 1:
+            chunks = ((chunk.start, chunk.ts, chunk.iq, chunk.n_rot, chunk.sync_off)
+                      for chunk in iter_chunks(fname, chunk_packets=CHUNK_PACKETS,
+                                               packet_size=packet_size, length=length))
+        else:
+            decoded = decode_file(fname, packet_size=packet_size, length=length,
+                                  n_workers=n_workers)[1:]
+            chunks = ((begin,) + tuple(values[begin:begin + CHUNK_PACKETS] for values in decoded)
+                      for begin in range(0, len(decoded[0]), CHUNK_PACKETS))
+        n_ch = (packet_size - 7) // 14
+        cols = {'time'    : _open('time', (length,), np.float64),
+                'n_rot'   : _open('n_rot', (length,), np.int64),
+                'sync_off': _open('sync_off', (length,), np.int64),
+                'I'       : _open('I', (n_ch, length), np.float64),
+                'Q'       : _open('Q', (n_ch, length), np.float64)}
+        scale = iq_scale(rate)
+        n_read = 0
+        for begin, ts, iq, n_rot, sync_off in chunks:
+            sel = slice(begin, begin + len(ts))
+            cols['time'][sel] = ts.astype(float) / float(rate)
+            cols['n_rot'][sel] = n_rot
+            cols['sync_off'][sel] = sync_off
+            cols['I'][:, sel] = iq[:, 0::2].T.astype(float) / scale
+            cols['Q'][:, sel] = iq[:, 1::2].T.astype(float) / scale
+            n_read = sel.stop
+        for col in cols.values():
+            col.flush()
+        del cols
+
+        meta = {'version' : CACHE_VERSION,
+                'name'    : str(fname),
+                'source'  : str(Path(fname).resolve()),
+                'type'    : 'tod',
+                'rate'    : float(rate),
+                'freq'    : [float(freq) for freq in header[::2]],
+                'length'  : n_read,
+                'n_sync'  : len(index.sync_pos),
+                'packet_size': packet_size}
+        with open(workdir / 'meta.json', 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file)
+        try:
+            os.rename(workdir, path)
+        except OSError:
+            if not (path / 'meta.json').is_file(): raise
+            shutil.rmtree(workdir, ignore_errors=True) # finished by another process
+    except BaseException:
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise
+
+    return TodColumns(path)
+
+
+def prune_cache(cache_dir=None, max_bytes=None):
+    '''Remove stale cache entries and keep the cache under a size.
+
+    Entries whose rawdata file was removed or modified, entries of another
+    CACHE_VERSION and unfinished entries older than TMP_MAX_AGE are removed.
+    Then the least recently used entries are removed until the total size
+    is at most `max_bytes` (the most recently used one is kept).
+
+    Parameters
+    ----------
+    cache_dir : str or Path, optional
+        Cache directory (default: CACHE_DIR).
+    max_bytes : int, optional
+        Size limit in bytes (default: CACHE_MAX_BYTES).
+
+    Returns
+    -------
+    removed : list of Path
+        Entries removed.
+    '''
+    cache_dir = Path(CACHE_DIR if cache_dir is None else cache_dir)
+    if max_bytes is None:
+        max_bytes = CACHE_MAX_BYTES
+    if not cache_dir.is_dir():
+        return []
+    removed = []
+    entries = []
+    for path in cache_dir.iterdir():
+        if not path.is_dir(): continue
+        try:
+            if path.name.startswith('.tmp-'):
+                if time.time() - path.stat().st_mtime > TMP_MAX_AGE:
+                    removed.append(path)
+                continue
+            meta_path = path / 'meta.json'
+            if not meta_path.is_file(): continue
+            with open(meta_path, encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+            source = meta.get('source')
+            if (meta.get('version') != CACHE_VERSION or source is None
+                    or not Path(source).is_file() or cache_path(source, cache_dir) != path):
+                removed.append(path)
+                continue
+            entries.append((meta_path.stat().st_mtime, _entry_size(path), path))
+        except (OSError, ValueError):
+            continue
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries)[:-1]:
+        if total <= max_bytes: break
+        removed.append(path)
+        total -= size
+
+    for path in removed:
+        shutil.rmtree(path, ignore_errors=True)
+    return removed
+
+
+def load_cache(fname, cache_dir=None, create=False, n_workers=1, allow_sync=True):
+    '''Cached columns of a TOD rawdata file.
+
+    Parameters
+    ----------
+    fname : str or Path
+        Path of the rawdata file.
+    cache_dir : str or Path, optional
+        Cache directory (default: CACHE_DIR).
+    create : bool, optional
+        Transcode the file when it is not cached yet (and then prune the cache).
+    n_workers, allow_sync :
+        Passed to `transcode`.
+
+    Returns
+    -------
+    columns : TodColumns or None
+        None when the file is not cached (and `create` is False).
+    '''
+    path = cache_path(fname, cache_dir)
+    if (path / 'meta.json').is_file():
+        columns = TodColumns(path)
+        if columns.meta.get('version') == CACHE_VERSION:
+            try:
+                os.utime(path / 'meta.json') # last use, for prune_cache
+            except OSError:
+                pass
+            return columns
+        shutil.rmtree(path, ignore_errors=True)
+    if not create:
+        return None
+    columns = transcode(fname, path, n_workers=n_workers, allow_sync=allow_sync)
+    prune_cache(cache_dir)
+    return columns
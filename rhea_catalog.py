@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+'''Metadata catalog of rawdata files.
+
+Rawdata files under a directory tree are inspected in parallel (header
+packet, size and a few packets of sweeps only) and their metadata is kept in
+a SQLite database:
+    files : path, size, mtime, type, rate, n_ch, packet_size, length,
+            duration, resolution, span, error
+    tones : path, ch, freq (one row per tone)
+`Catalog.update` rescans only the files whose size or mtime changed.
+
+The default database is CATALOG_PATH in the cache directory of
+`rhea_cache` (RHEA_CACHE_DIR).
+
+Example
+-------
+    with Catalog() as catalog:
+        catalog.update('/data/rhea')
+        tods = catalog.find(type='tod', tone=4.82e6, tol=1e4,
+                            after=datetime(2024, 1, 10), before=datetime(2024, 1, 11))
+'''
+from pathlib import Path
+from datetime import datetime
+from os import cpu_count
+import sqlite3
+
+from .packet_reader import get_file_info, get_packet_size, read_iq_packet, HEADER_SGSYNC, HEADER_DATA
+from .rhea_cache import CACHE_DIR
+from . import ReadSgSwp
+
+CATALOG_PATH = CACHE_DIR / 'catalog.sqlite'
+SWP_SCAN_PACKETS = 64 # packets read to find the frequency step of a sweep
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path        TEXT PRIMARY KEY,
+    size        INTEGER,
+    mtime_ns    INTEGER,
+    mtime       REAL,
+    type        TEXT,
+    rate        REAL,
+    n_ch        INTEGER,
+    packet_size INTEGER,
+    length      INTEGER,
+    duration    REAL,
+    resolution  REAL,
+    span        REAL,
+    error       TEXT
+);
+CREATE TABLE IF NOT EXISTS tones (
+    path TEXT,
+    ch   INTEGER,
+    freq REAL
+);
+CREATE INDEX IF NOT EXISTS tones_freq ON tones (freq);
+CREATE INDEX IF NOT EXISTS tones_path ON tones (path);
+CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime);
+'''
+
+COLUMNS = ['path', 'size', 'mtime_ns', 'mtime', 'type', 'rate', 'n_ch', 'packet_size',
+           'length', 'duration', 'resolution', 'span', 'error']
+
+
+def _swp_resolution(path, packet_size, freqs):
+    '''Frequency step of a RHEA sweep and number of steps.
+    Each step starts with a packet of zero timestamp holding the tone frequencies.'''
+    with open(path, 'rb') as rawfile:
+        rawfile.seek(packet_size)
+        buff = rawfile.read(packet_size * SWP_SCAN_PACKETS)
+    for n in range(len(buff) // packet_size):
+        packet = buff[n * packet_size:(n + 1) * packet_size]
+        if packet[0] != HEADER_DATA: continue
+        ts, data = read_iq_packet(packet)[0:2]
+        if ts == 0:
+            return float(data[0] - freqs[0]), n + 1
+    return None, None
+
+def scan_file(path):
+    '''Metadata of a rawdata file.
+
+    Parameter
+    ---------
+    path : str or Path
+        Path of the rawdata file.
+
+    Returns
+    -------
+    record : dict
+        Values of the `files` table (see COLUMNS) and 'freqs' (tone frequencies).
+        Files that cannot be read have type None and the reason in 'error'.
+    '''
+    path = Path(path)
+    info = path.stat()
+    record = dict.fromkeys(COLUMNS)
+    record.update(path=str(path), size=info.st_size, mtime_ns=info.st_mtime_ns,
+                  mtime=info.st_mtime, freqs=[])
+    try:
+        with open(path, 'rb') as rawfile:
+            first = rawfile.read(1)
+        if first and first[0] == HEADER_SGSYNC:
+            packet_size = ReadSgSwp.get_packet_size(str(path))
+        else:
+            packet_size = get_packet_size(path)
+        file_info = get_file_info(path, packet_size = packet_size)
+        record.update(type=file_info.type, rate=float(file_info.rate), n_ch=file_info.n_ch,
+                      packet_size=packet_size, length=file_info.length,
+                      duration=file_info.duration, freqs=[float(f) for f in file_info.freqs])
+        if file_info.type == 'swp':
+            resolution, step = _swp_resolution(path, packet_size, file_info.freqs)
+            if resolution is not None:
+                n_step = (file_info.n_packets) // step
+                record.update(resolution=resolution, span=resolution * n_step)
+        elif file_info.type == 'sgswp':
+            with open(path, 'rb') as rawfile:
+                header = rawfile.read(packet_size)
+            f_start, f_stop, f_step = ReadSgSwp.read_header(header, file_info.n_ch)[2:]
+            record.update(resolution=f_step * 1e6, span=(f_stop - f_start) * 1e6)
+    except Exception as err:
+        record.update(type=None, error=f'{type(err).__name__}: {err}')
+    return record
+
+
+class Catalog:
+    '''SQLite catalog of rawdata files.
+
+    Parameter
+    ---------
+    path : str or Path, optional
+        Database file (default: CATALOG_PATH).
+    '''
+    def __init__(self, path=None):
+        self.path = Path(CATALOG_PATH if path is None else path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _store(self, records):
+        with self.db:
+            for record in records:
+                self.db.execute('DELETE FROM tones WHERE path = ?', (record['path'],))
+                self.db.execute(f'INSERT OR REPLACE INTO files ({", ".join(COLUMNS)}) '
+                                f'VALUES ({", ".join("?" * len(COLUMNS))})',
+                                [record[col] for col in COLUMNS])
+                self.db.executemany('INSERT INTO tones (path, ch, freq) VALUES (?, ?, ?)',
+                                    [(record['path'], ch, freq)
+                                     for ch, freq in enumerate(record['freqs'])])
+                pass
+
+    def update(self, root, pattern='*.rawdata', n_workers=None):
+        '''Scan new and modified files under a directory.
+
+        Parameters
+        ----------
+        root : str or Path
+            Top directory, searched recursively.
+        pattern : str
+            Glob pattern of the file names.
+        n_workers : int, optional
+            Number of worker processes (default: number of CPUs).
+
+        Returns
+        -------
+        n_scanned, n_removed : int
+            Files (re)scanned and entries removed because the file is gone.
+        '''
+        from concurrent.futures import ProcessPoolExecutor
+
+        root = Path(root).resolve()
+        prefix = str(root).rstrip('/') + '/'
+        known = {row['path']: (row['size'], row['mtime_ns'])
+                 for row in self.db.execute('SELECT path, size, mtime_ns FROM files')
+                 if row['path'].startswith(prefix)}
+        todo = []
+        found = set()
+        for path in root.rglob(pattern):
+            if not path.is_file(): continue
+            found.add(str(path))
+            info = path.stat()
+            if known.get(str(path)) != (info.st_size, info.st_mtime_ns):
+                todo.append(str(path))
+            pass
+
+        if n_workers is None: n_workers = cpu_count() or 1
+        if n_workers > 1 and len(todo) > 1:
+            with ProcessPoolExecutor(max_workers = n_workers) as pool:
+                records = list(pool.map(scan_file, todo, chunksize = max(1, len(todo) // (4 * n_workers))))
+        else:
+            records = [scan_file(path) for path in todo]
+        self._store(records)
+
+        removed = [path for path in known if path not in found]
+        with self.db:
+            for path in removed:
+                self.db.execute('DELETE FROM files WHERE path = ?', (path,))
+                self.db.execute('DELETE FROM tones WHERE path = ?', (path,))
+                pass
+        return len(records), len(removed)
+
+    def freqs(self, path):
+        '''Tone frequencies of a cataloged file.'''
+        return [row['freq'] for row in
+                self.db.execute('SELECT freq FROM tones WHERE path = ? ORDER BY ch', (str(path),))]
+
+    def find(self, type=None, tone=None, tol=1e3, after=None, before=None, min_duration=None):
+        '''Query the catalog.
+
+        Parameters
+        ----------
+        type : str, optional
+            'tod', 'swp', 'sgswp' or 'snap'.
+        tone : float, optional
+            Files having a tone within `tol` Hz of this frequency (Hz).
+        after, before : datetime, optional
+            Range of the modification time.
+        min_duration : float, optional
+            Minimum duration in seconds (TOD only).
+
+        Returns
+        -------
+        rows : list of dict
+            Values of the `files` table and 'freqs', sorted by mtime.
+        '''
+        where = ['error IS NULL']
+        args = []
+        if type is not None:
+            where.append('type = ?')
+            args.append(type)
+        if tone is not None:
+            where.append('path IN (SELECT path FROM tones WHERE freq BETWEEN ? AND ?)')
+            args += [tone - tol, tone + tol]
+        if after is not None:
+            where.append('mtime >= ?')
+            args.append(after.timestamp())
+        if before is not None:
+            where.append('mtime < ?')
+            args.append(before.timestamp())
+        if min_duration is not None:
+            where.append('duration >= ?')
+            args.append(min_duration)
+        rows = self.db.execute(f'SELECT * FROM files WHERE {" AND ".join(where)} ORDER BY mtime', args)
+        ret = []
+        for row in rows.fetchall():
+            row = dict(row)
+            row['freqs'] = self.freqs(row['path'])
+            row['mtime'] = datetime.fromtimestamp(row['mtime'])
+            ret.append(row)
+            pass
+        return ret
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
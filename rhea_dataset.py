@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+'''Consecutive TOD rawdata files as one dataset.
+
+A long observation split into several `tod_*.rawdata` files is accessed
+through one sample axis (data packets, SYNC packets excluded) and one
+timestamp axis. Packets are decoded lazily from memory maps of the files,
+and the rotation state (n_rot, sync_off) of the last SYNC packet of a file is
+carried over to the following files.
+
+Example
+-------
+    with TodDataset('/data/rhea/tod_*.rawdata') as dataset:
+        ts, data, n_rot, sync_off = dataset[10**6:2*10**6]
+        for start, ts, data, n_rot, sync_off in dataset.iter_chunks(2**16):
+            ...
+'''
+from pathlib import Path
+from glob import glob
+from datetime import datetime
+import numpy as np
+
+from .packet_reader import RawDataFile, PacketReaderError, load_index, build_index, get_packet_size
+from .packet_reader import index_path
+from .packet_reader import check_packets, forward_fill_sync, _decode_iq
+from .packet_reader import HEADER_DATA, HEADER_SGSYNC, HEADER_SYNC, CHUNK_PACKETS
+
+
+class TodDataset:
+    '''Virtual TOD made of consecutive rawdata files.
+
+    The files must share the packet size, the sampling rate and the tone
+    frequencies. They are sorted by name unless a list is given.
+    A file without an up-to-date `.rawidx` index is scanned once and its
+    index is written next to it.
+    Timestamps are continued across the files: when the timestamps of a
+    file do not follow the previous file (counter reset), its offset is
+    estimated from the modification times of the files.
+
+    Parameters
+    ----------
+    files : str or list
+        Glob pattern or list of paths of the rawdata files.
+    packet_size : int, optional
+        Packet length in bytes (default: guessed from the first file).
+
+    Attributes
+    ----------
+    files : list of str
+        Paths of the files.
+    starts : ndarray
+        Global sample index of the first data packet of each file (+ total length).
+    ts_offsets : ndarray
+        Offsets added to the timestamps of each file.
+    gaps : list of (int, int)
+        (file index, number of missing timestamps before the file) for the
+        files that do not follow the previous one.
+    '''
+    def __init__(self, files, packet_size = None):
+        if isinstance(files, (str, Path)):
+            files = sorted(glob(str(files)))
+        self.files = [str(f) for f in files]
+        if len(self.files) == 0:
+            raise PacketReaderError('error : TodDataset.no file')
+        if packet_size is None: packet_size = get_packet_size(self.files[0])
+        self.packet_size = packet_size
+
+        self._raw = []
+        self._index = []
+        first_ts = []
+        last_ts = []
+        for f in self.files:
+            raw = RawDataFile(f, packet_size = packet_size)
+            if self._raw and (raw.rate != self.rate or raw.header[1] != self.header[1]):
+                raise PacketReaderError(f'error : TodDataset.header mismatch: {f}')
+            index = load_index(f)
+            if index is None or index.packet_size != packet_size:
+                index = build_index(f, packet_size = packet_size, save = False)
+                try:
+                    index.save(index_path(f))
+                except OSError:
+                    pass # read-only directory: scanned again on the next open
+            self._raw.append(raw)
+            self._index.append(index)
+            if index.n_data > 0:
+                first_ts.append(raw._timestamp(index.seek(0)[2] - 1))
+                last_ts.append(raw._timestamp(index.seek(index.n_data - 1)[2] - 1))
+            else:
+                first_ts.append(None)
+                last_ts.append(None)
+            pass
+        if self.rate <= 0:
+            raise PacketReaderError('error : TodDataset.no sampling rate')
+
+        self.starts = np.concatenate([[0], np.cumsum([index.n_data for index in self._index])])
+        self._set_offsets(first_ts, last_ts)
+
+        # rotation state at the beginning of each file
+        self._init_state = []
+        state = (-1, 0)
+        for index in self._index:
+            self._init_state.append(state)
+            if len(index.sync_pos):
+                state = (int(index.sync_n_rot[-1]), int(index.sync_off[-1]))
+            pass
+
+    def _set_offsets(self, first_ts, last_ts):
+        self.ts_offsets = np.zeros(len(self.files), dtype=np.int64)
+        self.gaps = []
+        t0 = None
+        prev_last = None
+        for k, (first, last) in enumerate(zip(first_ts, last_ts)):
+            if first is None: continue
+            if t0 is None:
+                t0 = self._raw[k].start_time
+                self.ts_offsets[k] = 0
+            elif first + self.ts_offsets[k - 1] > prev_last:
+                self.ts_offsets[k] = self.ts_offsets[k - 1]
+            else:
+                # the counter was reset: place the file by its modification time
+                delta = (self._raw[k].start_time - t0).total_seconds()
+                self.ts_offsets[k] = max(int(round(delta * self.rate)), prev_last + 1 - first)
+            if prev_last is not None and first + self.ts_offsets[k] != prev_last + 1:
+                self.gaps.append((k, int(first + self.ts_offsets[k] - prev_last - 1)))
+            prev_last = last + self.ts_offsets[k]
+            for j in range(k + 1, len(self.files)):
+                self.ts_offsets[j] = self.ts_offsets[k]
+            pass
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for raw in self._raw: raw.close()
+
+    @property
+    def header(self):
+        '''(timestamp, data) of the header packet of the first file.'''
+        return self._raw[0].header
+
+    @property
+    def rate(self):
+        return self._raw[0].rate
+
+    @property
+    def freqs(self):
+        return self._raw[0].freqs
+
+    @property
+    def n_ch(self):
+        return self._raw[0].n_ch
+
+    @property
+    def duration(self):
+        '''Time span from the first to the last timestamp in seconds.'''
+        ts = self[[0, len(self) - 1]][0]
+        return (ts[1] - ts[0] + 1) / self.rate
+
+    @property
+    def start_time(self):
+        '''Absolute time of timestamp 0 (see `RawDataFile.start_time`).'''
+        return self._raw[0].start_time
+
+    def locate(self, sample):
+        '''File index and data packet index in the file of a global sample index.'''
+        if not 0 <= sample < len(self):
+            raise IndexError(f'sample {sample} out of range')
+        k = int(np.searchsorted(self.starts, sample, side = 'right')) - 1
+        return k, int(sample - self.starts[k])
+
+    def _read(self, k, begin, end):
+        '''Decode data packets [begin, end) of the k-th file.'''
+        index = self._index[k]
+        n_rot, sync_off, position = index.seek(begin)
+        if np.searchsorted(index.sync_pos, position) == 0:
+            n_rot, sync_off = self._init_state[k]
+        stop = index.seek(end)[2] if end < index.n_data else index.n_packets
+        packets = self._raw[k].packets(slice(position - 1, stop - 1))
+        n_valid, error = check_packets(packets, (HEADER_DATA, HEADER_SGSYNC, HEADER_SYNC))
+        if error is not None:
+            raise PacketReaderError(f'error : TodDataset.{error}: {self.files[k]}', position + n_valid)
+        is_sync, n_rots, offs = forward_fill_sync(packets, n_rot, sync_off)
+        ts, data = _decode_iq(packets[~is_sync])
+        return ts + self.ts_offsets[k], data, n_rots[~is_sync], offs[~is_sync]
+
+    def read(self, begin = 0, end = None):
+        '''Decode the global samples [begin, end).
+
+        Returns
+        -------
+        ts : ndarray
+            Timestamps continued across the files.
+        data : ndarray
+            I/Q values (n x 2*n_ch).
+        n_rot, sync_off : ndarray
+            Rotation state of each sample.
+        '''
+        if end is None: end = len(self)
+        begin, end = max(0, begin), min(end, len(self))
+        parts = []
+        k0 = int(np.searchsorted(self.starts, begin, side = 'right')) - 1
+        for k in range(max(k0, 0), len(self.files)):
+            if self.starts[k] >= end: break
+            lo = max(begin, self.starts[k]) - self.starts[k]
+            hi = min(end, self.starts[k + 1]) - self.starts[k]
+            if hi > lo: parts.append(self._read(k, int(lo), int(hi)))
+            pass
+        if not parts:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, np.empty((0, 2 * self.n_ch), dtype=np.int64), empty, empty
+        return tuple(np.concatenate(col) for col in zip(*parts))
+
+    def __getitem__(self, key):
+        '''Decode samples selected by an index, a slice or an index array.
+        Returns (ts, data, n_rot, sync_off) like `read`.'''
+        if isinstance(key, slice):
+            begin, end, step = key.indices(len(self))
+            if step == 1: return self.read(begin, end)
+            key = np.arange(begin, end, step)
+        if np.ndim(key) == 0:
+            sample = int(key) + (len(self) if key < 0 else 0)
+            self.locate(sample)
+            ts, data, n_rot, sync_off = self.read(sample, sample + 1)
+            return int(ts[0]), data[0], int(n_rot[0]), int(sync_off[0])
+        key = np.asarray(key)
+        key = np.where(key < 0, key + len(self), key)
+        if len(key) and (key.min() < 0 or key.max() >= len(self)):
+            raise IndexError('sample out of range')
+        order = np.argsort(key, kind = 'stable')
+        parts = []
+        bounds = np.searchsorted(key[order], self.starts)
+        for k in range(len(self.files)):
+            sel = key[order][bounds[k]:bounds[k + 1]]
+            if len(sel) == 0: continue
+            lo, hi = int(sel[0]), int(sel[-1]) + 1
+            ts, data, n_rot, sync_off = self._read(k, lo - int(self.starts[k]), hi - int(self.starts[k]))
+            sel = sel - lo
+            parts.append((ts[sel], data[sel], n_rot[sel], sync_off[sel]))
+            pass
+        if not parts: return self.read(0, 0)
+        ts, data, n_rot, sync_off = (np.concatenate(col) for col in zip(*parts))
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        return ts[inverse], data[inverse], n_rot[inverse], sync_off[inverse]
+
+    def iter_chunks(self, chunk_packets = CHUNK_PACKETS, begin = 0, end = None):
+        '''Iterate over the samples in blocks of `chunk_packets` (across file boundaries).
+
+        Yields
+        ------
+        start : int
+            Global sample index of the first sample of the chunk.
+        ts, data, n_rot, sync_off : ndarray
+            Same as `read`.
+        '''
+        if end is None: end = len(self)
+        for start in range(begin, end, chunk_packets):
+            yield (start,) + self.read(start, min(start + chunk_packets, end))
+            pass
+
+    def search_time(self, t):
+        '''First global sample whose timestamp / rate is >= `t` (seconds or datetime).'''
+        if isinstance(t, datetime):
+            t = (t - self.start_time).total_seconds()
+        tick = int(np.ceil(t * self.rate))
+        for k, raw in enumerate(self._raw):
+            n_data = self._index[k].n_data
+            if n_data == 0: continue
+            last = int(self._read(k, n_data - 1, n_data)[0][0])
+            if last < tick: continue
+            position = raw.search_timestamp(tick - int(self.ts_offsets[k]))
+            n_sync = int(np.searchsorted(self._index[k].sync_pos, position + 1))
+            return int(self.starts[k]) + position - n_sync
+        return len(self)
+
+    def time_window(self, t_start = None, t_stop = None):
+        '''Decode the samples with t_start <= timestamp / rate < t_stop.'''
+        begin = 0 if t_start is None else self.search_time(t_start)
+        end = len(self) if t_stop is None else self.search_time(t_stop)
+        return self.read(begin, max(begin, end))
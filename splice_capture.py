@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+'''Zero-copy capture of the TCP data stream to a file.
+
+The bytes are moved from the socket to a pipe and from the pipe to the file
+with os.splice, so they stay in the kernel. Python only counts bytes, checks
+the packet alignment at the chunk boundaries (by reading back one packet
+from the file) and decides when to stop. For recording runs without live
+processing; requires Linux and Python 3.10 or later.
+
+Example
+-------
+    capture = SpliceCapture(fpga.tcp, fname, length=psize * data_length,
+                            packet_size=psize, header=header_packet)
+    fpga.iq_setting.iq_on()
+    capture.run()
+'''
+import os
+import select
+from time import perf_counter, process_time
+
+from tcp import TCP_N_TRY, TCP_TIMEOUT
+from packet_reader import HEADER_DATA, HEADER_SGSYNC, HEADER_SYNC, FOOTER
+
+SPLICE_PIPE_SIZE = 2**20 # bytes
+F_SETPIPE_SZ = 1031      # fcntl command (Linux)
+F_GETPIPE_SZ = 1032
+
+
+class SpliceError(Exception):
+    '''Raised when the splice capture is not available or fails.'''
+
+
+class SpliceCapture:
+    '''Socket-to-file capture with os.splice.
+
+    Parameters
+    ----------
+    tcp : tcp.TCP
+        Data stream. Bytes already buffered by `tcp` are written first.
+    fname : str
+        Output file name (overwritten).
+    length : int
+        Number of bytes to be captured (after the header).
+    packet_size : int
+        Packet length in bytes.
+    header : bytes
+        Written at the beginning of the file.
+    progress : callable, optional
+        Called with the number of bytes captured so far.
+    fsync : bool
+        fsync the file on close.
+
+    Attributes
+    ----------
+    n_written : int
+        Bytes captured (without the header).
+    n_splice : int
+        Number of splice calls.
+    n_misaligned : int
+        Chunk boundaries where the last packet was not a valid packet.
+    misaligned_offset : int or None
+        File offset of the first misaligned packet found.
+    '''
+    def __init__(self, tcp, fname, length, packet_size, header=b'', progress=None, fsync=True):
+        if not hasattr(os, 'splice'):
+            raise SpliceError('splice: os.splice is not available')
+        self.tcp = tcp
+        self.fname = fname
+        self.length = length
+        self.packet_size = packet_size
+        self.header = bytes(header)
+        self.progress = progress
+        self.fsync = fsync
+        self._stop = False
+
+        self.n_written = 0
+        self.n_splice = 0
+        self.n_misaligned = 0
+        self.misaligned_offset = None
+        self.elapsed = 0.
+        self.cpu_time = 0.
+
+    def stop(self):
+        '''Stop after the current chunk (e.g. from a signal handler).'''
+        self._stop = True
+
+    def _check(self, fd):
+        '''Read back the last complete packet written to the file.'''
+        n_packets = self.n_written // self.packet_size
+        if n_packets == 0: return
+        offset = len(self.header) + (n_packets - 1) * self.packet_size
+        packet = os.pread(fd, self.packet_size, offset)
+        if (len(packet) == self.packet_size and packet[-1] == FOOTER and
+                packet[0] in (HEADER_DATA, HEADER_SGSYNC, HEADER_SYNC)):
+            return
+        self.n_misaligned += 1
+        if self.misaligned_offset is None:
+            self.misaligned_offset = offset
+
+    def _wait(self, poller):
+        '''Wait until the socket is readable; False after TCP_N_TRY timeouts.'''
+        for _ in range(TCP_N_TRY):
+            if self._stop: return False
+            if poller.poll(TCP_TIMEOUT * 1000): return True
+        print('splice: receive timeout')
+        return False
+
+    def _drain(self, pipe_r, fd, n_bytes):
+        while n_bytes > 0:
+            n_moved = os.splice(pipe_r, fd, n_bytes)
+            self.n_splice += 1
+            n_bytes -= n_moved
+
+    def _capture(self, fd):
+        pipe_r, pipe_w = os.pipe()
+        try:
+            try:
+                import fcntl
+                fcntl.fcntl(pipe_w, F_SETPIPE_SZ, SPLICE_PIPE_SIZE)
+                pipe_size = fcntl.fcntl(pipe_w, F_GETPIPE_SZ)
+            except OSError:
+                pipe_size = 2**16
+            sock = self.tcp.sock.fileno()
+            poller = select.poll()
+            poller.register(sock, select.POLLIN)
+
+            while self.n_written < self.length:
+                if not self._wait(poller): break
+                try:
+                    n_moved = os.splice(sock, pipe_w, min(pipe_size, self.length - self.n_written),
+                                        flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+                except BlockingIOError:
+                    continue
+                self.n_splice += 1
+                if n_moved == 0:
+                    print('splice: connection closed')
+                    break
+                self._drain(pipe_r, fd, n_moved)
+                self.n_written += n_moved
+                self._check(fd)
+                if self.progress is not None:
+                    self.progress(self.n_written)
+                pass
+        finally:
+            os.close(pipe_r)
+            os.close(pipe_w)
+
+    def run(self):
+        '''Capture until `length` bytes are written, the stream pauses or `stop`.
+        The file is cut at the last packet boundary; on KeyboardInterrupt it is
+        closed before re-raising.'''
+        start, cpu_start = perf_counter(), process_time()
+        flags = os.O_RDWR | os.O_CREAT | os.O_TRUNC # read back for the alignment check
+        fd = os.open(self.fname, flags, 0o644)
+        try:
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(fd, 0, len(self.header) + self.length)
+                except OSError:
+                    pass
+            os.write(fd, self.header)
+            buffered = self.tcp.read(min(self.tcp.n_buffered, self.length))
+            os.write(fd, buffered)
+            self.n_written = len(buffered)
+            self._capture(fd)
+        finally:
+            self.n_written -= self.n_written % self.packet_size
+            os.ftruncate(fd, len(self.header) + self.n_written)
+            self._check(fd)
+            if self.fsync:
+                os.fsync(fd)
+            os.close(fd)
+            self.elapsed = perf_counter() - start
+            self.cpu_time = process_time() - cpu_start
+        return self
+
+    def report(self):
+        '''Summary of the throughput, CPU time and alignment.'''
+        rate = self.n_written / self.elapsed / 1e6 if self.elapsed > 0 else 0.
+        ret = (f'{self.n_written} bytes in {self.elapsed:.2f} s ({rate:.2f} MB/s), '
+               f'{self.n_splice} splices, cpu {self.cpu_time:.3f} s')
+        if self.n_misaligned:
+            ret += (f', misaligned at {self.n_misaligned} boundaries '
+                    f'(first at byte {self.misaligned_offset})')
+        return ret
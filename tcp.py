@@ -7,6 +7,7 @@ from rhea_pkg import IP_ADDRESS_DEFAULT, TCP_PORT_DEFAULT
 TCP_N_TRY = 10
 TCP_BUFFSIZE = 2**18
 TCP_TIMEOUT = 0.1
+TCP_RING_SIZE = 2**24
 
 
 class TCPError(Exception):
@@ -14,43 +15,85 @@ class TCPError(Exception):
 
 
 class TCP:
-    '''TCP communication handler.'''
-    def __init__(self, ip_address=IP_ADDRESS_DEFAULT, port_num=TCP_PORT_DEFAULT):
+    '''TCP communication handler.
+
+    Received bytes are stored in a preallocated ring buffer with
+    `socket.recv_into`; `read_into` and `read_packets` hand them over without
+    building intermediate bytes objects.
+
+    Parameters
+    ----------
+    ip_address : str
+        IP address.
+    port_num : int
+        Port number.
+    ring_size : int
+        Size of the receive buffer in bytes.
+    '''
+    def __init__(self, ip_address=IP_ADDRESS_DEFAULT, port_num=TCP_PORT_DEFAULT,
+                 ring_size=TCP_RING_SIZE):
         self.error_try_count = TCP_N_TRY
         self.buff_size = TCP_BUFFSIZE
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((ip_address, port_num))
         self.sock.settimeout(TCP_TIMEOUT)
-        self.read_buff = b''
+        self._ring = bytearray(max(ring_size, self.buff_size))
+        self._view = memoryview(self._ring)
+        self._head = 0
+        self._tail = 0
+
+    @property
+    def n_buffered(self):
+        '''Number of received bytes not read yet.'''
+        return self._tail - self._head
+
+    def __recv_into(self, view):
+        '''Receive once into `view`. Returns 0 on timeout.'''
+        try:
+            n_recv = self.sock.recv_into(view)
+        except socket.timeout:
+            return 0
+        if n_recv == 0:
+            raise TCPError('tcp.__recv_into: connection closed')
+        return n_recv
 
     def __pull(self, length):
+        '''Wait until `length` bytes (<= ring size) are buffered.'''
+        if self._tail + length - self.n_buffered > len(self._ring):
+            # move the unread bytes to the beginning of the ring
+            n_buffered = self.n_buffered
+            self._view[:n_buffered] = self._view[self._head:self._tail]
+            self._head, self._tail = 0, n_buffered
+
         error_cnt = 0
-        tmplen = min(length, self.buff_size)
-        while error_cnt < self.error_try_count:
-            if len(self.read_buff) >= length:
-                break
+        while self.n_buffered < length:
+            if error_cnt >= self.error_try_count:
+                raise TCPError('tcp.__pull: receive error')
             error_cnt += 1
-            try:
-                self.read_buff += self.sock.recv(tmplen)
+            n_recv = self.__recv_into(self._view[self._tail:])
+            if n_recv:
+                self._tail += n_recv
                 error_cnt = 0
-            except socket.timeout:
-                pass
+            pass
 
-        if error_cnt >= self.error_try_count:
-            raise TCPError('tcp.__pull: receive error')
-        buff = self.read_buff[0:length]
-        self.read_buff = self.read_buff[length:]
-        return buff
+    def __take(self, length):
+        view = self._view[self._head:self._head + length]
+        self._head += length
+        if self._head == self._tail:
+            self._head = self._tail = 0
+        return view
 
     def clear(self):
         '''Clear the TCP buffer.'''
+        self._head = self._tail = 0
         try:
             while True:
-                self.__pull(self.buff_size)
+                self.__pull(len(self._ring))
+                self._head = self._tail = 0
         except TCPError:
             pass
-        self.read_buff = b''
+        self._head = self._tail = 0
 
     def read(self, length=1):
         '''Read TCP stream.
@@ -65,38 +108,118 @@ class TCP:
         data : bytes
             Data bytes.
         '''
+        if length > len(self._ring):
+            buff = bytearray(length)
+            return bytes(buff[:self.read_into(buff)])
         try:
-            buff = self.__pull(length)
+            self.__pull(length)
+            buff = bytes(self.__take(length))
         except TCPError as err:
             print(err)
-            buff = self.read_buff
-            self.read_buff = b''
+            buff = bytes(self.__take(self.n_buffered))
         except TypeError as err:
             print(err)
-            buff = self.read_buff
-            self.read_buff = b''
+            buff = bytes(self.__take(self.n_buffered))
 
         return buff
 
+    def read_into(self, buffer):
+        '''Fill a writable buffer with the TCP stream.
+        The bytes are received directly into `buffer` once the ring buffer is empty.
+
+        Parameter
+        ---------
+        buffer : bytearray, memoryview or ndarray
+            Destination.
+
+        Returns
+        -------
+        length : int
+            Number of bytes written (less than len(buffer) on receive error).
+        '''
+        view = memoryview(buffer).cast('B')
+        length = min(len(view), self.n_buffered)
+        view[:length] = self.__take(length)
+
+        error_cnt = 0
+        try:
+            while length < len(view):
+                if error_cnt >= self.error_try_count:
+                    raise TCPError('tcp.read_into: receive error')
+                error_cnt += 1
+                n_recv = self.__recv_into(view[length:])
+                if n_recv:
+                    length += n_recv
+                    error_cnt = 0
+                pass
+        except TCPError as err:
+            print(err)
+        return length
+
+    def read_packets(self, n_packets, packet_size):
+        '''Read whole packets.
+
+        Parameters
+        ----------
+        n_packets : int
+            Number of packets.
+        packet_size : int
+            Packet length in bytes.
+
+        Returns
+        -------
+        data : memoryview
+            View of the ring buffer holding the packets (fewer packets on
+            receive error). It is valid until the next read.
+        '''
+        length = n_packets * packet_size
+        if length > len(self._ring):
+            raise TCPError(f'tcp.read_packets: {length} bytes exceed the buffer')
+        try:
+            self.__pull(length)
+        except TCPError as err:
+            print(err)
+            length = self.n_buffered - self.n_buffered % packet_size
+        return self.__take(length)
+
     def send(self, data):
         '''Write data.'''
         self.sock.send(data)
 
 
-def main():
-    '''Main function.'''
+def _request(length):
     client = TCP(ip_address='127.0.0.1', port_num=32409)
+    client.send(bytes(f'{length}', encoding='utf8'))
+    return client
+
 
+def main():
+    '''Throughput benchmark against dummy_server.py.'''
     test_length = 10_000_000
-    lenbytes = bytes(f'{test_length}', encoding='utf8')
+    packet_size = 7 + 14 * 8
+
+    def _report(name, length, start, stop):
+        print(f'{name:13s} length: {length}, time: {stop - start:.4f} s, '
+              f'speed: {length*8/(stop - start)/1e6:.1f} Mbps')
 
-    client.send(lenbytes)
+    client = _request(test_length)
     start = perf_counter()
     data = client.read(test_length)
-    stop = perf_counter()
-    print(f'Length: {len(data)}.')
-    print(f'Time: {stop - start} s.')
-    print(f'Speed: {len(data)*8/(stop - start)/1e6} Mbps')
+    _report('read', len(data), start, perf_counter())
+
+    client = _request(test_length)
+    buff = bytearray(test_length)
+    start = perf_counter()
+    length = client.read_into(buff)
+    _report('read_into', length, start, perf_counter())
+
+    client = _request(test_length)
+    n_packets = 2**12
+    length = 0
+    start = perf_counter()
+    while length + n_packets * packet_size <= test_length:
+        length += len(client.read_packets(n_packets, packet_size))
+    _report('read_packets', length, start, perf_counter())
 
 
 if __name__ == '__main__':